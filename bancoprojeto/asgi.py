@@ -14,3 +14,8 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'bancoprojeto.settings')
 
 application = get_asgi_application()
+
+# Aquecimento so no servidor, nao em cada comando do manage.py (contas/aquecimento.py)
+from contas.aquecimento import aquecer  # noqa: E402
+
+aquecer()
@@ -41,10 +41,16 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # Primeiro da pilha para medir a requisicao inteira; so atua com PERFIL_REQUISICOES['ATIVO']
+    'contas.perfil.PerfilMiddleware',
+    'contas.roteador.RoteamentoMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
+    # 429 antes da view nas URLs de LIMITE_REQUISICOES['REGRAS']; depois do CSRF,
+    # para que um POST recusado por ele nao gaste as fichas da conta
+    'contas.limites.LimiteRequisicoesMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
@@ -54,7 +60,9 @@ ROOT_URLCONF = 'bancoprojeto.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # DjangoTemplates que mede o tempo de template do perfil (contas/perfil.py)
+        'BACKEND': 'contas.perfil.TemplatesMedidos',
+        'NAME': 'django',
         'DIRS': [],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -78,7 +86,124 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
-    }
+        'OPTIONS': {
+            # O SQLite ignora SELECT ... FOR UPDATE; BEGIN IMMEDIATE reserva a escrita
+            # no inicio do atomic() e serializa as movimentacoes de saldo.
+            # A espera pela reserva e o busy_timeout de SQLITE_PRAGMAS.
+            'transaction_mode': 'IMMEDIATE',
+        },
+        'TEST': {
+            # Banco em arquivo: o banco em memoria compartilhado entre threads
+            # falha com "database table is locked" nos testes de concorrencia.
+            'NAME': BASE_DIR / 'test_db.sqlite3',
+        },
+        # Conexao persistente por thread, verificada antes de ser reaproveitada.
+        # No PostgreSQL use tambem OPTIONS['pool'] (psycopg 3) com CONN_MAX_AGE = 0.
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+    },
+    # Replica de leitura (contas/roteador.py). Por padrao e o proprio arquivo do
+    # primario aberto em outra conexao, somente leitura; para testar com dois
+    # arquivos aponte NAME para BASE_DIR / 'db_replica.sqlite3' e copie o
+    # primario com "manage.py sincronizar_replica" (o intervalo simula o atraso).
+    'replica': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'db.sqlite3',
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+        'TEST': {
+            'MIRROR': 'default',
+        },
+    },
+    # Segundo shard de contas (contas/shards.py). So recebe dados depois de entrar
+    # em SHARDING['SHARDS'] e de "manage.py preparar_shard shard1".
+    'shard1': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'db_shard1.sqlite3',
+        'OPTIONS': {
+            'transaction_mode': 'IMMEDIATE',
+        },
+        'TEST': {
+            'NAME': BASE_DIR / 'test_db_shard1.sqlite3',
+        },
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+    },
+}
+
+DATABASE_ROUTERS = ['contas.roteador.RoteadorLeituraEscrita']
+
+ROTEAMENTO_BANCO = {
+    'REPLICA': 'replica',
+    # Depois de escrever, o navegador le do primario por este tempo (atraso maximo da replica)
+    'FIXAR_PRIMARIO_SEGUNDOS': 5,
+}
+
+# Particionamento das contas por numero (contas/shards.py). O shard de indice i
+# guarda as contas de numero i * FAIXA_NUMEROS ate (i + 1) * FAIXA_NUMEROS - 1;
+# a ordem da lista nunca muda, so cresce. Contas novas sao distribuidas pelo CPF
+# entre NOVAS_CONTAS (padrao: todos os shards).
+SHARDING = {
+    'SHARDS': ['default'],
+    'FAIXA_NUMEROS': 100_000_000,
+    'NOVAS_CONTAS': None,
+}
+
+# Arquivamento de transacoes (contas/arquivamento.py): "manage.py arquivar_transacoes"
+# move para TransacaoArquivada as transacoes com mais de DIAS_QUENTES dias.
+ARQUIVAMENTO = {
+    'DIAS_QUENTES': 365,
+    'TAMANHO_LOTE': 2000,
+}
+
+# Fechamento do dia (contas/fechamento.py): "manage.py fechar_dia" depois da meia-noite
+# recompoe o limite usado com o saldo, cobra juros diarios sobre o limite que
+# continua usado e, no primeiro dia do mes, a tarifa mensal. Taxas em texto decimal.
+FECHAMENTO = {
+    'JUROS_LIMITE_DIA': '0.0033',
+    'TARIFA_MENSAL': '0.00',
+    'TAMANHO_BLOCO': 5000,
+}
+
+# Outbox de eventos de transacao (contas/outbox.py): "manage.py despachar_eventos"
+# entrega em lotes a cada destino (CLASSE com entregar(eventos) assincrono e
+# OPCOES do construtor). Cada destino tem o seu cursor; INTERVALO e a espera,
+# em segundos, quando nao ha eventos novos. Fora do SQLite, JANELA_COMMIT e a
+# idade minima, em segundos, de um evento entregue: ids concorrentes podem
+# commitar fora de ordem e o cursor nao pode passar por um ainda invisivel.
+OUTBOX = {
+    'DESTINOS': {
+        'arquivo': {
+            'CLASSE': 'contas.outbox.DestinoArquivo',
+            'OPCOES': {'caminho': BASE_DIR / 'eventos.jsonl'},
+        },
+    },
+    'TAMANHO_LOTE': 500,
+    'INTERVALO': 1.0,
+    'JANELA_COMMIT': 5.0,
+}
+
+
+# Pagamentos em lote (POST /lote/, contas/lote.py): cada linha debita a conta de
+# origem informada, entao so sao aceitos o sistema de folha integrado, com
+# "Authorization: Bearer <token>" de um dos TOKENS, ou um usuario staff logado.
+# Em producao os tokens vem de LOTE_PAGAMENTOS_TOKENS (bancoprojeto/settings_producao.py).
+LOTE_PAGAMENTOS = {
+    'TOKENS': [],
+}
+
+
+# Perfil de producao do SQLite, aplicado a cada conexao (contas/signals.py).
+# WAL: leitores nao bloqueiam o escritor e o commit nao espera fsync do banco
+# inteiro; com synchronous=NORMAL o fsync so ocorre no checkpoint do WAL (uma
+# queda de energia pode perder os ultimos commits, nunca corromper o banco).
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 20000,  # ms esperando a reserva de escrita antes de "database is locked"
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -20000,  # em KiB (20 MB por conexao)
+    'temp_store': 'MEMORY',
 }
 
 
@@ -123,3 +248,97 @@ STATICFILES_DIRS = [BASE_DIR / 'static']
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# Cache de resolucao de chaves PIX (contas/cache_pix.py)
+# TTL e o tempo maximo, em segundos, que outro processo pode enxergar uma chave
+# ja alterada; CACHE_DJANGO e o alias em CACHES compartilhado entre processos.
+PIX_CACHE = {
+    'TAMANHO_MAXIMO': 10000,
+    'TTL': 30,
+    'CACHE_DJANGO': None,
+    'TTL_COMPARTILHADO': 300,
+}
+
+# Regras de velocidade do PIX (contas/antifraude.py), avaliadas em memoria a cada PIX.
+# Limites 0 desligam a regra; CACHE_DJANGO (alias em CACHES) divide as janelas
+# entre processos. "manage.py reproduzir_antifraude" pontua o historico com as regras.
+# Os pagamentos em lote (contas/lote.py) nao passam por elas.
+ANTIFRAUDE = {
+    'ATIVO': True,
+    'REGRAS': {
+        'PIX_POR_MINUTO': 10,
+        'PIX_POR_HORA': 60,
+        'VALOR_POR_MINUTO': '5000.00',
+        'VALOR_POR_HORA': '20000.00',
+        'NOVOS_DESTINOS_POR_HORA': 10,
+        'NOTURNO_INICIO': 20,
+        'NOTURNO_FIM': 6,
+        'NOTURNO_VALOR_MAXIMO': '1000.00',
+    },
+    'TAMANHO_MAXIMO': 100000,
+    'CACHE_DJANGO': None,
+}
+
+# Limite de requisicoes (contas/limites.py) por nome de URL, com um balde por conta
+# (pk da URL) e outro por IP: 'N/periodo' permite rajadas de N e N por periodo
+# (s, m, h). CACHE_DJANGO (alias em CACHES) divide os baldes entre processos;
+# atras de um proxy reverso confiavel use CABECALHO_IP = 'HTTP_X_FORWARDED_FOR'.
+LIMITE_REQUISICOES = {
+    'ATIVO': True,
+    'METODOS': ['POST'],
+    'REGRAS': {
+        **{
+            nome: {'POR_CONTA': '30/m', 'POR_IP': '120/m'}
+            for nome in (
+                'efetuar_deposito', 'efetuar_saque', 'efetuar_transferencia', 'efetuar_pix',
+                'api_deposito', 'api_saque', 'api_transferencia', 'api_pix',
+            )
+        },
+        **{nome: {'POR_CONTA': '10/m', 'POR_IP': '30/m'} for nome in ('cadastrar_chave_pix', 'api_chaves')},
+    },
+    'TAMANHO_MAXIMO': 100000,
+    'CACHE_DJANGO': None,
+    'CABECALHO_IP': None,
+}
+
+# Caches do Django. O locmem e de cada processo: com varios processos (gunicorn,
+# uwsgi) use um cache compartilhado (Redis, Memcached), senao a invalidacao dos
+# trechos feita em um processo nao chega aos outros.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'OPTIONS': {'MAX_ENTRIES': 20000},
+    },
+}
+
+# Trechos das paginas de conta em cache (contas/fragmentos.py), com a versao da
+# conta na chave; as escritas trocam a versao depois do commit. CACHE_DJANGO e o
+# alias em CACHES e TTL, em segundos, o tempo de vida de cada trecho.
+FRAGMENTOS = {
+    'ATIVO': True,
+    'CACHE_DJANGO': 'default',
+    'TTL': 600,
+}
+
+# Aquecimento de cada processo ao carregar bancoprojeto.wsgi ou asgi (contas/aquecimento.py),
+# antes da primeira requisicao; ligado no perfil de producao (bancoprojeto/settings_producao.py).
+# "manage.py perfil_partida" mede a importacao por modulo e cada etapa.
+AQUECIMENTO = {
+    'ATIVO': False,
+    # Importa as views pelo URLconf e monta as tabelas de resolve/reverse
+    'URLS': True,
+    # Prefixos dos nomes de template compilados no loader em cache
+    'TEMPLATES': ['contas/'],
+    # Conexoes com os shards e a replica; desligue com gunicorn --preload (abriria antes do fork)
+    'CONEXOES': True,
+}
+
+# Perfil de requisicoes (contas/perfil.py): metricas em /metricas/prometheus/
+PERFIL_REQUISICOES = {
+    'ATIVO': False,
+    # Fracao das requisicoes executadas sob o cProfile (0 desliga)
+    'AMOSTRAGEM_CPROFILE': 0.0,
+    # Perfis amostrados mais lentos que o limite sao gravados no diretorio
+    'LIMITE_CPROFILE_MS': 500,
+    'DIRETORIO_CPROFILE': BASE_DIR / 'perfis',
+}
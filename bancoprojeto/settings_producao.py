@@ -0,0 +1,60 @@
+"""
+Perfil de producao do bancoprojeto: as settings de desenvolvimento mais o que
+muda no servidor.
+
+    DJANGO_SETTINGS_MODULE=bancoprojeto.settings_producao
+    DJANGO_SECRET_KEY=... DJANGO_ALLOWED_HOSTS=banco.exemplo.com LOTE_PAGAMENTOS_TOKENS=...
+
+O deploy roda "manage.py collectstatic --noinput" neste perfil. Ele grava em
+STATIC_ROOT os arquivos com hash no nome e as versoes .gz e .br (contas/estaticos.py).
+"""
+import os
+from pathlib import Path
+
+from django.core.exceptions import ImproperlyConfigured
+
+from .settings import *  # noqa: F401,F403
+from .settings import AQUECIMENTO, BASE_DIR, MIDDLEWARE, TEMPLATES
+
+DEBUG = False
+
+# Sem fallback para a chave de desenvolvimento, que esta no repositorio
+SECRET_KEY = os.environ.get('DJANGO_SECRET_KEY')
+if not SECRET_KEY:
+    raise ImproperlyConfigured('Defina DJANGO_SECRET_KEY no ambiente para usar o perfil de producao.')
+ALLOWED_HOSTS = os.environ.get('DJANGO_ALLOWED_HOSTS', 'localhost').split(',')
+
+# Loader em cache explicito e sem APP_DIRS: os templates sao compilados uma vez por
+# processo, no aquecimento (AQUECIMENTO), e nunca relidos do disco
+TEMPLATES = [
+    {
+        **TEMPLATES[0],
+        'APP_DIRS': False,
+        'OPTIONS': {
+            **TEMPLATES[0]['OPTIONS'],
+            'loaders': [
+                ('django.template.loaders.cached.Loader', [
+                    'django.template.loaders.filesystem.Loader',
+                    'django.template.loaders.app_directories.Loader',
+                ]),
+            ],
+        },
+    },
+]
+
+AQUECIMENTO = {**AQUECIMENTO, 'ATIVO': True}
+
+# Estaticos com hash no nome, pre-comprimidos e servidos com cache de um ano
+STATIC_ROOT = Path(os.environ.get('DJANGO_STATIC_ROOT', BASE_DIR / 'staticfiles'))
+STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'contas.estaticos.ArmazenamentoEstatico'},
+}
+# Antes de todo o resto: um arquivo estatico nao passa por perfil, roteamento nem sessao
+MIDDLEWARE = ['contas.estaticos.EstaticosMiddleware', *MIDDLEWARE]
+
+# Tokens do sistema de folha que envia os lotes de pagamento, separados por virgula.
+# Opcional: sem nenhum, o POST /lote/ aceita so usuarios staff logados
+LOTE_PAGAMENTOS = {
+    'TOKENS': [token for token in os.environ.get('LOTE_PAGAMENTOS_TOKENS', '').split(',') if token],
+}
@@ -1,9 +1,19 @@
 from django.contrib import admin
-from .models import Cliente, Conta, Transacao, ChavePix
+from .models import Cliente, Conta, Transacao, ChavePix, Idempotencia, Lancamento
+from .roteador import somente_leitura
+
+
+class ConsultaNaReplicaAdmin(admin.ModelAdmin):
+    """Listagens (GET) leem da replica; acoes em massa e edicoes ficam no primario"""
+
+    def changelist_view(self, request, extra_context=None):
+        if request.method == 'GET':
+            return somente_leitura(super().changelist_view)(request, extra_context)
+        return super().changelist_view(request, extra_context)
 
 
 @admin.register(Cliente)
-class ClienteAdmin(admin.ModelAdmin):
+class ClienteAdmin(ConsultaNaReplicaAdmin):
     """Administração de clientes"""
     list_display = ['codigo', 'nome', 'email', 'cpf', 'data_cadastro']
     list_filter = ['data_cadastro']
@@ -13,12 +23,13 @@ class ClienteAdmin(admin.ModelAdmin):
 
 
 @admin.register(Conta)
-class ContaAdmin(admin.ModelAdmin):
+class ContaAdmin(ConsultaNaReplicaAdmin):
     """Administração de contas"""
     list_display = ['numero', 'get_cliente_nome', 'saldo', 'limite', 'saldo_total', 'data_abertura']
+    list_select_related = ['cliente']
     list_filter = ['data_abertura']
     search_fields = ['numero', 'cliente__nome', 'cliente__cpf']
-    readonly_fields = ['numero', 'data_abertura', 'saldo_total']
+    readonly_fields = ['numero', 'saldo', 'limite_contratado', 'data_abertura', 'saldo_total']
     ordering = ['numero']
 
     def get_cliente_nome(self, obj):
@@ -26,11 +37,22 @@ class ContaAdmin(admin.ModelAdmin):
     get_cliente_nome.short_description = 'Cliente'
     get_cliente_nome.admin_order_field = 'cliente__nome'
 
+    def save_model(self, request, obj, form, change):
+        if not change:
+            super().save_model(request, obj, form, change)
+            return
+
+        # Saldo e limite sao projecoes do razao: nao regravar a linha inteira
+        obj.save(update_fields=['cliente'])
+        if 'limite' in form.changed_data:
+            obj.ajustar_limite(form.cleaned_data['limite'])
+
 
 @admin.register(Transacao)
-class TransacaoAdmin(admin.ModelAdmin):
+class TransacaoAdmin(ConsultaNaReplicaAdmin):
     """Administração de transações"""
     list_display = ['id', 'conta', 'tipo', 'valor', 'conta_destino', 'data_hora']
+    list_select_related = ['conta__cliente', 'conta_destino__cliente']
     list_filter = ['tipo', 'data_hora']
     search_fields = ['conta__numero', 'conta__cliente__nome']
     readonly_fields = ['data_hora']
@@ -46,16 +68,17 @@ class TransacaoAdmin(admin.ModelAdmin):
 
 
 @admin.register(ChavePix)
-class ChavePixAdmin(admin.ModelAdmin):
+class ChavePixAdmin(ConsultaNaReplicaAdmin):
     """Administracao de chaves PIX"""
     list_display = ['id', 'get_conta_numero', 'get_cliente_nome', 'tipo_chave', 'chave', 'ativa', 'data_criacao']
+    list_select_related = ['conta__cliente']
     list_filter = ['tipo_chave', 'ativa', 'data_criacao']
     search_fields = ['chave', 'conta__numero', 'conta__cliente__nome']
     readonly_fields = ['data_criacao']
     ordering = ['-data_criacao']
 
     def get_conta_numero(self, obj):
-        return obj.conta.numero
+        return obj.conta_id
     get_conta_numero.short_description = 'Conta'
     get_conta_numero.admin_order_field = 'conta__numero'
 
@@ -63,3 +86,39 @@ class ChavePixAdmin(admin.ModelAdmin):
         return obj.conta.cliente.nome
     get_cliente_nome.short_description = 'Cliente'
     get_cliente_nome.admin_order_field = 'conta__cliente__nome'
+
+
+@admin.register(Lancamento)
+class LancamentoAdmin(ConsultaNaReplicaAdmin):
+    """Consulta do razao (somente leitura)"""
+    list_display = ['id', 'movimento', 'conta', 'rubrica', 'natureza', 'valor', 'transacao', 'data_hora']
+    list_select_related = ['conta__cliente', 'transacao']
+    list_filter = ['rubrica', 'natureza']
+    search_fields = ['conta__numero', 'movimento']
+    ordering = ['-id']
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        # O razao e imutavel
+        return False
+
+
+@admin.register(Idempotencia)
+class IdempotenciaAdmin(ConsultaNaReplicaAdmin):
+    """Consulta das chaves de idempotencia (somente leitura)"""
+    list_display = ['chave', 'conta', 'operacao', 'resultado', 'criada_em']
+    list_select_related = ['conta__cliente']
+    list_filter = ['operacao']
+    search_fields = ['chave', 'conta__numero']
+    ordering = ['-criada_em']
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
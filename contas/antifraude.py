@@ -0,0 +1,264 @@
+"""Pontuacao antifraude do PIX por velocidade, sem consultar o historico de Transacao.
+
+Cada conta tem uma janela compacta em memoria: um buffer circular com o
+instante, o valor em centavos e a marca de destino novo dos ultimos PIX
+aceitos. Ele guarda no maximo PIX_POR_HORA registros, entao a ultima hora
+inteira sempre cabe. Junto vai uma lista curta dos destinos ja pagos. Avaliar
+um PIX e percorrer esse buffer, alguns microssegundos. Cada regra vira uma
+razao uso/limite; a maior e a pontuacao, e acima de 1 o PIX e recusado.
+
+Com CACHE_DJANGO a janela de cada conta tambem fica no cache compartilhado e
+vale para todos os processos. A escrita e "ultima vence": dois PIX da mesma
+conta no mesmo instante em processos diferentes podem contar como um so.
+"""
+import heapq
+import threading
+import time
+from array import array
+from collections import OrderedDict, namedtuple
+from contextlib import contextmanager
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils import timezone
+
+Avaliacao = namedtuple('Avaliacao', ['aprovado', 'regra', 'pontuacao'])
+
+# Limites 0 desligam a regra; valores em texto decimal
+REGRAS_PADRAO = {
+    'PIX_POR_MINUTO': 10,
+    'PIX_POR_HORA': 60,
+    'VALOR_POR_MINUTO': '5000.00',
+    'VALOR_POR_HORA': '20000.00',
+    'NOVOS_DESTINOS_POR_HORA': 10,
+    # Das NOTURNO_INICIO ate NOTURNO_FIM horas (horario local) cada PIX vai ate NOTURNO_VALOR_MAXIMO
+    'NOTURNO_INICIO': 20,
+    'NOTURNO_FIM': 6,
+    'NOTURNO_VALOR_MAXIMO': '1000.00',
+}
+
+MENSAGENS = {
+    'PIX_POR_MINUTO': 'Muitos PIX em sequencia, aguarde alguns minutos!',
+    'PIX_POR_HORA': 'Limite de PIX por hora atingido!',
+    'VALOR_POR_MINUTO': 'Valor enviado por PIX em sequencia acima do limite, aguarde alguns minutos!',
+    'VALOR_POR_HORA': 'Valor enviado por PIX na ultima hora acima do limite!',
+    'NOVOS_DESTINOS_POR_HORA': 'Muitos PIX para destinos novos na ultima hora!',
+    'NOTURNO_VALOR_MAXIMO': 'Valor acima do limite noturno do PIX!',
+}
+
+DESTINOS_CONHECIDOS = 64
+MINUTO, HORA = 60, 3600
+
+
+def centavos(valor):
+    return int(Decimal(str(valor)) * 100)
+
+
+class JanelaConta:
+    """Ultimos PIX aceitos de uma conta em buffer circular, mais os destinos recentes"""
+
+    __slots__ = ('instantes', 'valores', 'novos', 'inicio', 'tamanho', 'destinos')
+
+    def __init__(self, capacidade):
+        self.instantes = array('q', [0]) * capacidade
+        self.valores = array('q', [0]) * capacidade
+        self.novos = bytearray(capacidade)
+        self.inicio = 0
+        self.tamanho = 0
+        # dict em ordem de insercao serve de LRU pequeno
+        self.destinos = {}
+
+    def __getstate__(self):
+        return tuple(getattr(self, campo) for campo in self.__slots__)
+
+    def __setstate__(self, estado):
+        for campo, valor in zip(self.__slots__, estado):
+            setattr(self, campo, valor)
+
+    def recentes(self, desde):
+        """(instante, centavos, destino novo) dos registros posteriores a desde, do mais novo para o mais antigo"""
+        capacidade = len(self.instantes)
+        for deslocamento in range(self.tamanho - 1, -1, -1):
+            posicao = (self.inicio + deslocamento) % capacidade
+            if self.instantes[posicao] <= desde:
+                return
+            yield self.instantes[posicao], self.valores[posicao], self.novos[posicao]
+
+    def acrescentar(self, instante, valor, destino):
+        capacidade = len(self.instantes)
+        if self.tamanho == capacidade:
+            posicao = self.inicio
+            self.inicio = (self.inicio + 1) % capacidade
+        else:
+            posicao = (self.inicio + self.tamanho) % capacidade
+            self.tamanho += 1
+        self.instantes[posicao] = instante
+        self.valores[posicao] = valor
+        self.novos[posicao] = destino not in self.destinos
+        self.destinos.pop(destino, None)
+        self.destinos[destino] = None
+        if len(self.destinos) > DESTINOS_CONHECIDOS:
+            del self.destinos[next(iter(self.destinos))]
+
+
+class MotorAntifraude:
+    """Avalia e registra os PIX de cada conta contra as regras de velocidade"""
+
+    def __init__(self, regras=None, ativo=True, tamanho_maximo=100_000, alias_cache=None, ttl_compartilhado=HORA):
+        regras = {**REGRAS_PADRAO, **(regras or {})}
+        self.pix_por_minuto = int(regras['PIX_POR_MINUTO'])
+        self.pix_por_hora = int(regras['PIX_POR_HORA'])
+        self.valor_por_minuto = centavos(regras['VALOR_POR_MINUTO'])
+        self.valor_por_hora = centavos(regras['VALOR_POR_HORA'])
+        self.novos_destinos_por_hora = int(regras['NOVOS_DESTINOS_POR_HORA'])
+        self.noturno = (int(regras['NOTURNO_INICIO']), int(regras['NOTURNO_FIM']))
+        self.noturno_valor_maximo = centavos(regras['NOTURNO_VALOR_MAXIMO'])
+        # Sem limite de quantidade por hora a janela guarda um PIX por segundo da hora
+        self.capacidade = self.pix_por_hora or HORA
+        self.ativo = ativo
+        self.tamanho_maximo = tamanho_maximo
+        self.alias_cache = alias_cache
+        self.ttl_compartilhado = ttl_compartilhado
+        self._janelas = OrderedDict()
+        self._trava = threading.Lock()
+
+    @classmethod
+    def de_settings(cls):
+        config = getattr(settings, 'ANTIFRAUDE', {})
+        return cls(
+            regras=config.get('REGRAS'),
+            ativo=config.get('ATIVO', True),
+            tamanho_maximo=config.get('TAMANHO_MAXIMO', 100_000),
+            alias_cache=config.get('CACHE_DJANGO'),
+        )
+
+    def avaliar(self, conta, destino, valor, momento=None):
+        """Avaliacao do PIX de valor da conta para o destino (numeros de conta), sem registra-lo"""
+        if not self.ativo:
+            return Avaliacao(True, '', 0.0)
+        momento = momento or timezone.now()
+        instante, valor = int(momento.timestamp()), centavos(valor)
+        janela = self._janela(conta)
+
+        with self._trava:
+            pix_minuto = pix_hora = 1
+            valor_minuto = valor_hora = valor
+            novos = int(janela is None or destino not in janela.destinos)
+            if janela is not None:
+                for registrado, centavos_registrados, novo in janela.recentes(instante - HORA):
+                    pix_hora += 1
+                    valor_hora += centavos_registrados
+                    novos += novo
+                    if registrado > instante - MINUTO:
+                        pix_minuto += 1
+                        valor_minuto += centavos_registrados
+
+        usos = [
+            ('PIX_POR_MINUTO', pix_minuto, self.pix_por_minuto),
+            ('PIX_POR_HORA', pix_hora, self.pix_por_hora),
+            ('VALOR_POR_MINUTO', valor_minuto, self.valor_por_minuto),
+            ('VALOR_POR_HORA', valor_hora, self.valor_por_hora),
+            ('NOVOS_DESTINOS_POR_HORA', novos, self.novos_destinos_por_hora),
+        ]
+        if self._noturno(momento):
+            usos.append(('NOTURNO_VALOR_MAXIMO', valor, self.noturno_valor_maximo))
+        regra, pontuacao = max(
+            ((regra, uso / limite) for regra, uso, limite in usos if limite), key=lambda item: item[1], default=('', 0.0)
+        )
+        if pontuacao > 1:
+            return Avaliacao(False, regra, round(pontuacao, 4))
+        return Avaliacao(True, '', round(pontuacao, 4))
+
+    def registrar(self, conta, destino, valor, momento=None):
+        """Conta um PIX efetuado nas janelas da conta"""
+        if not self.ativo:
+            return
+        momento = momento or timezone.now()
+        with self._trava:
+            janela = self._janela_local(conta)
+            if janela is None:
+                janela = self._janelas[conta] = JanelaConta(self.capacidade)
+            janela.acrescentar(int(momento.timestamp()), centavos(valor), destino)
+            while len(self._janelas) > self.tamanho_maximo:
+                self._janelas.popitem(last=False)
+        if self.alias_cache:
+            caches[self.alias_cache].set(self._chave_compartilhada(conta), janela, self.ttl_compartilhado)
+
+    @contextmanager
+    def desativado(self):
+        """Suspende as regras no bloco (cargas, benchmarks)"""
+        ativo, self.ativo = self.ativo, False
+        try:
+            yield
+        finally:
+            self.ativo = ativo
+
+    def limpar(self):
+        """Esvazia as janelas deste processo"""
+        with self._trava:
+            self._janelas.clear()
+
+    def _noturno(self, momento):
+        inicio, fim = self.noturno
+        hora = timezone.localtime(momento).hour
+        return inicio <= hora or hora < fim if inicio > fim else inicio <= hora < fim
+
+    def _janela(self, conta):
+        if self.alias_cache:
+            # O cache compartilhado tem a janela mais nova, escrita por qualquer processo
+            janela = caches[self.alias_cache].get(self._chave_compartilhada(conta))
+            if janela is not None and len(janela.instantes) == self.capacidade:
+                with self._trava:
+                    self._janelas[conta] = janela
+                    self._janelas.move_to_end(conta)
+        with self._trava:
+            return self._janela_local(conta)
+
+    def _janela_local(self, conta):
+        janela = self._janelas.get(conta)
+        if janela is not None:
+            self._janelas.move_to_end(conta)
+        return janela
+
+    def _chave_compartilhada(self, conta):
+        return f'antifraude:{conta}'
+
+
+motor_antifraude = MotorAntifraude.de_settings()
+
+
+def historico_pix(desde=None, ate=None):
+    """(conta, destino, valor, data_hora) dos PIX de todos os shards, em ordem de data_hora"""
+    from .models import Transacao
+    from .shards import shards
+
+    fluxos = []
+    for alias in shards():
+        pix = Transacao.objects.using(alias).filter(tipo='P')
+        if desde:
+            pix = pix.filter(data_hora__gte=desde)
+        if ate:
+            pix = pix.filter(data_hora__lt=ate)
+        pix = pix.order_by('data_hora', 'id').values_list('conta_id', 'conta_destino_id', 'valor', 'data_hora')
+        fluxos.append(pix.iterator(chunk_size=2000))
+    return heapq.merge(*fluxos, key=lambda item: item[3])
+
+
+def reproduzir(pix, motor=None):
+    """Pontua um historico de PIX (conta, destino, valor, data_hora) em ordem de data_hora.
+
+    Gera (pix, Avaliacao, segundos gastos na avaliacao); so os aprovados entram
+    nas janelas, como aconteceria com as regras ativas. Por padrao usa um motor
+    novo com as regras de settings e sem cache compartilhado.
+    """
+    if motor is None:
+        config = getattr(settings, 'ANTIFRAUDE', {})
+        motor = MotorAntifraude(regras=config.get('REGRAS'), tamanho_maximo=config.get('TAMANHO_MAXIMO', 100_000))
+    for item in pix:
+        conta, destino, valor, momento = item
+        inicio = time.perf_counter()
+        avaliacao = motor.avaliar(conta, destino, valor, momento)
+        if avaliacao.aprovado:
+            motor.registrar(conta, destino, valor, momento)
+        yield item, avaliacao, time.perf_counter() - inicio
@@ -0,0 +1,251 @@
+"""API JSON das contas para o aplicativo movel.
+
+As leituras sao views assincronas (servidas por bancoprojeto/asgi.py): enquanto
+esperam o banco ou um cliente lento, liberam o worker para outras conexoes. As
+operacoes com dinheiro usam os mesmos metodos de Conta das telas HTML.
+"""
+import json
+from decimal import Decimal, InvalidOperation
+
+from asgiref.sync import sync_to_async
+from django.http import Http404, JsonResponse
+from django.shortcuts import get_object_or_404
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
+
+from .extrato import decodificar_cursor, pagina_extrato
+from .forms import ChavePixForm
+from .models import MENSAGEM_VALOR_INVALIDO, VALOR_MAXIMO, ChavePix, Conta, Idempotencia
+from .roteador import somente_leitura
+from .shards import no_shard_da_conta
+
+
+class DadosInvalidos(Exception):
+    """Requisicao com corpo ou campos invalidos (resposta 400)"""
+
+
+def _json_conta(conta):
+    return {
+        'numero': conta.numero,
+        'cliente': {
+            'codigo': conta.cliente.codigo,
+            'nome': conta.cliente.nome,
+            'email': conta.cliente.email,
+            'cpf': conta.cliente.cpf,
+        },
+        'saldo': conta.saldo,
+        'limite': conta.limite,
+        'saldo_total': conta.saldo_total,
+        'data_abertura': conta.data_abertura,
+    }
+
+
+def _json_transacao(transacao, conta):
+    return {
+        'id': transacao.pk,
+        'tipo': transacao.tipo,
+        'tipo_descricao': transacao.get_tipo_display(),
+        'valor': transacao.valor,
+        'entrada': transacao.conta_id != conta.numero or transacao.tipo in ('D', 'E'),
+        'conta': transacao.conta_id,
+        'conta_destino': transacao.conta_destino_id,
+        'chave_pix': transacao.chave_pix,
+        'descricao': transacao.descricao,
+        'data_hora': transacao.data_hora,
+    }
+
+
+def _json_chave(chave):
+    return {
+        'id': chave.pk,
+        'tipo_chave': chave.tipo_chave,
+        'chave': chave.chave,
+        'ativa': chave.ativa,
+        'data_criacao': chave.data_criacao,
+    }
+
+
+def _dados(request):
+    """Corpo da requisicao em JSON ou formulario"""
+    if request.content_type == 'application/json':
+        try:
+            dados = json.loads(request.body or b'{}')
+        except ValueError:
+            raise DadosInvalidos('JSON invalido!')
+        if not isinstance(dados, dict):
+            raise DadosInvalidos('O corpo deve ser um objeto JSON!')
+        return dados
+    return request.POST
+
+
+def _valor(dados):
+    try:
+        valor = Decimal(str(dados.get('valor', '')).replace(',', '.'))
+    except InvalidOperation:
+        raise DadosInvalidos('Valor invalido!')
+    if not valor.is_finite() or valor.as_tuple().exponent < -2 or abs(valor) > VALOR_MAXIMO:
+        raise DadosInvalidos(MENSAGEM_VALOR_INVALIDO)
+    return valor
+
+
+def _chave_idempotencia(request):
+    """Cabecalho Idempotency-Key: repeticoes com a mesma chave devolvem o primeiro resultado"""
+    chave = request.headers.get('Idempotency-Key')
+    if chave is not None and not 0 < len(chave) <= Idempotencia._meta.get_field('chave').max_length:
+        raise DadosInvalidos('Idempotency-Key invalida!')
+    return chave
+
+
+def _resposta_operacao(sucesso, mensagem, conta, **extras):
+    corpo = {'sucesso': sucesso, 'mensagem': mensagem, 'saldo': conta.saldo, 'limite': conta.limite, **extras}
+    return JsonResponse(corpo, status=200 if sucesso else 422)
+
+
+def _operacao(funcao):
+    """Converte DadosInvalidos em 400 e Http404 em JSON"""
+    def view(request, *args, **kwargs):
+        try:
+            return funcao(request, *args, **kwargs)
+        except DadosInvalidos as erro:
+            return JsonResponse({'sucesso': False, 'mensagem': str(erro)}, status=400)
+        except Http404:
+            return _conta_nao_encontrada()
+    view.__name__ = funcao.__name__
+    view.__doc__ = funcao.__doc__
+    return csrf_exempt(require_POST(view))
+
+
+# Leituras (assincronas)
+
+async def _buscar_conta(pk):
+    return await no_shard_da_conta(Conta.objects.select_related('cliente'), pk).filter(pk=pk).afirst()
+
+
+def _conta_nao_encontrada():
+    return JsonResponse({'sucesso': False, 'mensagem': 'Conta não encontrada!'}, status=404)
+
+
+@require_GET
+@somente_leitura
+async def conta(request, pk):
+    """Dados da conta e do cliente"""
+    conta_obj = await _buscar_conta(pk)
+    if conta_obj is None:
+        return _conta_nao_encontrada()
+    return JsonResponse(_json_conta(conta_obj))
+
+
+@require_GET
+@somente_leitura
+async def extrato(request, pk):
+    """Extrato paginado por cursor: ?cursor=<proximo_cursor da pagina anterior>"""
+    conta_obj = await _buscar_conta(pk)
+    if conta_obj is None:
+        return _conta_nao_encontrada()
+
+    cursor = request.GET.get('cursor')
+    if cursor:
+        cursor = decodificar_cursor(cursor)
+        if cursor is None:
+            return JsonResponse({'sucesso': False, 'mensagem': 'Cursor invalido!'}, status=400)
+
+    transacoes, proximo_cursor = await sync_to_async(pagina_extrato)(conta_obj, cursor)
+    return JsonResponse({
+        'transacoes': [_json_transacao(transacao, conta_obj) for transacao in transacoes],
+        'proximo_cursor': proximo_cursor,
+    })
+
+
+@csrf_exempt
+async def chaves(request, pk):
+    """GET lista as chaves PIX da conta; POST cadastra uma nova (tipo_chave, chave)"""
+    if request.method == 'GET':
+        conta_obj = await _buscar_conta(pk)
+        if conta_obj is None:
+            return _conta_nao_encontrada()
+        return JsonResponse({'chaves': [_json_chave(chave) async for chave in conta_obj.chaves_pix.all()]})
+    if request.method == 'POST':
+        return await sync_to_async(cadastrar_chave)(request, pk)
+    return JsonResponse({'sucesso': False, 'mensagem': 'Metodo nao permitido!'}, status=405, headers={'Allow': 'GET, POST'})
+
+
+# Operacoes (sincronas, no mesmo caminho transacional das telas)
+
+@_operacao
+def deposito(request, pk):
+    """Deposito: {"valor": "100.50"}"""
+    conta_obj = get_object_or_404(no_shard_da_conta(Conta.objects, pk), pk=pk)
+    sucesso, mensagem = conta_obj.depositar(_valor(_dados(request)), chave_idempotencia=_chave_idempotencia(request))
+    return _resposta_operacao(sucesso, mensagem, conta_obj)
+
+
+@_operacao
+def saque(request, pk):
+    """Saque: {"valor": "100.50"}"""
+    conta_obj = get_object_or_404(no_shard_da_conta(Conta.objects, pk), pk=pk)
+    sucesso, mensagem = conta_obj.sacar(_valor(_dados(request)), chave_idempotencia=_chave_idempotencia(request))
+    return _resposta_operacao(sucesso, mensagem, conta_obj)
+
+
+@_operacao
+def transferencia(request, pk):
+    """Transferencia: {"conta_destino": 2, "valor": "100.50"}"""
+    conta_obj = get_object_or_404(no_shard_da_conta(Conta.objects, pk), pk=pk)
+    dados = _dados(request)
+    valor = _valor(dados)
+    try:
+        numero_destino = int(dados.get('conta_destino'))
+        conta_destino = no_shard_da_conta(Conta.objects, numero_destino).get(numero=numero_destino)
+    except (TypeError, ValueError):
+        raise DadosInvalidos('Conta destino invalida!')
+    except Conta.DoesNotExist:
+        return JsonResponse({'sucesso': False, 'mensagem': 'Conta destino não encontrada!'}, status=404)
+
+    sucesso, mensagem = conta_obj.transferir(conta_destino, valor, chave_idempotencia=_chave_idempotencia(request))
+    return _resposta_operacao(sucesso, mensagem, conta_obj)
+
+
+@_operacao
+def pix(request, pk):
+    """PIX: {"chave_pix": "email@exemplo.com", "valor": "100.50"}"""
+    conta_obj = get_object_or_404(no_shard_da_conta(Conta.objects, pk), pk=pk)
+    dados = _dados(request)
+    valor = _valor(dados)
+    sucesso, mensagem, destino = conta_obj.transferir_pix(
+        str(dados.get('chave_pix', '')), valor, chave_idempotencia=_chave_idempotencia(request)
+    )
+    extras = {'destino': destino._asdict()} if destino else {}
+    return _resposta_operacao(sucesso, mensagem, conta_obj, **extras)
+
+
+def cadastrar_chave(request, pk):
+    conta_obj = no_shard_da_conta(Conta.objects, pk).filter(pk=pk).first()
+    if conta_obj is None:
+        return _conta_nao_encontrada()
+    try:
+        dados = dict(_dados(request).items())
+    except DadosInvalidos as erro:
+        return JsonResponse({'sucesso': False, 'mensagem': str(erro)}, status=400)
+    # Chave aleatoria e sempre gerada pelo banco
+    if dados.get('tipo_chave') == 'ALEATORIA':
+        dados['chave'] = ChavePix.gerar_chave_aleatoria()
+
+    form = ChavePixForm(dados)
+    if not form.is_valid():
+        return JsonResponse({'sucesso': False, 'erros': form.errors}, status=400)
+
+    chave = form.save(commit=False)
+    chave.conta = conta_obj
+    chave.save()
+    return JsonResponse({'sucesso': True, 'chave': _json_chave(chave)}, status=201)
+
+
+@_operacao
+def desativar_chave(request, pk, chave_id):
+    """Desativa uma chave PIX da conta"""
+    chave = no_shard_da_conta(ChavePix.objects, pk).filter(pk=chave_id, conta_id=pk).first()
+    if chave is None:
+        return JsonResponse({'sucesso': False, 'mensagem': 'Chave PIX não encontrada!'}, status=404)
+    chave.ativa = False
+    chave.save()
+    return JsonResponse({'sucesso': True, 'chave': _json_chave(chave)})
@@ -0,0 +1,13 @@
+from django.urls import path
+from . import api
+
+urlpatterns = [
+    path('contas/<int:pk>/', api.conta, name='api_conta'),
+    path('contas/<int:pk>/extrato/', api.extrato, name='api_extrato'),
+    path('contas/<int:pk>/deposito/', api.deposito, name='api_deposito'),
+    path('contas/<int:pk>/saque/', api.saque, name='api_saque'),
+    path('contas/<int:pk>/transferencia/', api.transferencia, name='api_transferencia'),
+    path('contas/<int:pk>/pix/', api.pix, name='api_pix'),
+    path('contas/<int:pk>/chaves/', api.chaves, name='api_chaves'),
+    path('contas/<int:pk>/chaves/<int:chave_id>/desativar/', api.desativar_chave, name='api_desativar_chave'),
+]
@@ -0,0 +1,108 @@
+"""Aquecimento de cada processo antes da primeira requisicao (AQUECIMENTO nas settings).
+
+Chamado por bancoprojeto.wsgi e asgi logo depois de criar a aplicacao, quando
+o servidor (gunicorn, uvicorn) os carrega, antes de aceitar trafego; os
+comandos do manage.py nao passam por eles e nao aquecem. Sem ele a
+primeira requisicao paga a importacao das views (pelo URLconf), a montagem
+das tabelas de reverse, a compilacao de cada template e a abertura das
+conexoes com o banco. "manage.py perfil_partida" mostra o tempo de cada etapa.
+
+As conexoes sao por thread: so a thread que carregou o app (a unica de um
+worker sync do gunicorn) ja atende com a conexao aberta. Com gunicorn
+--preload o modulo wsgi e importado no processo mestre, antes do fork, e conexoes
+abertas ali seriam herdadas pelos workers: desligue CONEXOES nesse caso.
+"""
+import logging
+import os
+import time
+
+from django.conf import settings
+from django.db import DatabaseError
+
+logger = logging.getLogger(__name__)
+
+# {etapa: (itens, milissegundos)} do ultimo aquecimento deste processo
+medidas = {}
+
+
+def configuracao():
+    return getattr(settings, 'AQUECIMENTO', {})
+
+
+def aquecer():
+    """Executa as etapas ligadas em AQUECIMENTO; retorna {etapa: (itens, milissegundos)}"""
+    config = configuracao()
+    if not config.get('ATIVO'):
+        return {}
+    etapas = [
+        ('urls', config.get('URLS'), aquecer_urls),
+        ('templates', config.get('TEMPLATES'), lambda: aquecer_templates(config['TEMPLATES'])),
+        ('conexoes', config.get('CONEXOES'), abrir_conexoes),
+    ]
+    for nome, ligada, etapa in etapas:
+        if ligada:
+            inicio = time.perf_counter()
+            total = etapa()
+            medidas[nome] = (total, round((time.perf_counter() - inicio) * 1000, 3))
+    return dict(medidas)
+
+
+def aquecer_urls():
+    """Importa o URLconf (e com ele as views) e monta as tabelas de resolve e reverse; retorna os nomes de URL"""
+    from django.urls import get_resolver
+
+    resolver = get_resolver()
+    # Os includes com namespace (admin) so montam as tabelas deles no primeiro reverse
+    resolvers = [resolver, *(incluido for _, incluido in resolver.namespace_dict.values())]
+    return sum(1 for atual in resolvers for chave in atual.reverse_dict if isinstance(chave, str))
+
+
+def aquecer_templates(prefixos):
+    """Compila, no loader em cache de cada engine, os templates cujo nome comeca com um dos prefixos"""
+    from django.template import engines
+
+    total = 0
+    for backend in engines.all():
+        engine = getattr(backend, 'engine', None)
+        if engine is None:
+            continue
+        for nome in nomes_de_templates(engine, prefixos):
+            engine.get_template(nome)
+            total += 1
+    return total
+
+
+def nomes_de_templates(engine, prefixos):
+    """Nomes dos templates encontrados nos diretorios dos loaders da engine, sem repeticao"""
+    loaders = []
+    for loader in engine.template_loaders:
+        # O loader em cache envolve os loaders que leem os arquivos
+        loaders += getattr(loader, 'loaders', [loader])
+    nomes = set()
+    for loader in loaders:
+        for diretorio in loader.get_dirs() if hasattr(loader, 'get_dirs') else []:
+            for raiz, _, arquivos in os.walk(diretorio):
+                for arquivo in arquivos:
+                    nome = os.path.relpath(os.path.join(raiz, arquivo), diretorio).replace(os.sep, '/')
+                    if nome.startswith(tuple(prefixos)):
+                        nomes.add(nome)
+    return sorted(nomes)
+
+
+def abrir_conexoes():
+    """Abre as conexoes com os shards e a replica; um banco fora do ar nao impede o processo de subir"""
+    from django.db import connections
+
+    from .roteador import replica_disponivel
+    from .shards import shards
+
+    abertas = 0
+    for alias in dict.fromkeys([*shards(), replica_disponivel()]):
+        if alias is None:
+            continue
+        try:
+            connections[alias].ensure_connection()
+            abertas += 1
+        except DatabaseError as erro:
+            logger.warning('Aquecimento: conexao com %s nao aberta: %s', alias, erro)
+    return abertas
@@ -0,0 +1,59 @@
+"""Arquivamento das transacoes antigas na tabela fria (TransacaoArquivada).
+
+A tabela quente (Transacao) guarda so os meses recentes, entao o extrato do
+dia a dia, o admin e os indices dela deixam de crescer para sempre. As
+transacoes saem em lotes, das mais antigas para as mais novas; em cada lote a
+copia para o arquivo e a remocao da tabela quente sao confirmadas juntas. O
+id e mantido, entao os lancamentos do razao continuam apontando para ela.
+
+O corte e sempre ARQUIVAMENTO['DIAS_QUENTES'] antes da execucao, entao tudo
+no arquivo e mais antigo do que tudo na tabela quente e do que esse prazo: o
+extrato so consulta o arquivo quando a tabela quente acaba e a conta e mais
+antiga que o prazo. Reduzir DIAS_QUENTES e seguro; aumenta-lo nao devolve a
+tabela quente o que ja foi arquivado.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .estatisticas import nome_checkpoint
+from .models import Estatistica, Transacao, TransacaoArquivada
+from .shards import shards
+
+
+def configuracao():
+    config = getattr(settings, 'ARQUIVAMENTO', {})
+    return config.get('DIAS_QUENTES', 365), config.get('TAMANHO_LOTE', 2000)
+
+
+def inicio_tabela_quente():
+    """Transacoes a partir deste momento nunca estao no arquivo"""
+    return timezone.now() - timedelta(days=configuracao()[0])
+
+
+def arquivar(tamanho_lote=None):
+    """Move para o arquivo as transacoes anteriores ao prazo em todos os shards e retorna quantas foram"""
+    corte = inicio_tabela_quente()
+    tamanho_lote = tamanho_lote or configuracao()[1]
+    return sum(_arquivar_shard(alias, corte, tamanho_lote) for alias in shards())
+
+
+def _arquivar_shard(alias, corte, tamanho_lote):
+    # So sai da tabela quente o que ja foi somado aos volumes das estatisticas
+    ultima_somada = (
+        Estatistica.objects.filter(nome=nome_checkpoint(alias)).values_list('quantidade', flat=True).first() or 0
+    )
+    antigas = Transacao.objects.using(alias).filter(data_hora__lt=corte, pk__lte=ultima_somada).order_by('pk')
+    movidas = 0
+    while True:
+        with transaction.atomic(using=alias):
+            lote = list(antigas[:tamanho_lote])
+            TransacaoArquivada.objects.using(alias).bulk_create(
+                [TransacaoArquivada.de_transacao(transacao) for transacao in lote]
+            )
+            Transacao.objects.using(alias).filter(pk__in=[transacao.pk for transacao in lote]).delete()
+        movidas += len(lote)
+        if len(lote) < tamanho_lote:
+            return movidas
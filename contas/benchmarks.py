@@ -0,0 +1,628 @@
+"""Cenarios de benchmark do app contas, executados por ``manage.py bench``"""
+import asyncio
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.db import OperationalError, connections
+from django.test import AsyncClient, Client, RequestFactory, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from .antifraude import motor_antifraude
+from .cache_pix import ResolvedorChavesPix
+from .extrato import TAMANHO_PAGINA, pagina_extrato
+from .fragmentos import cache_fragmentos
+from .limites import BaldesCache, BaldesMemoria, Limitador
+from .lote import processar_lote
+from .models import Cliente, ChavePix, Conta, Transacao
+
+CENARIOS = {}
+
+
+def cenario(nome):
+    """Registra uma funcao de benchmark com o nome usado na linha de comando"""
+    def registrar(funcao):
+        CENARIOS[nome] = funcao
+        return funcao
+    return registrar
+
+
+def cronometrar(funcao, repeticoes=5):
+    """Executa funcao algumas vezes e retorna a mediana em milissegundos"""
+    tempos = []
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        funcao()
+        tempos.append((time.perf_counter() - inicio) * 1000)
+    return round(statistics.median(tempos), 3)
+
+
+def medir(funcao, operacoes, clientes=1):
+    """Executa funcao(indice) para cada indice em range(operacoes), em clientes threads.
+
+    Retorna latencias (p50, p95, p99 em ms) e vazao. Cada thread fecha as
+    suas conexoes com o banco ao terminar.
+    """
+    latencias = []
+    trava = threading.Lock()
+
+    def executar(indices):
+        proprias = []
+        try:
+            for indice in indices:
+                inicio = time.perf_counter()
+                funcao(indice)
+                proprias.append((time.perf_counter() - inicio) * 1000)
+        finally:
+            if clientes > 1:
+                connections.close_all()
+        with trava:
+            latencias.extend(proprias)
+
+    inicio = time.perf_counter()
+    if clientes == 1:
+        executar(range(operacoes))
+    else:
+        with ThreadPoolExecutor(max_workers=clientes) as executor:
+            list(executor.map(executar, [range(indice, operacoes, clientes) for indice in range(clientes)]))
+    segundos = time.perf_counter() - inicio
+
+    percentis = statistics.quantiles(latencias, n=100) if len(latencias) > 1 else latencias * 99
+    return {
+        'p50_ms': round(percentis[49], 3),
+        'p95_ms': round(percentis[94], 3),
+        'p99_ms': round(percentis[98], 3),
+        'operacoes_por_segundo': round(operacoes / segundos),
+        'segundos': round(segundos, 3),
+    }
+
+
+# Campos que identificam uma linha de resultado entre duas execucoes; os demais
+# (metricas, taxa_acerto, efetuados, erros_lock, pragmas...) podem mudar
+CAMPOS_IDENTIDADE = ('item', 'modo', 'perfil', 'servidor', 'pagina', 'clientes')
+
+
+def comparar(base, atual, tolerancia):
+    """Compara duas execucoes (listas de resultados) e retorna as regressoes.
+
+    As linhas sao casadas pelos CAMPOS_IDENTIDADE. Campos terminados em _ms
+    e 'segundos' pioram quando sobem; campos terminados em por_segundo pioram
+    quando descem. Uma regressao e uma piora acima de tolerancia (0.2 = 20%)
+    ou uma linha presente em so uma das execucoes.
+    """
+    def identidade(linha):
+        return tuple((campo, linha[campo]) for campo in CAMPOS_IDENTIDADE if campo in linha)
+
+    def metricas(linha):
+        return {
+            campo: valor for campo, valor in linha.items()
+            if campo.endswith(('_ms', 'por_segundo')) or campo == 'segundos'
+        }
+
+    anteriores = {identidade(linha): metricas(linha) for linha in base}
+    atuais = {identidade(linha): metricas(linha) for linha in atual}
+    regressoes = []
+    for chave, depois in atuais.items():
+        if chave not in anteriores:
+            regressoes.append({**dict(chave), 'metrica': 'linha', 'antes': 'ausente', 'depois': 'presente'})
+            continue
+        for campo, valor in depois.items():
+            antes = anteriores[chave].get(campo)
+            if not antes:
+                continue
+            variacao = (antes - valor) / antes if campo.endswith('por_segundo') else (valor - antes) / antes
+            if variacao > tolerancia:
+                regressoes.append({**dict(chave), 'metrica': campo, 'antes': antes, 'depois': valor})
+    for chave in anteriores:
+        if chave not in atuais:
+            regressoes.append({**dict(chave), 'metrica': 'linha', 'antes': 'presente', 'depois': 'ausente'})
+    return regressoes
+
+
+def criar_contas(quantidade, saldo='1000.00'):
+    """Cria clientes e contas numerados para os cenarios"""
+    contas = []
+    for indice in range(quantidade):
+        cliente = Cliente.objects.create(
+            nome=f'Cliente Benchmark {indice}',
+            email=f'bench{indice}@exemplo.com',
+            cpf=f'{indice:011d}',
+            data_nascimento=date(1990, 1, 1),
+        )
+        contas.append(Conta.objects.create(cliente=cliente, saldo=Decimal(saldo)))
+    return contas
+
+
+@contextmanager
+def _data_hora_manual():
+    """Permite gravar data_hora explicita em Transacao durante a carga"""
+    campo = Transacao._meta.get_field('data_hora')
+    campo.auto_now_add = False
+    try:
+        yield
+    finally:
+        campo.auto_now_add = True
+
+
+def semear_transacoes(conta, quantidade, lote=10_000):
+    """Grava quantidade transacoes na conta, uma por segundo ate agora"""
+    inicio = timezone.now() - timedelta(seconds=quantidade)
+    with _data_hora_manual():
+        for deslocamento in range(0, quantidade, lote):
+            Transacao.objects.bulk_create([
+                Transacao(
+                    conta=conta,
+                    tipo='D',
+                    valor=Decimal('1.00'),
+                    data_hora=inicio + timedelta(seconds=indice),
+                    descricao='Carga de benchmark',
+                )
+                for indice in range(deslocamento, min(deslocamento + lote, quantidade))
+            ])
+
+
+@cenario('extrato')
+def bench_extrato(opcoes):
+    """Compara paginacao por OFFSET com paginacao por cursor em paginas cada vez mais fundas"""
+    quantidade = opcoes['transacoes']
+    conta = criar_contas(1)[0]
+    semear_transacoes(conta, quantidade)
+    historico = conta.transacoes.order_by('-data_hora', '-id')
+
+    resultados = []
+    for pagina in (1, 10, 100, 1_000, 10_000, 100_000, 500_000):
+        deslocamento = (pagina - 1) * TAMANHO_PAGINA
+        if deslocamento >= quantidade:
+            break
+
+        cursor = None
+        if deslocamento:
+            ancora = historico[deslocamento - 1]
+            cursor = (ancora.data_hora, ancora.pk)
+
+        resultados.append({
+            'pagina': pagina,
+            'offset_ms': cronometrar(lambda: list(historico[deslocamento:deslocamento + TAMANHO_PAGINA])),
+            'cursor_ms': cronometrar(lambda: pagina_extrato(conta, cursor)),
+        })
+    return resultados
+
+
+@cenario('pix')
+def bench_pix(opcoes):
+    """Resolucoes de chave PIX por segundo direto no banco e com o cache aquecido"""
+    contas = criar_contas(opcoes['contas'])
+    chaves = [ChavePix.gerar_chave_aleatoria() for _ in contas]
+    ChavePix.objects.bulk_create([
+        ChavePix(conta=conta, tipo_chave='ALEATORIA', chave=chave) for conta, chave in zip(contas, chaves)
+    ])
+    consultas = [chaves[indice % len(chaves)] for indice in range(opcoes['operacoes'])]
+
+    resultados = []
+    for nome, resolvedor in (('banco', ResolvedorChavesPix(ttl=0)), ('cache', ResolvedorChavesPix())):
+        if nome == 'cache':
+            for chave in chaves:
+                resolvedor.resolver(chave)
+            resolvedor.zerar_estatisticas()
+
+        inicio = time.perf_counter()
+        for chave in consultas:
+            resolvedor.resolver(chave)
+        segundos = time.perf_counter() - inicio
+
+        resultados.append({
+            'modo': nome,
+            'consultas_por_segundo': round(len(consultas) / segundos),
+            'taxa_acerto': resolvedor.estatisticas()['taxa_acerto'],
+        })
+    return resultados
+
+
+@cenario('lote')
+def bench_lote(opcoes):
+    """Folha de pagamento: uma conta pagadora distribui operacoes PIX entre as demais contas"""
+    contas = criar_contas(opcoes['contas'] + 1, saldo='0.00')
+    pagadora = contas[0]
+    Conta.objects.filter(pk=pagadora.pk).update(saldo=Decimal('100000000.00'))
+    chaves = [ChavePix.gerar_chave_aleatoria() for _ in contas[1:]]
+    ChavePix.objects.bulk_create([
+        ChavePix(conta=conta, tipo_chave='ALEATORIA', chave=chave) for conta, chave in zip(contas[1:], chaves)
+    ])
+    itens = [
+        {'origem': pagadora.numero, 'chave_pix': chaves[indice % len(chaves)], 'valor': '1.00'}
+        for indice in range(opcoes['operacoes'])
+    ]
+
+    inicio = time.perf_counter()
+    relatorio = processar_lote(itens)
+    segundos = time.perf_counter() - inicio
+
+    return [{
+        'pagamentos': len(itens),
+        'efetuados': sum(1 for linha in relatorio if linha['sucesso']),
+        'segundos': round(segundos, 3),
+        'pagamentos_por_segundo': round(len(itens) / segundos),
+    }]
+
+
+@cenario('api')
+@override_settings(ALLOWED_HOSTS=['testserver'])
+def bench_api(opcoes):
+    """Leituras da API JSON por segundo: WSGI com um pool de threads x ASGI com um unico event loop.
+
+    Os dois lados usam os clientes de teste do Django, em processo, com
+    opcoes['clientes'] requisicoes simultaneas; nao ha rede nem servidor.
+    """
+    contas = criar_contas(opcoes['contas'])
+    # Metade consulta a conta, metade a primeira pagina do extrato
+    urls = [
+        reverse(('api_conta', 'api_extrato')[indice % 2], args=[contas[indice % len(contas)].numero])
+        for indice in range(opcoes['operacoes'])
+    ]
+    simultaneos = opcoes['clientes']
+
+    def wsgi():
+        def requisitar(fatia):
+            cliente = Client()
+            try:
+                for url in fatia:
+                    cliente.get(url)
+            finally:
+                connections.close_all()
+
+        with ThreadPoolExecutor(max_workers=simultaneos) as executor:
+            list(executor.map(requisitar, [urls[indice::simultaneos] for indice in range(simultaneos)]))
+
+    async def asgi():
+        async def requisitar(fatia):
+            cliente = AsyncClient()
+            for url in fatia:
+                await cliente.get(url)
+
+        await asyncio.gather(*(requisitar(urls[indice::simultaneos]) for indice in range(simultaneos)))
+
+    resultados = []
+    for nome, executar in (('wsgi', wsgi), ('asgi', lambda: asyncio.run(asgi()))):
+        inicio = time.perf_counter()
+        executar()
+        segundos = time.perf_counter() - inicio
+        resultados.append({
+            'servidor': nome,
+            'clientes': simultaneos,
+            'requisicoes': len(urls),
+            'requisicoes_por_segundo': round(len(urls) / segundos),
+        })
+    return resultados
+
+
+@cenario('suite')
+# Centenas de POSTs por conta quente passariam do limite; o custo dele e medido no cenario limites
+@override_settings(ALLOWED_HOSTS=['testserver'], LIMITE_REQUISICOES={'ATIVO': False})
+def bench_suite(opcoes):
+    """Latencia e vazao de cada view de contas/urls.py e de cada metodo de Conta que movimenta dinheiro.
+
+    Semeia opcoes['contas'] contas com uma chave PIX cada e opcoes['transacoes']
+    transacoes distribuidas entre as dez primeiras contas. Cada item e medido
+    com opcoes['amostras'] operacoes em um cliente e depois com
+    opcoes['clientes'] clientes simultaneos.
+    """
+    contas = criar_contas(opcoes['contas'], saldo='1000000.00')
+    chaves = [ChavePix.gerar_chave_aleatoria() for _ in contas]
+    ChavePix.objects.bulk_create([
+        ChavePix(conta=conta, tipo_chave='ALEATORIA', chave=chave) for conta, chave in zip(contas, chaves)
+    ])
+    # As operacoes circulam entre as dez primeiras contas; chaves[i] e a chave de contas[i]
+    quentes = contas[:10]
+    for quente in quentes:
+        semear_transacoes(quente, opcoes['transacoes'] // len(quentes))
+
+    locais = threading.local()
+
+    def cliente():
+        if not hasattr(locais, 'cliente'):
+            locais.cliente = Client()
+        return locais.cliente
+
+    def conta(indice):
+        return quentes[indice % len(quentes)]
+
+    def destino(indice):
+        return quentes[(indice + 1) % len(quentes)]
+
+    def get(nome, por_conta=True, **parametros):
+        def requisitar(indice):
+            args = [conta(indice).numero] if por_conta else []
+            resposta = cliente().get(reverse(nome, args=args), parametros)
+            if resposta.status_code != 200:
+                raise AssertionError(f'{nome}: HTTP {resposta.status_code}')
+            if resposta.streaming:
+                for _ in resposta.streaming_content:
+                    pass
+        return requisitar
+
+    def post(nome, dados):
+        def requisitar(indice):
+            resposta = cliente().post(reverse(nome, args=[conta(indice).numero]), dados(indice))
+            if resposta.status_code != 302:
+                raise AssertionError(f'{nome}: HTTP {resposta.status_code}')
+        return requisitar
+
+    itens = {
+        # Views HTML de leitura
+        'view:home': get('home', por_conta=False),
+        'view:metricas': get('metricas', por_conta=False),
+        'view:conta_list': get('conta_list', por_conta=False),
+        'view:conta_detail': get('conta_detail'),
+        'view:extrato': get('extrato'),
+        'view:exportar_extrato': get('exportar_extrato', fim=date.today().isoformat()),
+        'view:listar_chaves_pix': get('listar_chaves_pix'),
+        'view:criar_conta': get('criar_conta', por_conta=False),
+        'view:cadastrar_chave_pix': get('cadastrar_chave_pix'),
+        # Views HTML de operacao (POST com redirect)
+        'view:efetuar_deposito': post('efetuar_deposito', lambda indice: {'valor': '1,00'}),
+        'view:efetuar_saque': post('efetuar_saque', lambda indice: {'valor': '1,00'}),
+        'view:efetuar_transferencia': post(
+            'efetuar_transferencia', lambda indice: {'numero_conta_destino': destino(indice).numero, 'valor': '1,00'}
+        ),
+        'view:efetuar_pix': post(
+            'efetuar_pix', lambda indice: {'chave_pix': chaves[(indice + 1) % len(quentes)], 'valor': '1,00'}
+        ),
+        # API JSON
+        'api:conta': get('api_conta'),
+        'api:extrato': get('api_extrato'),
+        'api:chaves': get('api_chaves'),
+        # Metodos de Conta
+        'conta:depositar': lambda indice: conta(indice).depositar(Decimal('1.00')),
+        'conta:sacar': lambda indice: conta(indice).sacar(Decimal('1.00')),
+        'conta:transferir': lambda indice: conta(indice).transferir(destino(indice), Decimal('1.00')),
+        'conta:transferir_pix': lambda indice: conta(indice).transferir_pix(
+            chaves[(indice + 1) % len(quentes)], Decimal('1.00')
+        ),
+    }
+
+    resultados = []
+    # As contas quentes passariam dos limites de velocidade e o PIX mediria a recusa
+    # (o custo das regras e medido por "manage.py reproduzir_antifraude")
+    with motor_antifraude.desativado():
+        for nome, funcao in itens.items():
+            for clientes in sorted({1, opcoes['clientes']}):
+                resultados.append({'item': nome, 'clientes': clientes, **medir(funcao, opcoes['amostras'], clientes)})
+    return resultados
+
+
+@cenario('limites')
+@override_settings(ALLOWED_HOSTS=['testserver'])
+def bench_limites(opcoes):
+    """Custo do limite de requisicoes: a verificacao sozinha e um deposito pela tela com e sem o middleware.
+
+    As regras sao altas o bastante para nenhuma requisicao ser recusada: mede-se
+    so o custo de consultar e gastar as fichas dos baldes de conta e de IP.
+    """
+    contas = criar_contas(opcoes['contas'])
+    regras = {'efetuar_deposito': {'POR_CONTA': '1000000/s', 'POR_IP': '1000000/s'}}
+    requisicao = RequestFactory().post('/')
+
+    resultados = []
+    for nome, baldes in (('memoria', BaldesMemoria()), ('cache', BaldesCache('default'))):
+        limitador = Limitador(regras, baldes=baldes)
+        metricas = medir(
+            lambda indice: limitador.verificar(requisicao, 'efetuar_deposito', {'pk': contas[indice % len(contas)].numero}),
+            opcoes['operacoes'],
+        )
+        resultados.append({'item': f'verificar:{nome}', **metricas})
+
+    for ativo in (False, True):
+        with override_settings(LIMITE_REQUISICOES={'ATIVO': ativo, 'REGRAS': regras}):
+            cliente = Client()
+
+            def depositar(indice):
+                url = reverse('efetuar_deposito', args=[contas[indice % len(contas)].numero])
+                resposta = cliente.post(url, {'valor': '1,00'})
+                if resposta.status_code != 302:
+                    raise AssertionError(f'efetuar_deposito: HTTP {resposta.status_code}')
+
+            resultados.append({'item': f'deposito:{"com" if ativo else "sem"}_limite', **medir(depositar, opcoes['amostras'])})
+    return resultados
+
+
+@cenario('fragmentos')
+@override_settings(ALLOWED_HOSTS=['testserver'], LIMITE_REQUISICOES={'ATIVO': False})
+def bench_fragmentos(opcoes):
+    """Paginas de conta com o cache de trechos frio (limpo a cada requisicao) e quente.
+
+    O item misto intercala um deposito a cada quatro leituras da mesma conta,
+    como numa conta movimentada; a taxa de acerto e a dos trechos no item.
+    """
+    contas = criar_contas(opcoes['contas'])
+    for conta in contas[:10]:
+        semear_transacoes(conta, opcoes['transacoes'] // 10)
+    cliente = Client()
+
+    def get(nome, por_conta=True):
+        def requisitar(indice):
+            args = [contas[indice % 10].numero] if por_conta else []
+            resposta = cliente.get(reverse(nome, args=args))
+            if resposta.status_code != 200:
+                raise AssertionError(f'{nome}: HTTP {resposta.status_code}')
+        return requisitar
+
+    def frio(funcao):
+        def requisitar(indice):
+            cache_fragmentos.cache.clear()
+            funcao(indice)
+        return requisitar
+
+    def misto(indice):
+        if indice % 5 == 4:
+            contas[indice % 10].depositar(Decimal('1.00'))
+        else:
+            get('conta_detail')(indice)
+
+    resultados = []
+    for nome in ('conta_detail', 'conta_list'):
+        funcao = get(nome, por_conta=nome == 'conta_detail')
+        for estado, medida in (('frio', frio(funcao)), ('quente', funcao)):
+            cache_fragmentos.zerar_estatisticas()
+            resultados.append({'item': f'{nome}:{estado}', **medir(medida, opcoes['amostras']), **_taxa_fragmentos()})
+    cache_fragmentos.zerar_estatisticas()
+    resultados.append({'item': 'conta_detail:misto', **medir(misto, opcoes['amostras']), **_taxa_fragmentos()})
+    return resultados
+
+
+def _taxa_fragmentos():
+    totais = [sum(valores[campo] for valores in cache_fragmentos.estatisticas().values()) for campo in ('acertos', 'faltas')]
+    return {'taxa_acerto': round(totais[0] / sum(totais), 4) if sum(totais) else 0.0}
+
+
+# Perfis comparados pelo cenario sqlite: (OPTIONS do banco, SQLITE_PRAGMAS)
+PERFIS_SQLITE = {
+    # Configuracao padrao do Django: BEGIN adiado, journal de rollback com fsync a cada commit
+    'padrao': ({}, {'journal_mode': 'DELETE', 'synchronous': 'FULL'}),
+    # So a reserva de escrita no BEGIN, ainda com journal de rollback
+    'immediate': ({'transaction_mode': 'IMMEDIATE'}, {'journal_mode': 'DELETE', 'synchronous': 'FULL', 'busy_timeout': 20000}),
+    'producao': None,  # settings atuais
+}
+
+
+@cenario('sqlite')
+def bench_sqlite(opcoes):
+    """Transferencias concorrentes por segundo no perfil padrao do SQLite e no de producao (WAL).
+
+    Cada perfil roda opcoes['operacoes'] transferencias entre dez contas com
+    opcoes['clientes'] threads; falhas por "database is locked" sao contadas.
+    """
+    from django.conf import settings
+
+    if connections['default'].vendor != 'sqlite':
+        raise RuntimeError('O cenario sqlite exige o banco default em SQLite')
+
+    contas = criar_contas(10, saldo='1000000.00')
+    configuracao = connections.settings['default']
+    opcoes_originais = configuracao['OPTIONS']
+    resultados = []
+    for nome, perfil in PERFIS_SQLITE.items():
+        opcoes_banco, pragmas = perfil or (opcoes_originais, settings.SQLITE_PRAGMAS)
+        # journal_mode so muda sem outras conexoes abertas
+        connections.close_all()
+        configuracao['OPTIONS'] = opcoes_banco
+        erros = []
+
+        def transferir(indice):
+            try:
+                contas[indice % 10].transferir(contas[(indice + 1) % 10], Decimal('1.00'))
+            except OperationalError as erro:
+                erros.append(str(erro))
+
+        try:
+            with override_settings(SQLITE_PRAGMAS=pragmas):
+                journal_mode = connections['default'].cursor().execute('PRAGMA journal_mode').fetchone()[0]
+                metricas = medir(transferir, opcoes['operacoes'], opcoes['clientes'])
+                connections.close_all()
+        finally:
+            configuracao['OPTIONS'] = opcoes_originais
+        resultados.append({
+            'perfil': nome,
+            'journal_mode': journal_mode,
+            'clientes': opcoes['clientes'],
+            **metricas,
+            'erros_lock': len(erros),
+            'efetivadas_por_segundo': round((opcoes['operacoes'] - len(erros)) / metricas['segundos']),
+        })
+    return resultados
+
+
+# Executado em um interpretador novo por amostra: importa o WSGI e mede a primeira
+# e a segunda resposta de cada caminho (ate o primeiro bloco do corpo)
+SCRIPT_PARTIDA = '''
+import json, sys, time
+inicio = time.perf_counter()
+from bancoprojeto.wsgi import application
+medidas = {'partida_ms': (time.perf_counter() - inicio) * 1000}
+from wsgiref.util import setup_testing_defaults
+from django.conf import settings
+from django.templatetags.static import static
+
+def primeiro_byte(caminho, **cabecalhos):
+    ambiente = {'PATH_INFO': caminho, 'HTTP_HOST': 'localhost', **cabecalhos}
+    setup_testing_defaults(ambiente)
+    estado = []
+    inicio = time.perf_counter()
+    corpo = application(ambiente, lambda linha, cabecalhos, exc_info=None: estado.append(linha))
+    primeiro = next(iter(corpo), b'')
+    decorrido = (time.perf_counter() - inicio) * 1000
+    tamanho = len(primeiro) + sum(len(bloco) for bloco in corpo)
+    getattr(corpo, 'close', lambda: None)()
+    if not estado[0].startswith('200'):
+        raise SystemExit(f'{caminho}: HTTP {estado[0]}')
+    return decorrido, tamanho
+
+for caminho in sys.argv[1:]:
+    medidas[f'{caminho}:primeira_ms'] = primeiro_byte(caminho)[0]
+    medidas[f'{caminho}:segunda_ms'] = primeiro_byte(caminho)[0]
+if settings.STATIC_ROOT:
+    arquivo = static('admin/css/base.css')
+    medidas['estatico_ms'], medidas['estatico_bytes'] = primeiro_byte(arquivo)
+    medidas['estatico_gzip_bytes'] = primeiro_byte(arquivo, HTTP_ACCEPT_ENCODING='gzip, br')[1]
+print(json.dumps(medidas))
+'''
+
+# Perfis comparados pelo cenario partida: nome -> DJANGO_SETTINGS_MODULE
+PERFIS_PARTIDA = {
+    'desenvolvimento': 'bancoprojeto.settings',
+    'producao': 'bancoprojeto.settings_producao',
+}
+
+
+@cenario('partida')
+def bench_partida(opcoes):
+    """Partida a frio de um processo e latencia ate o primeiro byte em cada perfil de settings.
+
+    Cada amostra e um interpretador novo: o tempo de importar bancoprojeto.wsgi
+    (com o aquecimento) e a primeira e a segunda resposta de paginas
+    que nao consultam o banco. O perfil de producao roda antes o collectstatic
+    em um diretorio temporario e mede tambem um arquivo estatico. Sao
+    opcoes['amostras'] // 40 amostras por perfil (no minimo 3), com as medianas.
+    """
+    import json
+    import os
+    import subprocess
+    import sys
+    import tempfile
+
+    from django.conf import settings
+
+    caminhos = [reverse('criar_conta'), reverse('admin:login')]
+    amostras = max(3, opcoes['amostras'] // 40)
+    resultados = []
+    with tempfile.TemporaryDirectory() as estaticos:
+        for nome, modulo in PERFIS_PARTIDA.items():
+            ambiente = {
+                # O perfil de producao exige a chave no ambiente; a medicao nao guarda nada assinado
+                'DJANGO_SECRET_KEY': 'bench-partida',
+                **os.environ,
+                'DJANGO_SETTINGS_MODULE': modulo,
+                'DJANGO_STATIC_ROOT': estaticos,
+            }
+            if nome == 'producao':
+                subprocess.run(
+                    [sys.executable, 'manage.py', 'collectstatic', '--noinput', '-v0'],
+                    cwd=settings.BASE_DIR, env=ambiente, check=True, capture_output=True,
+                )
+            medidas = []
+            for _ in range(amostras):
+                saida = subprocess.run(
+                    [sys.executable, '-c', SCRIPT_PARTIDA, *caminhos],
+                    cwd=settings.BASE_DIR, env=ambiente, check=True, capture_output=True, text=True,
+                )
+                medidas.append(json.loads(saida.stdout.splitlines()[-1]))
+            resultados.append({
+                'perfil': nome,
+                'amostras': amostras,
+                **{chave: round(statistics.median(medida[chave] for medida in medidas), 3) for chave in medidas[0]},
+            })
+    return resultados
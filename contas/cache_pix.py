@@ -0,0 +1,135 @@
+"""Cache de resolucao de chaves PIX: chave -> (numero da conta, nome do cliente)"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from django.conf import settings
+from django.core.cache import caches
+
+DestinoPix = namedtuple('DestinoPix', ['numero', 'nome'])
+
+
+class ResolvedorChavesPix:
+    """LRU em processo com TTL, opcionalmente apoiado em um cache do Django.
+
+    O cache local evita qualquer ida ao banco na consulta de chaves mais
+    quentes; o cache compartilhado (alias em settings.CACHES) evita que cada
+    processo precise consultar o banco para aquecer o seu. Chaves inexistentes
+    ou inativas nunca sao guardadas.
+    """
+
+    def __init__(self, tamanho_maximo=10_000, ttl=30, alias_cache=None, ttl_compartilhado=300):
+        self.tamanho_maximo = tamanho_maximo
+        self.ttl = ttl
+        self.alias_cache = alias_cache
+        self.ttl_compartilhado = ttl_compartilhado
+        self._entradas = OrderedDict()
+        self._trava = threading.Lock()
+        self._geracao = 0
+        self.zerar_estatisticas()
+
+    @classmethod
+    def de_settings(cls):
+        config = getattr(settings, 'PIX_CACHE', {})
+        return cls(
+            tamanho_maximo=config.get('TAMANHO_MAXIMO', 10_000),
+            ttl=config.get('TTL', 30),
+            alias_cache=config.get('CACHE_DJANGO'),
+            ttl_compartilhado=config.get('TTL_COMPARTILHADO', 300),
+        )
+
+    def resolver(self, chave):
+        """Retorna o DestinoPix da chave ativa ou None se ela nao existir ou estiver inativa"""
+        with self._trava:
+            entrada = self._entradas.get(chave)
+            if entrada is not None and entrada[0] > time.monotonic():
+                self._entradas.move_to_end(chave)
+                self.acertos_locais += 1
+                return entrada[1]
+            geracao = self._geracao
+
+        destino = self._consultar_compartilhado(chave)
+        if destino is None:
+            destino = self._consultar_banco(chave)
+            if destino is None:
+                return None
+            self._guardar_compartilhado(chave, destino)
+
+        with self._trava:
+            # Uma invalidacao durante a consulta torna o resultado suspeito
+            if geracao == self._geracao:
+                self._entradas[chave] = (time.monotonic() + self.ttl, destino)
+                self._entradas.move_to_end(chave)
+                while len(self._entradas) > self.tamanho_maximo:
+                    self._entradas.popitem(last=False)
+        return destino
+
+    def invalidar(self, *chaves):
+        """Remove as chaves dos caches local e compartilhado"""
+        with self._trava:
+            self._geracao += 1
+            for chave in chaves:
+                self._entradas.pop(chave, None)
+            self.invalidacoes += len(chaves)
+        if self.alias_cache:
+            caches[self.alias_cache].delete_many([self._chave_compartilhada(chave) for chave in chaves])
+
+    def limpar(self):
+        """Esvazia o cache local deste processo"""
+        with self._trava:
+            self._geracao += 1
+            self._entradas.clear()
+
+    def zerar_estatisticas(self):
+        self.acertos_locais = 0
+        self.acertos_compartilhados = 0
+        self.consultas_banco = 0
+        self.invalidacoes = 0
+
+    def estatisticas(self):
+        """Contadores de acerto do cache desde a ultima zerada"""
+        acertos = self.acertos_locais + self.acertos_compartilhados
+        total = acertos + self.consultas_banco
+        return {
+            'acertos_locais': self.acertos_locais,
+            'acertos_compartilhados': self.acertos_compartilhados,
+            'consultas_banco': self.consultas_banco,
+            'invalidacoes': self.invalidacoes,
+            'taxa_acerto': round(acertos / total, 4) if total else 0.0,
+            'entradas': len(self._entradas),
+        }
+
+    def _consultar_banco(self, chave):
+        from .models import DiretorioPix
+
+        with self._trava:
+            self.consultas_banco += 1
+        # O diretorio global acha a chave em qualquer shard com uma unica consulta
+        linha = (
+            DiretorioPix.objects.filter(chave=chave, ativa=True)
+            .values_list('conta_numero', 'nome')
+            .first()
+        )
+        return DestinoPix(*linha) if linha else None
+
+    def _chave_compartilhada(self, chave):
+        # Chaves PIX podem ter caracteres e tamanhos invalidos para memcached
+        return 'pix:' + hashlib.sha256(chave.encode()).hexdigest()
+
+    def _consultar_compartilhado(self, chave):
+        if not self.alias_cache:
+            return None
+        bruto = caches[self.alias_cache].get(self._chave_compartilhada(chave))
+        if bruto is None:
+            return None
+        with self._trava:
+            self.acertos_compartilhados += 1
+        return DestinoPix(*bruto)
+
+    def _guardar_compartilhado(self, chave, destino):
+        if self.alias_cache:
+            caches[self.alias_cache].set(self._chave_compartilhada(chave), tuple(destino), self.ttl_compartilhado)
+
+
+resolvedor_pix = ResolvedorChavesPix.de_settings()
@@ -0,0 +1,131 @@
+"""Arquivos estaticos de producao: hash no nome, versoes comprimidas e cache longo.
+
+No perfil de producao (bancoprojeto/settings_producao.py) o collectstatic usa
+o ArmazenamentoEstatico. Ele grava cada arquivo com o hash do conteudo no nome
+(ManifestStaticFilesStorage) e, ao lado dos que comprimem bem, as versoes .gz
+e .br (esta so com o pacote brotli instalado). A compressao e feita uma vez,
+no deploy, e nunca por requisicao.
+
+O EstaticosMiddleware serve STATIC_URL a partir de STATIC_ROOT antes do resto
+da pilha. Ele escolhe a versao comprimida que o navegador aceita e marca os
+nomes com hash como imutaveis por um ano: o nome muda quando o conteudo muda.
+Atras de um nginx, prefira gzip_static/brotli_static apontando para
+STATIC_ROOT.
+"""
+import gzip
+import mimetypes
+from pathlib import Path
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage, staticfiles_storage
+from django.core.exceptions import MiddlewareNotUsed, SuspiciousFileOperation
+from django.http import FileResponse
+from django.utils._os import safe_join
+
+try:
+    import brotli
+except ImportError:  # opcional: sem brotli so as versoes .gz
+    brotli = None
+
+EXTENSOES_COMPRIMIVEIS = ('.css', '.js', '.mjs', '.map', '.json', '.svg', '.txt', '.xml', '.html', '.ico', '.ttf', '.otf', '.eot')
+TAMANHO_MINIMO = 256
+# Codificacao aceita pelo navegador -> extensao gravada no collectstatic, na ordem de preferencia
+CODIFICACOES = (('br', '.br'), ('gzip', '.gz'))
+CACHE_IMUTAVEL = 'public, max-age=31536000, immutable'
+CACHE_CURTO = 'public, max-age=60'
+
+
+def _comprimir_br(dados):
+    return brotli.compress(dados, quality=11)
+
+
+def _comprimir_gz(dados):
+    # mtime fixo: o mesmo arquivo gera sempre o mesmo .gz
+    return gzip.compress(dados, compresslevel=9, mtime=0)
+
+
+class ArmazenamentoEstatico(ManifestStaticFilesStorage):
+    """Manifest com hash no nome e versoes .gz/.br gravadas no collectstatic"""
+
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run, **options)
+        if not dry_run:
+            for nome in set(self.hashed_files.values()):
+                self.comprimir(nome)
+
+    def comprimir(self, nome):
+        """Grava as versoes comprimidas do arquivo que ficarem ao menos 5% menores"""
+        if not nome.endswith(EXTENSOES_COMPRIMIVEIS):
+            return
+        caminho = Path(self.path(nome))
+        conteudo = caminho.read_bytes()
+        if len(conteudo) < TAMANHO_MINIMO:
+            return
+        compressores = [('.gz', _comprimir_gz)] + ([('.br', _comprimir_br)] if brotli is not None else [])
+        for extensao, comprimir in compressores:
+            comprimido = comprimir(conteudo)
+            if len(comprimido) < len(conteudo) * 0.95:
+                caminho.with_name(caminho.name + extensao).write_bytes(comprimido)
+
+
+class EstaticosMiddleware:
+    """Serve STATIC_URL de STATIC_ROOT com a versao comprimida aceita e cache longo nos nomes com hash"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.STATIC_ROOT:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.prefixo = settings.STATIC_URL
+        self.raiz = str(settings.STATIC_ROOT)
+        self.imutaveis = set(getattr(staticfiles_storage, 'hashed_files', {}).values())
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if self.estatico(request):
+            resposta = self.servir(request, request.path[len(self.prefixo):])
+            if resposta is not None:
+                return resposta
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        if self.estatico(request):
+            # Abrir o arquivo e I/O de disco: fora do loop de eventos, so nas URLs de estaticos
+            servir = sync_to_async(self.servir, thread_sensitive=False)
+            resposta = await servir(request, request.path[len(self.prefixo):])
+            if resposta is not None:
+                return resposta
+        return await self.get_response(request)
+
+    def estatico(self, request):
+        return request.method in ('GET', 'HEAD') and request.path.startswith(self.prefixo)
+
+    def servir(self, request, nome):
+        """FileResponse do arquivo, ou None para seguir a pilha (e responder 404) se ele nao existir"""
+        try:
+            caminho = Path(safe_join(self.raiz, nome))
+        except SuspiciousFileOperation:
+            return None
+        if not caminho.is_file():
+            return None
+
+        aceitas = {parte.split(';')[0].strip() for parte in request.headers.get('Accept-Encoding', '').split(',')}
+        codificacao = None
+        for nome_codificacao, extensao in CODIFICACOES:
+            comprimido = caminho.with_name(caminho.name + extensao)
+            if nome_codificacao in aceitas and comprimido.is_file():
+                codificacao, caminho = nome_codificacao, comprimido
+                break
+
+        tipo = mimetypes.guess_type(nome)[0] or 'application/octet-stream'
+        resposta = FileResponse(caminho.open('rb'), content_type=tipo)
+        if codificacao:
+            resposta['Content-Encoding'] = codificacao
+        resposta['Vary'] = 'Accept-Encoding'
+        resposta['Cache-Control'] = CACHE_IMUTAVEL if nome in self.imutaveis else CACHE_CURTO
+        return resposta
@@ -0,0 +1,151 @@
+"""Estatisticas pre-calculadas do painel (home e metricas).
+
+Clientes e contas sao contados por sinais no momento do cadastro. Os volumes
+por tipo de transacao sao somados periodicamente por atualizar_estatisticas,
+a partir da ultima transacao ja processada, para que nenhuma movimentacao
+dispute a mesma linha de contador. reconciliar_estatisticas recalcula tudo
+do zero e corrige qualquer desvio.
+
+Os contadores ficam no banco default e somam todos os shards; cada shard tem
+o seu checkpoint de ultima transacao.
+"""
+from datetime import timedelta
+from decimal import Decimal
+from itertools import chain
+
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import Count, F, Max, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import Cliente, Conta, Estatistica, Transacao, TransacaoArquivada, VolumeDiario
+from .shards import faixa, shards
+
+CLIENTES = 'clientes'
+CONTAS = 'contas'
+# quantidade guarda o id da ultima transacao somada aos volumes
+ULTIMA_TRANSACAO = 'ultima_transacao'
+# Transacoes mais novas que a margem ficam para a proxima execucao, pois outras
+# transacoes com id menor ainda podem estar por confirmar
+MARGEM = timedelta(seconds=60)
+
+
+def nome_volume(tipo):
+    return f'volume_{tipo}'
+
+
+def nome_checkpoint(alias):
+    return ULTIMA_TRANSACAO if alias == DEFAULT_DB_ALIAS else f'{ULTIMA_TRANSACAO}:{alias}'
+
+
+def _transacoes_do_shard(alias, modelo=Transacao):
+    """Transacoes do shard sem as de entrada de transferencias vindas de outro shard (ja contadas na origem)"""
+    inicio, fim = faixa(alias)
+    return modelo.objects.using(alias).filter(conta_id__gte=inicio, conta_id__lt=fim)
+
+
+def incrementar(nome, quantidade=1, valor=Decimal('0.00')):
+    """Soma ao contador com um UPDATE atomico, criando-o se ainda nao existir"""
+    atualizar = dict(quantidade=F('quantidade') + quantidade, valor=F('valor') + valor, atualizado_em=timezone.now())
+    if not Estatistica.objects.filter(nome=nome).update(**atualizar):
+        Estatistica.objects.get_or_create(nome=nome)
+        Estatistica.objects.filter(nome=nome).update(**atualizar)
+
+
+def painel():
+    """Todos os contadores em uma unica consulta: {nome: Estatistica}"""
+    return {estatistica.nome: estatistica for estatistica in Estatistica.objects.all()}
+
+
+def _volumes(transacoes):
+    return (
+        transacoes.annotate(dia=TruncDate('data_hora'))
+        .values('dia', 'tipo')
+        .annotate(quantidade=Count('id'), total=Sum('valor'))
+        .order_by()
+    )
+
+
+def atualizar_volumes(margem=MARGEM):
+    """Soma aos volumes as transacoes novas desde a ultima execucao e retorna quantas foram"""
+    return sum(_atualizar_volumes_do_shard(alias, margem) for alias in shards())
+
+
+def _atualizar_volumes_do_shard(alias, margem):
+    with transaction.atomic():
+        Estatistica.objects.get_or_create(nome=nome_checkpoint(alias))
+        checkpoint = Estatistica.objects.select_for_update().get(nome=nome_checkpoint(alias))
+
+        ultimo_id = _transacoes_do_shard(alias).filter(
+            pk__gt=checkpoint.quantidade,
+            data_hora__lt=timezone.now() - margem,
+        ).aggregate(ultimo=Max('pk'))['ultimo']
+        if ultimo_id is None:
+            return 0
+
+        processadas = 0
+        novas = _transacoes_do_shard(alias).filter(pk__gt=checkpoint.quantidade, pk__lte=ultimo_id)
+        for linha in _volumes(novas):
+            atualizar = dict(quantidade=F('quantidade') + linha['quantidade'], total=F('total') + linha['total'])
+            if not VolumeDiario.objects.filter(data=linha['dia'], tipo=linha['tipo']).update(**atualizar):
+                VolumeDiario.objects.create(
+                    data=linha['dia'], tipo=linha['tipo'], quantidade=linha['quantidade'], total=linha['total']
+                )
+            incrementar(nome_volume(linha['tipo']), linha['quantidade'], linha['total'])
+            processadas += linha['quantidade']
+
+        checkpoint.quantidade = ultimo_id
+        checkpoint.save(update_fields=['quantidade', 'atualizado_em'])
+    return processadas
+
+
+def reconciliar(margem=MARGEM):
+    """Recalcula todos os contadores a partir das tabelas e retorna as divergencias corrigidas.
+
+    Varre Transacao e TransacaoArquivada inteiras: deve rodar fora do horario de pico.
+    Como em atualizar_volumes, as transacoes mais novas que a margem ficam de fora
+    e depois do checkpoint, para a proxima atualizacao.
+    """
+    with transaction.atomic():
+        Estatistica.objects.get_or_create(nome=ULTIMA_TRANSACAO)
+        Estatistica.objects.select_for_update().get(nome=ULTIMA_TRANSACAO)
+
+        esperado = {
+            CLIENTES: (sum(Cliente.objects.using(alias).count() for alias in shards()), Decimal('0.00')),
+            CONTAS: (sum(Conta.objects.using(alias).count() for alias in shards()), Decimal('0.00')),
+        }
+        for tipo, _ in Transacao.TIPO_CHOICES:
+            esperado[nome_volume(tipo)] = (0, Decimal('0.00'))
+
+        volumes = {}
+        limite = timezone.now() - margem
+        for alias in shards():
+            transacoes = _transacoes_do_shard(alias)
+            arquivadas = _transacoes_do_shard(alias, TransacaoArquivada)
+            ultimo_id = max(
+                transacoes.filter(data_hora__lt=limite).aggregate(ultimo=Max('pk'))['ultimo'] or 0,
+                arquivadas.filter(data_hora__lt=limite).aggregate(ultimo=Max('pk'))['ultimo'] or 0,
+            )
+            esperado[nome_checkpoint(alias)] = (ultimo_id, Decimal('0.00'))
+            linhas = chain(
+                _volumes(transacoes.filter(pk__lte=ultimo_id)), _volumes(arquivadas.filter(pk__lte=ultimo_id)),
+            )
+            for linha in linhas:
+                volume = volumes.setdefault((linha['dia'], linha['tipo']), VolumeDiario(data=linha['dia'], tipo=linha['tipo']))
+                volume.quantidade += linha['quantidade']
+                volume.total += linha['total']
+                quantidade, total = esperado[nome_volume(linha['tipo'])]
+                esperado[nome_volume(linha['tipo'])] = (quantidade + linha['quantidade'], total + linha['total'])
+
+        VolumeDiario.objects.all().delete()
+        VolumeDiario.objects.bulk_create(volumes.values(), batch_size=1000)
+
+        atuais = painel()
+        divergencias = []
+        for nome, (quantidade, valor) in esperado.items():
+            estatistica = atuais.get(nome) or Estatistica(nome=nome)
+            if (estatistica.quantidade, estatistica.valor) != (quantidade, valor):
+                divergencias.append((nome, (estatistica.quantidade, estatistica.valor), (quantidade, valor)))
+                estatistica.quantidade, estatistica.valor = quantidade, valor
+                estatistica.save()
+    return divergencias
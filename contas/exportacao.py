@@ -0,0 +1,173 @@
+"""Exportacao do extrato em CSV e OFX como geradores, com memoria constante"""
+import csv
+from collections import namedtuple
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+from django.db.models import CharField, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from .models import Lancamento, Transacao, TransacaoArquivada, soma_rubrica
+from .saldos import saldo_em
+
+TAMANHO_LOTE = 2000
+
+LinhaExtrato = namedtuple('LinhaExtrato', ['data_hora', 'movimento', 'transacao', 'descricao', 'valor', 'saldo', 'limite'])
+
+
+def periodo_extrato(inicio, fim):
+    """Converte datas AAAA-MM-DD (ou vazias) no intervalo [inicio, fim) do fuso local.
+
+    O dia final entra inteiro no periodo. Levanta ValueError para datas invalidas.
+    """
+    def meia_noite(texto):
+        data = parse_date(texto)
+        if data is None:
+            raise ValueError(f'Data invalida: {texto}')
+        return timezone.make_aware(datetime.combine(data, time.min))
+
+    return (
+        meia_noite(inicio) if inicio else None,
+        meia_noite(fim) + timedelta(days=1) if fim else None,
+    )
+
+
+def linhas_extrato(conta, inicio=None, fim=None, chunk_size=TAMANHO_LOTE):
+    """Gera as linhas do extrato da conta em ordem cronologica, com saldo corrente.
+
+    Le o razao com .iterator(chunk_size) e agrupa os lancamentos de cada
+    movimento; o saldo e o limite sao acumulados linha a linha a partir do
+    saldo anterior a inicio (contas/saldos.py), entao a memoria usada nao
+    depende do historico.
+    valor e o efeito do movimento no saldo total (saldo + limite) da conta.
+    """
+    lancamentos = Lancamento.objects.using(conta._state.db).filter(conta=conta)
+    saldo = limite = Decimal('0.00')
+    if inicio is not None:
+        saldo, limite = saldo_em(conta, inicio)
+        lancamentos = lancamentos.filter(data_hora__gte=inicio)
+    if fim is not None:
+        lancamentos = lancamentos.filter(data_hora__lt=fim)
+
+    # A transacao pode ja ter ido para o arquivo, com o mesmo id
+    arquivada = TransacaoArquivada.objects.using(conta._state.db).filter(pk=OuterRef('transacao_id'))
+    lancamentos = (
+        lancamentos.annotate(
+            origem=Coalesce(
+                'transacao__conta', Subquery(arquivada.values('conta')[:1]), output_field=IntegerField()
+            ),
+            tipo_transacao=Coalesce(
+                'transacao__tipo', Subquery(arquivada.values('tipo')[:1]), output_field=CharField()
+            ),
+        )
+        .only('movimento', 'rubrica', 'natureza', 'valor', 'historico', 'data_hora', 'transacao')
+        .order_by('id')
+    )
+    tipos = dict(Transacao.TIPO_CHOICES)
+
+    atual = None
+    for lancamento in lancamentos.iterator(chunk_size=chunk_size):
+        if atual is not None and lancamento.movimento != atual['movimento']:
+            yield LinhaExtrato(saldo=saldo, limite=limite, **atual)
+            atual = None
+
+        if atual is None:
+            descricao = lancamento.historico
+            if lancamento.origem is not None and lancamento.origem != conta.numero:
+                descricao = f'Recebido da conta {lancamento.origem} ({tipos[lancamento.tipo_transacao]})'
+            atual = {
+                'data_hora': lancamento.data_hora,
+                'movimento': lancamento.movimento,
+                'transacao': lancamento.transacao_id,
+                'descricao': descricao,
+                'valor': Decimal('0.00'),
+            }
+
+        efeito = lancamento.valor if lancamento.natureza == 'C' else -lancamento.valor
+        atual['valor'] += efeito
+        if lancamento.rubrica == 'S':
+            saldo += efeito
+        else:
+            limite += efeito
+
+    if atual is not None:
+        yield LinhaExtrato(saldo=saldo, limite=limite, **atual)
+
+
+class _Eco:
+    """Buffer que apenas devolve o que o csv.writer escreve"""
+
+    def write(self, valor):
+        return valor
+
+
+def extrato_csv(conta, inicio=None, fim=None):
+    escritor = csv.writer(_Eco())
+    yield escritor.writerow(['data_hora', 'transacao', 'descricao', 'valor', 'saldo', 'limite'])
+    for linha in linhas_extrato(conta, inicio, fim):
+        yield escritor.writerow([
+            timezone.localtime(linha.data_hora).isoformat(),
+            linha.transacao or '',
+            linha.descricao,
+            linha.valor,
+            linha.saldo,
+            linha.limite,
+        ])
+
+
+def _data_ofx(data_hora):
+    return timezone.localtime(data_hora).strftime('%Y%m%d%H%M%S')
+
+
+def extrato_ofx(conta, inicio=None, fim=None):
+    """Extrato no formato OFX 2.2 (XML); o saldo final vai no LEDGERBAL ao fim do arquivo"""
+    # Importado no primeiro OFX: xml.sax traz urllib.request para todos os processos web
+    from xml.sax.saxutils import escape
+
+    agora = timezone.now()
+    yield (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<?OFX OFXHEADER="200" VERSION="220" SECURITY="NONE" OLDFILEUID="NONE" NEWFILEUID="NONE"?>\n'
+        '<OFX>\n'
+        '<SIGNONMSGSRSV1><SONRS><STATUS><CODE>0</CODE><SEVERITY>INFO</SEVERITY></STATUS>'
+        f'<DTSERVER>{_data_ofx(agora)}</DTSERVER><LANGUAGE>POR</LANGUAGE></SONRS></SIGNONMSGSRSV1>\n'
+        '<BANKMSGSRSV1><STMTTRNRS><TRNUID>0</TRNUID>'
+        '<STATUS><CODE>0</CODE><SEVERITY>INFO</SEVERITY></STATUS>\n'
+        '<STMTRS><CURDEF>BRL</CURDEF>\n'
+        f'<BANKACCTFROM><BANKID>BANCOPY</BANKID><ACCTID>{conta.numero}</ACCTID>'
+        '<ACCTTYPE>CHECKING</ACCTTYPE></BANKACCTFROM>\n'
+        f'<BANKTRANLIST><DTSTART>{_data_ofx(inicio or conta.data_abertura)}</DTSTART>'
+        f'<DTEND>{_data_ofx(fim or agora)}</DTEND>\n'
+    )
+
+    saldo = None
+    for linha in linhas_extrato(conta, inicio, fim):
+        saldo = linha.saldo
+        tipo = 'CREDIT' if linha.valor >= 0 else 'DEBIT'
+        yield (
+            f'<STMTTRN><TRNTYPE>{tipo}</TRNTYPE><DTPOSTED>{_data_ofx(linha.data_hora)}</DTPOSTED>'
+            f'<TRNAMT>{linha.valor}</TRNAMT><FITID>{linha.movimento}</FITID>'
+            f'<MEMO>{escape(linha.descricao)}</MEMO></STMTTRN>\n'
+        )
+
+    if saldo is None:
+        # Periodo sem movimentos: o saldo e o mesmo do fim do periodo
+        saldo = conta.saldo
+        if fim is not None:
+            saldo = Lancamento.objects.using(conta._state.db).filter(conta=conta, data_hora__lt=fim).aggregate(
+                saldo=soma_rubrica('S')
+            )['saldo'] or Decimal('0.00')
+    yield (
+        '</BANKTRANLIST>\n'
+        f'<LEDGERBAL><BALAMT>{saldo}</BALAMT><DTASOF>{_data_ofx(fim or agora)}</DTASOF></LEDGERBAL>\n'
+        '</STMTRS></STMTTRNRS></BANKMSGSRSV1>\n'
+        '</OFX>\n'
+    )
+
+
+FORMATOS = {
+    'csv': (extrato_csv, 'text/csv; charset=utf-8'),
+    'ofx': (extrato_ofx, 'application/x-ofx'),
+}
@@ -0,0 +1,72 @@
+"""Extrato de conta paginado por cursor (data_hora, id) em vez de OFFSET"""
+import base64
+import binascii
+from datetime import datetime
+from heapq import merge
+
+from django.db.models import Q
+
+from .arquivamento import inicio_tabela_quente
+from .models import Transacao, TransacaoArquivada
+
+TAMANHO_PAGINA = 20
+
+
+def codificar_cursor(transacao):
+    """Gera o cursor opaco que aponta para depois da transacao informada"""
+    bruto = f'{transacao.data_hora.isoformat()}|{transacao.pk}'
+    return base64.urlsafe_b64encode(bruto.encode()).decode()
+
+
+def decodificar_cursor(cursor):
+    """Retorna (data_hora, id) do cursor ou None se ele for invalido"""
+    try:
+        data_hora, pk = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        return datetime.fromisoformat(data_hora), int(pk)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        return None
+
+
+def _ordem(transacao):
+    return transacao.data_hora, transacao.pk
+
+
+def _mais_recentes(modelo, conta, filtro_cursor, quantidade):
+    """As transacoes enviadas e recebidas mais recentes da conta em modelo"""
+    # No shard da conta (ou na replica de onde ela foi lida)
+    transacoes = modelo.objects.using(conta._state.db)
+    consultas = [
+        transacoes.filter(filtro_cursor, conta=conta),
+        transacoes.filter(filtro_cursor, conta_destino=conta),
+    ]
+    lados = [list(consulta.order_by('-data_hora', '-id')[:quantidade]) for consulta in consultas]
+    return list(merge(*lados, key=_ordem, reverse=True))[:quantidade]
+
+
+def pagina_extrato(conta, cursor=None, tamanho=TAMANHO_PAGINA):
+    """Retorna (transacoes, proximo_cursor) do extrato da conta, mais recentes primeiro.
+
+    O extrato reune as transacoes enviadas (conta) e recebidas (conta_destino).
+    Cada lado e uma consulta separada que percorre o indice composto
+    (conta, -data_hora, -id) ou (conta_destino, -data_hora, -id) a partir do
+    cursor e le no maximo tamanho + 1 linhas, entao a pagina 10.000 custa o
+    mesmo que a primeira. Se a tabela quente nao completa a pagina, o restante
+    vem do mesmo jeito de TransacaoArquivada, que so tem transacoes mais antigas
+    (e so e consultada para contas abertas antes do prazo da tabela quente).
+    """
+    filtro_cursor = Q()
+    if cursor:
+        data_hora, pk = cursor
+        # Equivale a (data_hora, id) < cursor; o data_hora <= isolado da ao banco
+        # o limite de busca no indice, em vez de varrer a conta desde o inicio
+        filtro_cursor = Q(data_hora__lte=data_hora) & (Q(data_hora__lt=data_hora) | Q(pk__lt=pk))
+
+    transacoes = _mais_recentes(Transacao, conta, filtro_cursor, tamanho + 1)
+    if len(transacoes) <= tamanho and conta.data_abertura < inicio_tabela_quente():
+        transacoes += _mais_recentes(TransacaoArquivada, conta, filtro_cursor, tamanho + 1 - len(transacoes))
+
+    proximo_cursor = None
+    if len(transacoes) > tamanho:
+        transacoes = transacoes[:tamanho]
+        proximo_cursor = codificar_cursor(transacoes[-1])
+    return transacoes, proximo_cursor
@@ -0,0 +1,164 @@
+"""Fechamento do dia em lote: recomposicao do limite, juros do limite usado e tarifa mensal.
+
+As contas de cada shard sao fechadas em blocos, em ordem de numero. Cada bloco
+e lido com uma consulta, convertido em centavos inteiros e calculado de uma vez
+com vetores do NumPy (quando instalado; senao com as mesmas formulas, conta a
+conta), arredondando como Decimal com ROUND_HALF_UP. O resultado volta com
+bulk_update nas contas e bulk_create nas transacoes e no razao, na mesma
+transacao do banco que avanca o checkpoint do shard: se o fechamento for
+interrompido, a proxima execucao continua do bloco seguinte e nenhuma conta e
+cobrada duas vezes no mesmo dia.
+"""
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .fragmentos import cache_fragmentos
+from .models import Conta, Estatistica, EventoTransacao, Lancamento, Transacao, _caixa, _montar_lancamentos
+from .shards import shards
+
+try:
+    import numpy as np
+except ImportError:  # opcional: sem NumPy os blocos sao calculados conta a conta
+    np = None
+
+# Checkpoints guardados no proprio shard: ultimo dia fechado (date.toordinal())
+# e ultima conta ja fechada no dia em andamento
+ULTIMO_DIA = 'fechamento_ultimo_dia'
+ULTIMA_CONTA = 'fechamento_ultima_conta'
+
+
+def configuracao():
+    config = getattr(settings, 'FECHAMENTO', {})
+    return (
+        Decimal(str(config.get('JUROS_LIMITE_DIA', '0'))),
+        Decimal(str(config.get('TARIFA_MENSAL', '0'))),
+        config.get('TAMANHO_BLOCO', 5000),
+    )
+
+
+def centavos(valor):
+    return int(valor * 100)
+
+
+def reais(centavos):
+    return Decimal(int(centavos)).scaleb(-2)
+
+
+def calcular(saldo, limite, contratado, juros_dia, tarifa):
+    """Regras do fechamento em centavos, para inteiros ou vetores do NumPy.
+
+    Primeiro o saldo recompoe o limite usado; sobre o que continuar usado
+    incidem os juros do dia; juros e tarifa saem do saldo e depois do limite,
+    no maximo ate o saldo total. Retorna (recomposto, juros_saldo,
+    juros_limite, tarifa_saldo, tarifa_limite, saldo, limite).
+    """
+    vetores = np is not None and isinstance(saldo, np.ndarray)
+    minimo, maximo = (np.minimum, np.maximum) if vetores else (min, max)
+
+    recomposto = minimo(saldo, maximo(contratado - limite, 0))
+    saldo, limite = saldo - recomposto, limite + recomposto
+
+    numerador, denominador = juros_dia.as_integer_ratio()
+    juros = (maximo(contratado - limite, 0) * numerador + denominador // 2) // denominador
+    juros_saldo, juros_limite, saldo, limite = _cobrar(juros, saldo, limite, minimo)
+    tarifa_saldo, tarifa_limite, saldo, limite = _cobrar(tarifa, saldo, limite, minimo)
+    return recomposto, juros_saldo, juros_limite, tarifa_saldo, tarifa_limite, saldo, limite
+
+
+def _cobrar(valor, saldo, limite, minimo):
+    valor = minimo(valor, saldo + limite)
+    do_saldo = minimo(saldo, valor)
+    do_limite = valor - do_saldo
+    return do_saldo, do_limite, saldo - do_saldo, limite - do_limite
+
+
+def fechar(ate=None):
+    """Fecha os dias ainda nao fechados ate ontem (ou ate) em todos os shards e retorna quantas contas mudaram"""
+    if ate is None:
+        ate = timezone.localdate() - timedelta(days=1)
+    return sum(_fechar_shard(alias, ate) for alias in shards())
+
+
+def _fechar_shard(alias, ate):
+    ordinal = Estatistica.objects.using(alias).filter(nome=ULTIMO_DIA).values_list('quantidade', flat=True).first()
+    dia = date.fromordinal(ordinal) + timedelta(days=1) if ordinal else ate
+    alteradas = 0
+    while dia <= ate:
+        alteradas += _fechar_dia(alias, dia)
+        dia += timedelta(days=1)
+    return alteradas
+
+
+def _fechar_dia(alias, dia):
+    juros_dia, tarifa_mensal, tamanho = configuracao()
+    tarifa = centavos(tarifa_mensal) if dia.day == 1 else 0
+    contas = Conta.objects.using(alias).select_for_update().order_by('numero')
+    if not tarifa:
+        # Sem tarifa, so as contas com limite usado tem o que fechar
+        contas = contas.filter(limite__lt=F('limite_contratado'))
+
+    alteradas = 0
+    while True:
+        with transaction.atomic(using=alias):
+            Estatistica.objects.using(alias).get_or_create(nome=ULTIMA_CONTA)
+            ultima = Estatistica.objects.using(alias).select_for_update().get(nome=ULTIMA_CONTA)
+            bloco = list(
+                contas.filter(numero__gt=ultima.quantidade)
+                .values_list('numero', 'saldo', 'limite', 'limite_contratado')[:tamanho]
+            )
+            alteradas += _fechar_bloco(alias, bloco, juros_dia, tarifa)
+            if len(bloco) == tamanho:
+                ultima.quantidade = bloco[-1][0]
+                ultima.save(update_fields=['quantidade', 'atualizado_em'])
+                continue
+            # Dia fechado: o proximo comeca da primeira conta
+            ultima.quantidade = 0
+            ultima.save(update_fields=['quantidade', 'atualizado_em'])
+            Estatistica.objects.using(alias).update_or_create(nome=ULTIMO_DIA, defaults={'quantidade': dia.toordinal()})
+            return alteradas
+
+
+def _fechar_bloco(alias, bloco, juros_dia, tarifa):
+    if not bloco:
+        return 0
+    numeros, *colunas = zip(*bloco)
+    colunas = [[centavos(valor) for valor in coluna] for coluna in colunas]
+    if np is not None:
+        resultado = calcular(*(np.array(coluna, dtype=np.int64) for coluna in colunas), juros_dia, tarifa)
+        linhas = zip(*(vetor.tolist() for vetor in resultado))
+    else:
+        linhas = (calcular(*valores, juros_dia, tarifa) for valores in zip(*colunas))
+
+    contas, transacoes, movimentos = [], [], []
+    for numero, (recomposto, *cobrancas, saldo, limite) in zip(numeros, linhas):
+        if not (recomposto or any(cobrancas)):
+            continue
+        contas.append(Conta(numero=numero, saldo=reais(saldo), limite=reais(limite)))
+        if recomposto:
+            valor = reais(recomposto)
+            movimentos.append(([(numero, 'S', 'D', valor), (numero, 'L', 'C', valor)], None, 'Recomposição do limite'))
+        juros_saldo, juros_limite, tarifa_saldo, tarifa_limite = cobrancas
+        for tipo, descricao, do_saldo, do_limite in (
+            ('J', 'Juros do limite', juros_saldo, juros_limite),
+            ('F', 'Tarifa mensal', tarifa_saldo, tarifa_limite),
+        ):
+            if do_saldo or do_limite:
+                transacao = Transacao(conta_id=numero, tipo=tipo, valor=reais(do_saldo + do_limite), descricao=descricao)
+                partidas = [(numero, rubrica, 'D', reais(parte)) for rubrica, parte in (('S', do_saldo), ('L', do_limite)) if parte]
+                transacoes.append(transacao)
+                movimentos.append((partidas + [_caixa('C', transacao.valor)], transacao, ''))
+
+    Conta.objects.using(alias).bulk_update(contas, ['saldo', 'limite'], batch_size=1000)
+    Transacao.objects.using(alias).bulk_create(transacoes, batch_size=1000)
+    EventoTransacao.objects.using(alias).bulk_create(map(EventoTransacao.de_transacao, transacoes), batch_size=1000)
+    lancamentos = []
+    for partidas, transacao, historico in movimentos:
+        lancamentos += _montar_lancamentos(partidas, transacao, historico)
+    Lancamento.objects.using(alias).bulk_create(lancamentos, batch_size=1000)
+    cache_fragmentos.invalidar_apos_commit((conta.numero for conta in contas), using=alias)
+    return len(contas)
@@ -1,4 +1,6 @@
 # -*- coding: utf-8 -*-
+import uuid
+
 from django import forms
 from .models import Cliente, Conta, ChavePix
 
@@ -32,7 +34,22 @@ class ContaForm(forms.ModelForm):
         fields = ['cliente']
 
 
-class DepositoForm(forms.Form):
+class OperacaoForm(forms.Form):
+    """Base dos formularios que movimentam dinheiro.
+
+    Cada formulario exibido recebe uma chave de idempotencia nova; reenvios do
+    mesmo formulario (duplo clique, retentativa) repetem a chave e nao executam
+    a operacao de novo.
+    """
+    chave_idempotencia = forms.CharField(
+        max_length=100,
+        required=False,
+        initial=lambda: str(uuid.uuid4()),
+        widget=forms.HiddenInput
+    )
+
+
+class DepositoForm(OperacaoForm):
     """Formulario para deposito"""
     valor = forms.CharField(
         max_length=20,
@@ -46,7 +63,7 @@ class DepositoForm(forms.Form):
     )
 
 
-class SaqueForm(forms.Form):
+class SaqueForm(OperacaoForm):
     """Formulario para saque"""
     valor = forms.CharField(
         max_length=20,
@@ -60,7 +77,7 @@ class SaqueForm(forms.Form):
     )
 
 
-class TransferenciaForm(forms.Form):
+class TransferenciaForm(OperacaoForm):
     """Formulario para transferencia"""
     numero_conta_destino = forms.IntegerField(
         widget=forms.NumberInput(attrs={
@@ -99,7 +116,7 @@ class ChavePixForm(forms.ModelForm):
         }
 
 
-class PixForm(forms.Form):
+class PixForm(OperacaoForm):
     """Formulario para transferencia via PIX"""
     chave_pix = forms.CharField(
         max_length=200,
@@ -0,0 +1,159 @@
+"""Cache dos trechos de HTML das paginas de conta, invalidado por versao.
+
+Cada conta tem uma versao no cache (um token aleatorio). Os trechos, como o
+cartao do cliente, os saldos, as ultimas transacoes e a linha da lista de
+contas, ficam guardados com a chave (trecho, conta, versao). Um acerto devolve
+o HTML pronto, sem consultar o banco nem renderizar template. Qualquer escrita
+na conta apaga a versao depois do commit: o razao (_lancar), os caminhos em
+lote, Cliente, Conta e ChavePix. A leitura seguinte cria uma versao nova, e os
+trechos antigos ficam orfaos ate expirar pelo TTL.
+
+Trechos lidos de uma replica com atraso nao sao guardados: poderiam ser
+anteriores a escrita que trocou a versao.
+"""
+import threading
+import uuid
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connections, transaction
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+from .roteador import alias_de_leitura
+from .shards import primario_da_conta
+
+
+class CacheFragmentos:
+    """Trechos de template por conta e versao em um cache do Django, com contadores de acerto"""
+
+    def __init__(self, ativo=True, alias_cache='default', ttl=600):
+        self.ativo = ativo
+        self.alias_cache = alias_cache
+        self.ttl = ttl
+        self._trava = threading.Lock()
+        self.zerar_estatisticas()
+
+    @classmethod
+    def de_settings(cls):
+        config = getattr(settings, 'FRAGMENTOS', {})
+        return cls(
+            ativo=config.get('ATIVO', True),
+            alias_cache=config.get('CACHE_DJANGO', 'default'),
+            ttl=config.get('TTL', 600),
+        )
+
+    @property
+    def cache(self):
+        return caches[self.alias_cache]
+
+    def renderizar(self, numero, nomes, contexto):
+        """{nome: html} dos trechos da conta (templates contas/fragmentos/<nome>.html), do cache ou renderizados.
+
+        contexto() e chamado so se faltar algum trecho e devolve o contexto dos
+        templates; e nele que ficam as consultas ao banco.
+        """
+        trechos = self._obter([(nome, numero) for nome in nomes], lambda faltando: {numero: contexto()})
+        return {nome: trechos[nome, numero] for nome in nomes}
+
+    def renderizar_lista(self, nome, numeros, contextos):
+        """HTML do trecho para cada conta, na ordem de numeros.
+
+        contextos(numeros que faltam) devolve {numero: contexto}; contas
+        ausentes dele ficam fora da lista.
+        """
+        trechos = self._obter([(nome, numero) for numero in numeros], contextos)
+        return [trechos[nome, numero] for numero in numeros if (nome, numero) in trechos]
+
+    def _obter(self, pares, contextos):
+        versoes, trechos = self._buscar(pares) if self.ativo else ({}, {})
+        faltando = [par for par in pares if par not in trechos]
+        if not faltando:
+            return trechos
+        dados = contextos(list(dict.fromkeys(numero for _, numero in faltando)))
+        novos = {
+            (nome, numero): render_to_string(f'contas/fragmentos/{nome}.html', dados[numero])
+            for nome, numero in faltando if numero in dados
+        }
+        guardar = {
+            self._chave(nome, numero, versoes[numero]): html
+            for (nome, numero), html in novos.items() if numero in versoes and _leitura_sem_atraso(numero)
+        }
+        if guardar:
+            self.cache.set_many(guardar, self.ttl)
+        trechos.update(novos)
+        return trechos
+
+    def _buscar(self, pares):
+        """Versao atual de cada conta e {(nome, numero): html} dos trechos guardados nela"""
+        versoes = self._versoes({numero for _, numero in pares})
+        chaves = {self._chave(nome, numero, versoes[numero]): (nome, numero) for nome, numero in pares if numero in versoes}
+        trechos = {chaves[chave]: mark_safe(html) for chave, html in self.cache.get_many(chaves).items()}
+        with self._trava:
+            for nome, numero in pares:
+                (self.acertos if (nome, numero) in trechos else self.faltas)[nome] += 1
+        return versoes, trechos
+
+    def _versoes(self, numeros):
+        chaves = {f'fragmentos:versao:{numero}': numero for numero in numeros}
+        versoes = {chaves[chave]: versao for chave, versao in self.cache.get_many(chaves).items()}
+        novas = [chave for chave, numero in chaves.items() if numero not in versoes]
+        if novas:
+            # add: se outro processo criou a versao ao mesmo tempo, vale a dele
+            for chave in novas:
+                self.cache.add(chave, uuid.uuid4().hex, None)
+            versoes.update({chaves[chave]: versao for chave, versao in self.cache.get_many(novas).items()})
+        return versoes
+
+    def invalidar(self, *numeros):
+        if self.ativo and numeros:
+            self.cache.delete_many([f'fragmentos:versao:{numero}' for numero in numeros])
+
+    def invalidar_apos_commit(self, numeros, using):
+        """Invalida so depois do commit, para que nenhuma leitura guarde trechos com dados antigos"""
+        numeros = {numero for numero in numeros if numero is not None}
+        if self.ativo and numeros:
+            transaction.on_commit(lambda: self.invalidar(*numeros), using=using)
+
+    def zerar_estatisticas(self):
+        with self._trava:
+            self.acertos = Counter()
+            self.faltas = Counter()
+
+    def estatisticas(self):
+        """Acertos, faltas e taxa de acerto por trecho neste processo desde a ultima zerada"""
+        with self._trava:
+            return {
+                nome: {
+                    'acertos': self.acertos[nome],
+                    'faltas': self.faltas[nome],
+                    'taxa_acerto': round(self.acertos[nome] / (self.acertos[nome] + self.faltas[nome]), 4),
+                }
+                for nome in sorted(self.acertos.keys() | self.faltas.keys())
+            }
+
+    def prometheus(self):
+        """Contadores de acerto e falta por trecho no formato texto do Prometheus"""
+        linhas = []
+        estatisticas = self.estatisticas()
+        for metrica in ('acertos', 'faltas'):
+            nome = f'bancopy_fragmentos_{metrica}_total'
+            linhas.append(f'# TYPE {nome} counter')
+            linhas += [f'{nome}{{fragmento="{trecho}"}} {valores[metrica]}' for trecho, valores in estatisticas.items()]
+        return '\n'.join(linhas) + '\n'
+
+    def _chave(self, nome, numero, versao):
+        return f'fragmentos:{nome}:{numero}:{versao}'
+
+
+def _leitura_sem_atraso(numero):
+    """As leituras da conta nesta requisicao enxergam o primario (ou uma replica no mesmo arquivo)"""
+    primario = primario_da_conta(numero)
+    if primario is None:
+        return False
+    alias = alias_de_leitura(primario)
+    return alias == primario or connections[alias].settings_dict['NAME'] == connections[primario].settings_dict['NAME']
+
+
+cache_fragmentos = CacheFragmentos.de_settings()
@@ -0,0 +1,164 @@
+"""Importacao em massa de clientes e contas (migracao de carteira de parceiros).
+
+O CSV (nome, email, cpf, data_nascimento) e lido em streaming, em blocos de
+linhas. Em cada bloco, CPF e e-mail sao validados em memoria, os repetidos no
+proprio arquivo sao recusados e a unicidade no banco e conferida com uma
+consulta IN por shard. As linhas aceitas sao gravadas por shard (o do CPF,
+como no cadastro pela tela) em uma transacao: clientes, contas, lancamentos
+de abertura e, se pedido, chaves PIX aleatorias, tudo com bulk_create.
+"""
+import csv
+from collections import defaultdict, namedtuple
+from datetime import datetime
+from itertools import islice
+
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
+from django.db import DEFAULT_DB_ALIAS, IntegrityError, transaction
+from django.db.models import Q
+from django.utils.dateparse import parse_date
+
+from . import estatisticas
+from .models import ChavePix, Cliente, Conta, DiretorioPix, Lancamento, _caixa, _montar_lancamentos
+from .shards import shard_para_cpf, shards
+
+TAMANHO_BLOCO = 1000
+LIMITE_INICIAL = Conta._meta.get_field('limite').default
+
+Rejeitada = namedtuple('Rejeitada', ['linha', 'cpf', 'email', 'motivo'])
+
+
+def cpf_valido(digitos):
+    """Confere os dois digitos verificadores de um CPF com 11 digitos"""
+    if len(digitos) != 11 or not digitos.isdigit() or digitos == digitos[0] * 11:
+        return False
+    for tamanho in (9, 10):
+        soma = sum(int(digito) * peso for digito, peso in zip(digitos, range(tamanho + 1, 1, -1)))
+        if (soma * 10 % 11) % 10 != int(digitos[tamanho]):
+            return False
+    return True
+
+
+def formatar_cpf(digitos):
+    return f'{digitos[:3]}.{digitos[3:6]}.{digitos[6:9]}-{digitos[9:]}'
+
+
+def _data(texto):
+    """AAAA-MM-DD ou DD/MM/AAAA"""
+    try:
+        data = parse_date(texto)
+        return data or datetime.strptime(texto, '%d/%m/%Y').date()
+    except ValueError:
+        raise ValueError('Data de nascimento invalida!')
+
+
+def _validar(item):
+    """Converte uma linha do arquivo em (nome, email, digitos do cpf, data_nascimento) ou levanta ValueError"""
+    nome = (item.get('nome') or '').strip()
+    if not nome or len(nome) > Cliente._meta.get_field('nome').max_length:
+        raise ValueError('Nome invalido!')
+    email = (item.get('email') or '').strip().lower()
+    try:
+        validate_email(email)
+    except ValidationError:
+        raise ValueError('E-mail invalido!')
+    digitos = ''.join(caractere for caractere in item.get('cpf') or '' if caractere.isdigit())
+    if not cpf_valido(digitos):
+        raise ValueError('CPF invalido!')
+    return nome, email, digitos, _data((item.get('data_nascimento') or '').strip())
+
+
+def importar_clientes(arquivo, gerar_chave_pix=False, tamanho_bloco=TAMANHO_BLOCO):
+    """Importa os clientes de um arquivo CSV aberto em modo texto.
+
+    Retorna (quantidade importada, lista de Rejeitada com linha e motivo, em ordem de linha).
+    """
+    leitor = enumerate(csv.DictReader(arquivo), start=2)
+    vistos_cpf, vistos_email = set(), set()
+    importados, rejeitadas = 0, []
+    while bloco := list(islice(leitor, tamanho_bloco)):
+        validas = []
+        for linha, item in bloco:
+            try:
+                nome, email, digitos, nascimento = _validar(item)
+            except (ValueError, AttributeError) as erro:
+                rejeitadas.append(Rejeitada(linha, item.get('cpf'), item.get('email'), str(erro)))
+                continue
+            if digitos in vistos_cpf or email in vistos_email:
+                rejeitadas.append(Rejeitada(linha, item.get('cpf'), email, 'CPF ou e-mail repetido no arquivo!'))
+                continue
+            vistos_cpf.add(digitos)
+            vistos_email.add(email)
+            validas.append((linha, nome, email, digitos, nascimento))
+
+        validas = _sem_cadastrados(validas, rejeitadas)
+        por_shard = defaultdict(list)
+        for valida in validas:
+            por_shard[shard_para_cpf(valida[3])].append(valida)
+        for alias, linhas in por_shard.items():
+            try:
+                importados += _gravar(alias, linhas, gerar_chave_pix)
+            except IntegrityError:
+                # Cadastro concorrente com o mesmo CPF, e-mail ou chave desde a conferencia
+                rejeitadas += [
+                    Rejeitada(linha, digitos, email, 'Conflito com cadastro simultaneo, importe novamente!')
+                    for linha, _, email, digitos, _ in linhas
+                ]
+    return importados, sorted(rejeitadas, key=lambda rejeitada: rejeitada.linha)
+
+
+def _sem_cadastrados(validas, rejeitadas):
+    """Recusa as linhas com CPF (com ou sem mascara) ou e-mail ja cadastrado em qualquer shard"""
+    cpfs = {digitos for _, _, _, digitos, _ in validas}
+    cpfs |= {formatar_cpf(digitos) for digitos in cpfs}
+    emails = {email for _, _, email, _, _ in validas}
+    cadastrados = set()
+    for alias in shards():
+        existentes = Cliente.objects.using(alias).filter(Q(cpf__in=cpfs) | Q(email__in=emails))
+        for cpf, email in existentes.values_list('cpf', 'email').order_by():
+            cadastrados.add(''.join(caractere for caractere in cpf if caractere.isdigit()))
+            cadastrados.add(email.lower())
+
+    restantes = []
+    for valida in validas:
+        linha, _, email, digitos, _ = valida
+        if digitos in cadastrados or email in cadastrados:
+            rejeitadas.append(Rejeitada(linha, digitos, email, 'CPF ou e-mail ja cadastrado!'))
+        else:
+            restantes.append(valida)
+    return restantes
+
+
+def _gravar(alias, linhas, gerar_chave_pix):
+    # O diretorio PIX fica no default: em outro shard sao dois commits, o do
+    # default primeiro. Uma falha entre eles deixa entradas sem chave, que
+    # "manage.py reconciliar_diretorio_pix" apaga (como as de ChavePix.save).
+    with transaction.atomic(using=alias), transaction.atomic(using=DEFAULT_DB_ALIAS):
+        clientes = Cliente.objects.using(alias).bulk_create([
+            Cliente(nome=nome, email=email, cpf=formatar_cpf(digitos), data_nascimento=nascimento)
+            for _, nome, email, digitos, nascimento in linhas
+        ])
+        contas = Conta.objects.using(alias).bulk_create([
+            Conta(cliente=cliente, limite=LIMITE_INICIAL, limite_contratado=LIMITE_INICIAL) for cliente in clientes
+        ])
+
+        # bulk_create nao passa por Conta.save: os lancamentos de abertura e os contadores vao aqui
+        lancamentos = []
+        for conta in contas:
+            if conta.limite:
+                lancamentos += _montar_lancamentos(
+                    [(conta.numero, 'L', 'C', conta.limite), _caixa('D', conta.limite)], historico='Abertura de conta'
+                )
+        Lancamento.objects.using(alias).bulk_create(lancamentos)
+        estatisticas.incrementar(estatisticas.CLIENTES, len(clientes))
+        estatisticas.incrementar(estatisticas.CONTAS, len(contas))
+
+        if gerar_chave_pix:
+            chaves = ChavePix.objects.using(alias).bulk_create([
+                ChavePix(conta=conta, tipo_chave='ALEATORIA', chave=ChavePix.gerar_chave_aleatoria()) for conta in contas
+            ])
+            DiretorioPix.objects.bulk_create([
+                DiretorioPix(chave=chave.chave, conta_numero=conta.numero, nome=cliente.nome)
+                for chave, conta, cliente in zip(chaves, contas, clientes)
+            ])
+    return len(contas)
@@ -0,0 +1,195 @@
+"""Limite de requisicoes por conta e por IP nas operacoes (baldes de fichas).
+
+Cada regra de LIMITE_REQUISICOES['REGRAS'] vale para um nome de URL
+(contas/urls.py e contas/api_urls.py) e tem um balde por conta (o pk da URL)
+e outro por IP. 'N/periodo' e um balde de N fichas que se recompoe em N por
+periodo (s, m ou h): rajadas de ate N e, na media, N por periodo. Sem fichas a
+resposta e 429 com Retry-After, antes da view tocar no banco; a requisicao so
+gasta fichas quando todos os baldes dela tem uma.
+
+Os baldes ficam em memoria no processo (LRU) ou, com CACHE_DJANGO, em um cache
+compartilhado entre os processos. Ali a leitura e a escrita nao sao atomicas:
+requisicoes simultaneas do mesmo cliente em processos diferentes podem gastar
+a mesma ficha, um excesso pequeno aceito para nao travar o cache.
+"""
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import HttpResponse, JsonResponse
+
+PERIODOS = {'s': 1, 'm': 60, 'h': 3600}
+MENSAGEM = 'Muitas requisicoes, tente novamente em alguns segundos!'
+
+
+def configuracao():
+    return getattr(settings, 'LIMITE_REQUISICOES', {})
+
+
+def taxa(texto):
+    """'20/m' -> (capacidade 20, 20 / 60 fichas por segundo)"""
+    quantidade, periodo = texto.split('/')
+    quantidade = int(quantidade)
+    return quantidade, quantidade / PERIODOS[periodo.strip()[0]]
+
+
+class BaldesMemoria:
+    """Baldes deste processo: chave -> (fichas, instante da ultima recomposicao), em LRU"""
+
+    def __init__(self, tamanho_maximo=100_000):
+        self.tamanho_maximo = tamanho_maximo
+        self._baldes = OrderedDict()
+        self._trava = threading.Lock()
+
+    def consumir(self, chave, capacidade, por_segundo):
+        """Gasta uma ficha; retorna 0 ou os segundos ate a proxima ficha"""
+        return self.consumir_todos([(chave, capacidade, por_segundo)])
+
+    def consumir_todos(self, baldes):
+        """Gasta uma ficha de cada (chave, capacidade, por_segundo) so se todos tiverem; senao nenhuma.
+
+        Retorna 0 ou os segundos ate o balde mais vazio ter uma ficha.
+        """
+        agora = time.monotonic()
+        with self._trava:
+            recompostos = []
+            for chave, capacidade, por_segundo in baldes:
+                fichas, instante = self._baldes.pop(chave, (capacidade, agora))
+                recompostos.append((chave, min(capacidade, fichas + (agora - instante) * por_segundo), por_segundo))
+            espera = max(
+                [(1 - fichas) / por_segundo for _, fichas, por_segundo in recompostos if fichas < 1], default=0
+            )
+            for chave, fichas, _ in recompostos:
+                self._baldes[chave] = (fichas - 1 if not espera else fichas, agora)
+            while len(self._baldes) > self.tamanho_maximo:
+                self._baldes.popitem(last=False)
+        return espera
+
+    def limpar(self):
+        with self._trava:
+            self._baldes.clear()
+
+
+class BaldesCache:
+    """Baldes em um cache do Django compartilhado; expiram quando estariam cheios de novo"""
+
+    def __init__(self, alias_cache):
+        self.alias_cache = alias_cache
+
+    def consumir(self, chave, capacidade, por_segundo):
+        return self.consumir_todos([(chave, capacidade, por_segundo)])
+
+    def consumir_todos(self, baldes):
+        """Como BaldesMemoria.consumir_todos: uma ficha de cada balde, ou nenhuma se algum estiver vazio"""
+        cache = caches[self.alias_cache]
+        agora = time.time()
+        guardados = cache.get_many([f'limite:{chave}' for chave, _, _ in baldes])
+        recompostos = []
+        for chave, capacidade, por_segundo in baldes:
+            fichas, instante = guardados.get(f'limite:{chave}') or (capacidade, agora)
+            fichas = min(capacidade, fichas + max(agora - instante, 0) * por_segundo)
+            recompostos.append((chave, capacidade, fichas, por_segundo))
+        espera = max([(1 - fichas) / por_segundo for _, _, fichas, por_segundo in recompostos if fichas < 1], default=0)
+        if espera:
+            return espera
+        for chave, capacidade, fichas, por_segundo in recompostos:
+            cache.set(f'limite:{chave}', (fichas - 1, agora), math.ceil((capacidade - fichas + 1) / por_segundo))
+        return 0
+
+
+class Limitador:
+    """Regras por nome de URL aplicadas aos baldes de conta e de IP"""
+
+    def __init__(self, regras=None, metodos=('POST',), baldes=None, cabecalho_ip=None):
+        self.regras = {
+            nome: {
+                dimensao: taxa(regra[dimensao]) for dimensao in ('POR_CONTA', 'POR_IP') if regra.get(dimensao)
+            }
+            for nome, regra in (regras or {}).items()
+        }
+        self.metodos = set(metodos)
+        self.baldes = baldes or BaldesMemoria()
+        self.cabecalho_ip = cabecalho_ip
+
+    @classmethod
+    def de_settings(cls):
+        config = configuracao()
+        alias_cache = config.get('CACHE_DJANGO')
+        return cls(
+            regras=config.get('REGRAS'),
+            metodos=config.get('METODOS', ('POST',)),
+            baldes=BaldesCache(alias_cache) if alias_cache else BaldesMemoria(config.get('TAMANHO_MAXIMO', 100_000)),
+            cabecalho_ip=config.get('CABECALHO_IP'),
+        )
+
+    def ip(self, request):
+        if self.cabecalho_ip and request.META.get(self.cabecalho_ip):
+            # Proxy reverso confiavel: o primeiro endereco e o do cliente
+            return request.META[self.cabecalho_ip].split(',')[0].strip()
+        return request.META.get('REMOTE_ADDR', '')
+
+    def verificar(self, request, nome_url, kwargs):
+        """0 se a requisicao pode seguir, senao os segundos ate poder tentar de novo"""
+        regra = self.regras.get(nome_url)
+        if not regra or request.method not in self.metodos:
+            return 0
+        baldes = []
+        for dimensao, identificador in (('POR_CONTA', kwargs.get('pk')), ('POR_IP', self.ip(request))):
+            if dimensao in regra and identificador is not None:
+                # Baldes por nome de URL: estourar depositos nao bloqueia o PIX
+                baldes.append((f'{nome_url}:{dimensao}:{identificador}', *regra[dimensao]))
+        # Recusada por um balde, a requisicao nao gasta ficha de nenhum: um IP
+        # estourado nao esvazia o balde da conta que ele esta atacando
+        return self.baldes.consumir_todos(baldes) if baldes else 0
+
+
+class LimiteRequisicoesMiddleware:
+    """Responde 429 quando a conta ou o IP passa do limite da URL (ver LIMITE_REQUISICOES nas settings)"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not configuracao().get('ATIVO'):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.limitador = Limitador.de_settings()
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+            # O Django so chama process_view no loop de eventos, sem passar por uma thread, se ele for async
+            self.process_view = self._process_view_async
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        return await self.get_response(request)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        nome_url = request.resolver_match.url_name
+        return self._recusar(nome_url, self.limitador.verificar(request, nome_url, view_kwargs))
+
+    async def _process_view_async(self, request, view_func, view_args, view_kwargs):
+        nome_url = request.resolver_match.url_name
+        verificar = self.limitador.verificar
+        if isinstance(self.limitador.baldes, BaldesCache):
+            # Os baldes em memoria nao fazem I/O; o cache compartilhado roda fora do loop
+            verificar = sync_to_async(verificar)
+            return self._recusar(nome_url, await verificar(request, nome_url, view_kwargs))
+        return self._recusar(nome_url, verificar(request, nome_url, view_kwargs))
+
+    @staticmethod
+    def _recusar(nome_url, espera):
+        """None para seguir a pilha, ou a resposta 429"""
+        if not espera:
+            return None
+        cabecalhos = {'Retry-After': str(math.ceil(espera))}
+        if nome_url.startswith('api_'):
+            return JsonResponse({'sucesso': False, 'mensagem': MENSAGEM}, status=429, headers=cabecalhos)
+        return HttpResponse(MENSAGEM, status=429, headers=cabecalhos, content_type='text/plain; charset=utf-8')
@@ -0,0 +1,202 @@
+"""Pagamentos em lote (lote PIX / folha de pagamento)"""
+import csv
+import hmac
+import io
+import json
+from collections import defaultdict
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.db import transaction
+
+from .fragmentos import cache_fragmentos
+from .models import (
+    VALOR_MAXIMO, Conta, DiretorioPix, EventoTransacao, Lancamento, Transacao, _bloquear_contas, _calcular_debito,
+    _montar_lancamentos,
+)
+from .shards import primario_da_conta
+
+CAMPOS = ['origem', 'chave_pix', 'conta_destino', 'valor']
+
+
+def tokens_de_integracao():
+    return getattr(settings, 'LOTE_PAGAMENTOS', {}).get('TOKENS', [])
+
+
+def token_valido(request):
+    """True se o cabecalho "Authorization: Bearer <token>" traz um dos TOKENS de LOTE_PAGAMENTOS"""
+    tipo, _, token = request.headers.get('Authorization', '').partition(' ')
+    if tipo.lower() != 'bearer' or not token:
+        return False
+    return any(hmac.compare_digest(token.encode(), valido.encode()) for valido in tokens_de_integracao() if valido)
+
+
+def ler_lote(arquivo, formato):
+    """Le um arquivo CSV (com cabecalho) ou JSON (lista de objetos) com os campos de CAMPOS"""
+    conteudo = arquivo.read()
+    if isinstance(conteudo, bytes):
+        conteudo = conteudo.decode('utf-8-sig')
+
+    if formato == 'json':
+        itens = json.loads(conteudo)
+        if not isinstance(itens, list):
+            raise ValueError('O JSON do lote deve ser uma lista de pagamentos')
+        return itens
+    if formato == 'csv':
+        return list(csv.DictReader(io.StringIO(conteudo)))
+    raise ValueError(f'Formato de lote desconhecido: {formato}')
+
+
+def _validar(item):
+    """Converte uma linha do arquivo em (origem, chave_pix, conta_destino, valor) ou levanta ValueError"""
+    try:
+        origem = int(item.get('origem'))
+    except (TypeError, ValueError):
+        raise ValueError('Conta de origem invalida!')
+
+    chave_pix = str(item.get('chave_pix') or '').strip() or None
+    conta_destino = str(item.get('conta_destino') or '').strip() or None
+    if bool(chave_pix) == bool(conta_destino):
+        raise ValueError('Informe a chave PIX ou a conta destino, nunca as duas!')
+    if conta_destino is not None:
+        try:
+            conta_destino = int(conta_destino)
+        except ValueError:
+            raise ValueError('Conta destino invalida!')
+
+    try:
+        valor = Decimal(str(item.get('valor')).replace(',', '.'))
+    except InvalidOperation:
+        raise ValueError('Valor invalido!')
+    if not valor.is_finite() or valor <= 0 or valor.as_tuple().exponent < -2:
+        raise ValueError('Valor deve ser positivo e ter no maximo duas casas decimais!')
+    if valor > VALOR_MAXIMO:
+        raise ValueError('Valor acima do maximo de uma operacao!')
+
+    return origem, chave_pix, conta_destino, valor
+
+
+def processar_lote(itens):
+    """Executa os pagamentos do lote e retorna um relatorio com o resultado de cada linha.
+
+    As chaves PIX sao resolvidas com uma unica consulta IN ao diretorio e, em
+    cada shard, todas as contas envolvidas sao bloqueadas de uma vez, em ordem
+    crescente de numero. Os debitos e creditos sao aplicados em memoria, linha
+    a linha, e gravados com bulk_update; transacoes e lancamentos com
+    bulk_create. Pagamentos para conta de outro shard seguem um a um pela
+    TransferenciaEntreShards. Linhas invalidas ou sem saldo sao recusadas sem
+    interromper o restante do lote.
+
+    As linhas PIX nao passam pelo motor_antifraude nem entram nas janelas dele,
+    de proposito: o lote so chega pelo sistema de folha (token) ou por um staff,
+    e uma folha paga dezenas de destinos da mesma origem de uma vez, o que as
+    regras de velocidade do PIX do cliente recusariam.
+    """
+    relatorio = []
+    validos = []
+    for linha, item in enumerate(itens, start=1):
+        try:
+            validos.append((linha, *_validar(item)))
+            relatorio.append({'linha': linha, 'sucesso': False, 'mensagem': '', 'transacao': None})
+        except (ValueError, AttributeError) as erro:
+            relatorio.append({'linha': linha, 'sucesso': False, 'mensagem': str(erro), 'transacao': None})
+
+    chaves = {
+        chave: (numero, nome)
+        for chave, numero, nome in DiretorioPix.objects.filter(
+            chave__in={chave_pix for _, _, chave_pix, _, _ in validos if chave_pix},
+            ativa=True,
+        ).values_list('chave', 'conta_numero', 'nome')
+    }
+
+    por_shard = defaultdict(list)
+    entre_shards = []
+    for linha, origem, chave_pix, numero_destino, valor in validos:
+        resultado = relatorio[linha - 1]
+
+        if chave_pix is not None:
+            if chave_pix not in chaves:
+                resultado['mensagem'] = 'Chave PIX nao encontrada ou inativa!'
+                continue
+            numero_destino, nome = chaves[chave_pix]
+            pagamento = (resultado, origem, numero_destino, valor, 'P', f'PIX para {nome}', chave_pix)
+        else:
+            pagamento = (resultado, origem, numero_destino, valor, 'T', f'Transferência para conta {numero_destino}', None)
+
+        banco, banco_destino = primario_da_conta(origem), primario_da_conta(numero_destino)
+        if banco is None:
+            resultado['mensagem'] = f'Conta {origem} não encontrada!'
+        elif banco_destino is None:
+            resultado['mensagem'] = f'Conta {numero_destino} não encontrada!'
+        elif banco == banco_destino:
+            por_shard[banco].append(pagamento)
+        else:
+            entre_shards.append(pagamento)
+
+    for banco, pagamentos in por_shard.items():
+        _pagar_no_shard(banco, pagamentos)
+    for pagamento in entre_shards:
+        _pagar_em_outro_shard(*pagamento)
+    return relatorio
+
+
+def _pagar_no_shard(banco, pagamentos):
+    """Pagamentos com origem e destino no mesmo shard, em uma unica transacao"""
+    with transaction.atomic(using=banco):
+        numeros = {origem for _, origem, _, _, _, _, _ in pagamentos}
+        numeros |= {numero_destino for _, _, numero_destino, _, _, _, _ in pagamentos}
+        contas = _bloquear_contas(*numeros)
+
+        alteradas = {}
+        efetuados = []
+        for resultado, origem, numero_destino, valor, tipo, descricao, chave_pix in pagamentos:
+            conta, conta_destino = contas.get(origem), contas.get(numero_destino)
+            if conta is None:
+                resultado['mensagem'] = f'Conta {origem} não encontrada!'
+            elif conta_destino is None:
+                resultado['mensagem'] = f'Conta {numero_destino} não encontrada!'
+            elif conta is conta_destino:
+                resultado['mensagem'] = 'Não é possível transferir para a mesma conta!'
+            elif valor > conta.saldo_total:
+                resultado['mensagem'] = 'Pagamento não realizado. Saldo insuficiente!'
+            else:
+                partidas = _calcular_debito(conta, valor) + [(numero_destino, 'S', 'C', valor)]
+                conta_destino.saldo += valor
+                alteradas[conta.numero] = conta
+                alteradas[conta_destino.numero] = conta_destino
+                transacao = Transacao(
+                    conta_id=origem,
+                    tipo=tipo,
+                    valor=valor,
+                    conta_destino_id=numero_destino,
+                    chave_pix=chave_pix,
+                    descricao=descricao,
+                )
+                efetuados.append((resultado, transacao, partidas))
+                resultado['sucesso'] = True
+                resultado['mensagem'] = 'Pagamento efetuado com sucesso!'
+
+        Conta.objects.using(banco).bulk_update(alteradas.values(), ['saldo', 'limite'], batch_size=1000)
+        transacoes = Transacao.objects.using(banco).bulk_create([transacao for _, transacao, _ in efetuados], batch_size=1000)
+        EventoTransacao.objects.using(banco).bulk_create(map(EventoTransacao.de_transacao, transacoes), batch_size=1000)
+        lancamentos = []
+        for resultado, transacao, partidas in efetuados:
+            resultado['transacao'] = transacao.pk
+            lancamentos += _montar_lancamentos(partidas, transacao)
+        Lancamento.objects.using(banco).bulk_create(lancamentos, batch_size=1000)
+        cache_fragmentos.invalidar_apos_commit(alteradas, using=banco)
+
+
+def _pagar_em_outro_shard(resultado, origem, numero_destino, valor, tipo, descricao, chave_pix):
+    """Pagamento para conta de outro shard: debito agora, credito depois do commit"""
+    conta = Conta.objects.using(primario_da_conta(origem)).filter(numero=origem).first()
+    if conta is None:
+        resultado['mensagem'] = f'Conta {origem} não encontrada!'
+        return
+    enviada = conta._enviar_para_outro_shard(numero_destino, valor, tipo, descricao, chave_pix)
+    if enviada is None:
+        resultado['mensagem'] = 'Pagamento não realizado. Saldo insuficiente!'
+        return
+    resultado['sucesso'] = True
+    resultado['mensagem'] = 'Pagamento efetuado com sucesso!'
+    resultado['transacao'] = enviada[1].pk
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from contas.arquivamento import arquivar
+
+
+class Command(BaseCommand):
+    help = (
+        "Move para a tabela de arquivo as transacoes mais antigas que ARQUIVAMENTO['DIAS_QUENTES'], "
+        'em lotes (agendar diariamente, fora do pico)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lote', type=int, help="Transacoes por transacao do banco (padrao: ARQUIVAMENTO['TAMANHO_LOTE'])")
+
+    def handle(self, *args, **options):
+        movidas = arquivar(options['lote'])
+        self.stdout.write(self.style.SUCCESS(f'{movidas} transacoes arquivadas.'))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from contas.estatisticas import atualizar_volumes
+
+
+class Command(BaseCommand):
+    help = 'Soma aos volumes do painel as transacoes novas desde a ultima execucao (agendar a cada minuto)'
+
+    def handle(self, *args, **options):
+        processadas = atualizar_volumes()
+        self.stdout.write(self.style.SUCCESS(f'{processadas} transacoes somadas as estatisticas.'))
@@ -0,0 +1,87 @@
+import json
+import platform
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.utils import timezone
+
+from contas.benchmarks import CENARIOS, comparar
+
+
+class Command(BaseCommand):
+    help = 'Executa um cenario de benchmark do app contas em um banco de teste descartavel'
+
+    def add_arguments(self, parser):
+        parser.add_argument('cenario', choices=sorted(CENARIOS))
+        parser.add_argument('--transacoes', type=int, default=100_000, help='Transacoes semeadas')
+        parser.add_argument('--contas', type=int, default=1_000, help='Contas semeadas')
+        parser.add_argument('--operacoes', type=int, default=20_000, help='Operacoes medidas por cenario')
+        parser.add_argument('--amostras', type=int, default=200, help='Operacoes medidas por item (cenario suite)')
+        parser.add_argument('--clientes', type=int, default=50, help='Clientes simultaneos (cenarios api e suite)')
+        parser.add_argument('--json', metavar='ARQUIVO', help='Grava os resultados em JSON')
+        parser.add_argument('--comparar', metavar='ARQUIVO', help='JSON de uma execucao anterior para detectar regressoes')
+        parser.add_argument(
+            '--tolerancia',
+            type=float,
+            default=0.2,
+            help='Piora aceita em relacao ao --comparar antes de falhar (0.2 = 20%%)'
+        )
+        parser.add_argument(
+            '--keepdb',
+            action='store_true',
+            help='Reaproveita o banco de teste entre execucoes'
+        )
+
+    def handle(self, *args, **options):
+        if options['cenario'] == 'suite' and options['contas'] < 2:
+            raise CommandError('O cenario suite precisa de pelo menos 2 contas.')
+
+        # Nunca semeia o banco real: usa o banco de teste configurado em DATABASES['TEST']
+        nome_original = connection.creation.create_test_db(verbosity=0, keepdb=options['keepdb'])
+        # Como no runner de testes, a replica (TEST['MIRROR']) le o banco de teste
+        for alias in connections:
+            espelho = connections[alias].settings_dict['TEST'].get('MIRROR')
+            if espelho == connection.alias:
+                connections[alias].creation.set_as_test_mirror(connection.settings_dict)
+        try:
+            resultados = CENARIOS[options['cenario']](options)
+        finally:
+            connection.creation.destroy_test_db(nome_original, verbosity=0, keepdb=options['keepdb'])
+
+        for linha in resultados:
+            self.stdout.write('  '.join(f'{chave}={valor}' for chave, valor in linha.items()))
+
+        if options['json']:
+            execucao = {
+                'cenario': options['cenario'],
+                'data_hora': timezone.now().isoformat(),
+                'ambiente': {
+                    'python': platform.python_version(),
+                    'django': django.get_version(),
+                    'banco': connection.vendor,
+                    'maquina': platform.platform(),
+                },
+                'opcoes': {
+                    chave: options[chave]
+                    for chave in ('transacoes', 'contas', 'operacoes', 'amostras', 'clientes')
+                },
+                'resultados': resultados,
+            }
+            with open(options['json'], 'w', encoding='utf-8') as arquivo:
+                json.dump(execucao, arquivo, indent=2, ensure_ascii=False)
+
+        if options['comparar']:
+            with open(options['comparar'], encoding='utf-8') as arquivo:
+                base = json.load(arquivo)
+            if base.get('cenario') != options['cenario']:
+                raise CommandError(f'{options["comparar"]} e do cenario {base.get("cenario")}.')
+            regressoes = comparar(base['resultados'], resultados, options['tolerancia'])
+            for regressao in regressoes:
+                self.stderr.write('REGRESSAO  ' + '  '.join(f'{chave}={valor}' for chave, valor in regressao.items()))
+            if regressoes:
+                raise CommandError(
+                    f'{len(regressoes)} regressoes: metricas que pioraram mais de {options["tolerancia"]:.0%} '
+                    'ou linhas presentes em so uma das execucoes.'
+                )
+            self.stdout.write(self.style.SUCCESS('Nenhuma regressao em relacao a execucao anterior.'))
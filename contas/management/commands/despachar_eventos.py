@@ -0,0 +1,30 @@
+import asyncio
+
+from django.core.management.base import BaseCommand, CommandError
+
+from contas.outbox import atraso, despachar
+
+
+class Command(BaseCommand):
+    help = (
+        'Entrega os eventos de transacao (outbox) aos destinos de settings.OUTBOX; '
+        'roda ate ser interrompido, retomando de onde cada destino parou'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--uma-vez', action='store_true', help='Esvazia o outbox e termina')
+        parser.add_argument('--lote', type=int, help='Eventos por lote de cada shard')
+
+    def handle(self, *args, **options):
+        parar = None if options['uma_vez'] else asyncio.Event()
+        try:
+            despachante = despachar(parar, tamanho_lote=options['lote'])
+        except KeyboardInterrupt:
+            return
+        except Exception as erro:
+            raise CommandError(f'Entrega interrompida, o lote sera reenviado: {erro}')
+        for nome, metricas in sorted(despachante.metricas.items()):
+            pendentes, segundos = atraso([nome])[nome]
+            self.stdout.write(self.style.SUCCESS(
+                f'{nome}: {metricas.entregues} eventos entregues, {pendentes} pendentes ({segundos:.0f}s de atraso).'
+            ))
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from contas.exportacao import FORMATOS, periodo_extrato
+from contas.models import Conta
+from contas.shards import no_shard_da_conta
+
+
+class Command(BaseCommand):
+    help = 'Exporta o extrato de uma conta em CSV ou OFX, gravando aos poucos (memoria constante)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('numero', type=int, help='Numero da conta')
+        parser.add_argument('--formato', choices=sorted(FORMATOS), default='csv')
+        parser.add_argument('--inicio', help='Primeiro dia do periodo (AAAA-MM-DD)')
+        parser.add_argument('--fim', help='Ultimo dia do periodo (AAAA-MM-DD)')
+        parser.add_argument('--saida', help='Arquivo de saida (padrao: saida padrao)')
+
+    def handle(self, *args, **options):
+        try:
+            conta = no_shard_da_conta(Conta.objects, options['numero']).get(numero=options['numero'])
+        except Conta.DoesNotExist:
+            raise CommandError(f'Conta {options["numero"]} não encontrada!')
+        try:
+            inicio, fim = periodo_extrato(options['inicio'], options['fim'])
+        except ValueError as erro:
+            raise CommandError(str(erro))
+
+        pedacos = FORMATOS[options['formato']][0](conta, inicio, fim)
+        if options['saida']:
+            with open(options['saida'], 'w', encoding='utf-8', newline='') as saida:
+                for pedaco in pedacos:
+                    saida.write(pedaco)
+        else:
+            for pedaco in pedacos:
+                self.stdout.write(pedaco, ending='')
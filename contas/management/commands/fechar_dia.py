@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from contas.fechamento import fechar
+
+
+class Command(BaseCommand):
+    help = (
+        'Fechamento do dia em lote: recompoe o limite usado, cobra juros do limite e a tarifa mensal '
+        '(agendar depois da meia-noite; retoma de onde parou)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ate', help='Ultimo dia a fechar (AAAA-MM-DD, padrao: ontem)')
+
+    def handle(self, *args, **options):
+        ate = None
+        if options['ate']:
+            ate = parse_date(options['ate'])
+            if ate is None:
+                raise CommandError(f'Data invalida: {options["ate"]}')
+        alteradas = fechar(ate)
+        self.stdout.write(self.style.SUCCESS(f'{alteradas} contas alteradas no fechamento.'))
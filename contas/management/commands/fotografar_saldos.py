@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from contas.saldos import fotografar
+
+
+class Command(BaseCommand):
+    help = 'Grava o saldo no fim do dia das contas movimentadas nos dias fechados (agendar logo apos a meia-noite)'
+
+    def handle(self, *args, **options):
+        gravadas = fotografar()
+        self.stdout.write(self.style.SUCCESS(f'{gravadas} saldos diarios gravados.'))
@@ -0,0 +1,33 @@
+import csv
+
+from django.core.management.base import BaseCommand, CommandError
+
+from contas.importacao import TAMANHO_BLOCO, Rejeitada, importar_clientes
+
+
+class Command(BaseCommand):
+    help = 'Importa clientes e abre suas contas a partir de um CSV (nome, email, cpf, data_nascimento)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('arquivo', help='Arquivo CSV com cabecalho')
+        parser.add_argument('--chave-pix', action='store_true', help='Cadastra uma chave PIX aleatoria para cada conta')
+        parser.add_argument('--bloco', type=int, default=TAMANHO_BLOCO, help='Linhas validadas e gravadas por vez')
+        parser.add_argument('--rejeitadas', help='Grava as linhas recusadas e o motivo neste arquivo CSV')
+
+    def handle(self, *args, **options):
+        try:
+            with open(options['arquivo'], encoding='utf-8-sig', newline='') as arquivo:
+                importados, rejeitadas = importar_clientes(arquivo, options['chave_pix'], options['bloco'])
+        except (OSError, csv.Error) as erro:
+            raise CommandError(f'Nao foi possivel ler o arquivo: {erro}')
+
+        if options['rejeitadas']:
+            with open(options['rejeitadas'], 'w', newline='', encoding='utf-8') as saida:
+                escritor = csv.writer(saida)
+                escritor.writerow(Rejeitada._fields)
+                escritor.writerows(rejeitadas)
+        else:
+            for rejeitada in rejeitadas:
+                self.stdout.write(self.style.WARNING(f'Linha {rejeitada.linha}: {rejeitada.motivo}'))
+
+        self.stdout.write(self.style.SUCCESS(f'{importados} clientes importados, {len(rejeitadas)} linhas recusadas.'))
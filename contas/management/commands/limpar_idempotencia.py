@@ -0,0 +1,21 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from contas.models import Idempotencia
+from contas.shards import shards
+
+
+class Command(BaseCommand):
+    help = 'Apaga chaves de idempotencia mais antigas que a janela de retentativa (agendar diariamente)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--horas', type=int, default=24, help='Janela em que uma repeticao ainda e reconhecida')
+
+    def handle(self, *args, **options):
+        limite = timezone.now() - timedelta(hours=options['horas'])
+        apagadas = sum(
+            Idempotencia.objects.using(alias).filter(criada_em__lt=limite).delete()[0] for alias in shards()
+        )
+        self.stdout.write(self.style.SUCCESS(f'{apagadas} chaves de idempotencia apagadas.'))
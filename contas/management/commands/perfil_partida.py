@@ -0,0 +1,79 @@
+import json
+import os
+import subprocess
+import sys
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Roda em um interpretador novo com -X importtime: o import do modulo inclui o
+# django.setup() e o aquecimento (contas/aquecimento.py)
+SCRIPT = '''
+import json, sys, time
+inicio = time.perf_counter()
+# __import__ e nao importlib.import_module: so o import nativo aparece no importtime
+__import__(sys.argv[1])
+total = (time.perf_counter() - inicio) * 1000
+from contas.aquecimento import medidas
+print(json.dumps({'total_ms': total, 'aquecimento': medidas}))
+'''
+
+
+def ler_importtime(texto):
+    """[(modulo, proprio_us, acumulado_us)] das linhas de "python -X importtime", na ordem em que terminaram"""
+    modulos = []
+    for linha in texto.splitlines():
+        if not linha.startswith('import time:') or 'imported package' in linha:
+            continue
+        proprio, acumulado, modulo = linha[len('import time:'):].split('|')
+        modulos.append((modulo.strip(), int(proprio), int(acumulado)))
+    return modulos
+
+
+class Command(BaseCommand):
+    help = (
+        'Mede a partida de um processo novo: tempo de importacao de cada modulo de bancoprojeto.wsgi '
+        '(ou asgi), incluindo o django.setup(), e de cada etapa do aquecimento'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--alvo', choices=['wsgi', 'asgi'], default='wsgi')
+        parser.add_argument('--limite', type=int, default=30, help='Modulos (ou pacotes) listados')
+        parser.add_argument('--ordenar', choices=['acumulado', 'proprio'], default='acumulado')
+        parser.add_argument('--pacotes', action='store_true', help='Soma o tempo proprio por pacote de primeiro nivel')
+
+    def handle(self, *args, **options):
+        alvo = f'bancoprojeto.{options["alvo"]}'
+        # O processo novo usa as mesmas settings deste (inclusive as de --settings)
+        ambiente = {**os.environ, 'DJANGO_SETTINGS_MODULE': settings.SETTINGS_MODULE}
+        processo = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', SCRIPT, alvo],
+            cwd=settings.BASE_DIR, env=ambiente, capture_output=True, text=True,
+        )
+        if processo.returncode:
+            raise CommandError(f'Falha ao importar {alvo}:\n{processo.stderr[-2000:]}')
+        resultado = json.loads(processo.stdout.splitlines()[-1])
+        modulos = ler_importtime(processo.stderr)
+
+        if options['pacotes']:
+            pacotes = defaultdict(lambda: [0, 0])
+            for modulo, proprio, _ in modulos:
+                pacotes[modulo.split('.')[0]][0] += proprio
+                pacotes[modulo.split('.')[0]][1] += 1
+            self.stdout.write(f'{"proprio_ms":>11}  {"modulos":>7}  pacote')
+            for pacote, (proprio, quantidade) in sorted(pacotes.items(), key=lambda item: -item[1][0])[:options['limite']]:
+                self.stdout.write(f'{proprio / 1000:11.1f}  {quantidade:7d}  {pacote}')
+        else:
+            indice = 1 if options['ordenar'] == 'proprio' else 2
+            self.stdout.write(f'{"proprio_ms":>11}  {"acumulado_ms":>12}  modulo')
+            for modulo, proprio, acumulado in sorted(modulos, key=lambda item: -item[indice])[:options['limite']]:
+                self.stdout.write(f'{proprio / 1000:11.1f}  {acumulado / 1000:12.1f}  {modulo}')
+
+        etapas = '  '.join(
+            f'{etapa}={itens} ({milissegundos:.1f} ms)' for etapa, (itens, milissegundos) in resultado['aquecimento'].items()
+        )
+        self.stdout.write(f'Aquecimento: {etapas or "desligado"}')
+        self.stdout.write(self.style.SUCCESS(
+            f'{alvo} ({settings.SETTINGS_MODULE}): {resultado["total_ms"]:.1f} ms, {len(modulos)} modulos importados.'
+        ))
@@ -0,0 +1,24 @@
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from contas.shards import faixa, preparar_sequencias, shards
+
+
+class Command(BaseCommand):
+    help = 'Cria as tabelas de um shard novo e faz seus numeros de conta comecarem na faixa dele'
+
+    def add_arguments(self, parser):
+        parser.add_argument('alias', help="Alias em DATABASES, ja incluido em SHARDING['SHARDS']")
+
+    def handle(self, *args, **options):
+        alias = options['alias']
+        if alias not in connections.settings:
+            raise CommandError(f'Banco {alias} nao esta em DATABASES')
+        if alias not in shards():
+            raise CommandError(f"Inclua {alias} em SHARDING['SHARDS'] antes de prepara-lo")
+
+        call_command('migrate', database=alias, interactive=False, verbosity=options['verbosity'])
+        preparar_sequencias(alias)
+        inicio, fim = faixa(alias)
+        self.stdout.write(self.style.SUCCESS(f'Shard {alias} pronto para as contas {inicio} a {fim - 1}.'))
@@ -0,0 +1,41 @@
+import csv
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from contas.lote import ler_lote, processar_lote
+
+
+class Command(BaseCommand):
+    help = 'Processa um arquivo de pagamentos em lote (origem, chave_pix ou conta_destino, valor)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('arquivo', help='Arquivo CSV com cabecalho ou JSON com uma lista de pagamentos')
+        parser.add_argument('--formato', choices=['csv', 'json'], help='Padrao: deduzido pela extensao')
+        parser.add_argument('--relatorio', help='Grava o resultado de cada linha neste arquivo CSV')
+
+    def handle(self, *args, **options):
+        caminho = Path(options['arquivo'])
+        formato = options['formato'] or ('json' if caminho.suffix.lower() == '.json' else 'csv')
+        try:
+            with caminho.open('rb') as arquivo:
+                itens = ler_lote(arquivo, formato)
+        except (OSError, ValueError, csv.Error) as erro:
+            raise CommandError(f'Nao foi possivel ler o lote: {erro}')
+
+        relatorio = processar_lote(itens)
+
+        if options['relatorio']:
+            with open(options['relatorio'], 'w', newline='', encoding='utf-8') as saida:
+                escritor = csv.DictWriter(saida, fieldnames=['linha', 'sucesso', 'mensagem', 'transacao'])
+                escritor.writeheader()
+                escritor.writerows(relatorio)
+
+        for linha in relatorio:
+            if not linha['sucesso']:
+                self.stdout.write(self.style.WARNING(f'Linha {linha["linha"]}: {linha["mensagem"]}'))
+
+        efetuados = sum(1 for linha in relatorio if linha['sucesso'])
+        self.stdout.write(self.style.SUCCESS(
+            f'{efetuados} de {len(relatorio)} pagamentos efetuados.'
+        ))
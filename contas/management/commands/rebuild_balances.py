@@ -0,0 +1,81 @@
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from contas.fragmentos import cache_fragmentos
+from contas.models import Conta, Lancamento, soma_rubrica
+from contas.shards import shards
+
+
+class Command(BaseCommand):
+    help = 'Recalcula Conta.saldo e Conta.limite a partir do razao (Lancamento), em lotes de contas'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Contas processadas por lote')
+        parser.add_argument(
+            '--verificar',
+            action='store_true',
+            help='Apenas informa as divergencias, sem corrigir os saldos'
+        )
+
+    def handle(self, *args, **options):
+        total_contas = divergentes = 0
+        for alias in shards():
+            contas, divergencias = self.reconstruir(alias, options['chunk_size'], options['verificar'])
+            total_contas += contas
+            divergentes += divergencias
+
+        acao = 'encontradas' if options['verificar'] else 'corrigidas'
+        self.stdout.write(self.style.SUCCESS(
+            f'{total_contas} contas verificadas, {divergentes} divergencias {acao}.'
+        ))
+
+    def reconstruir(self, alias, chunk_size, verificar):
+        """Confere as contas de um shard; retorna (contas verificadas, divergencias)"""
+        ultimo_numero = 0
+        total_contas = 0
+        divergentes = 0
+
+        while True:
+            # Cada lote bloqueia apenas as proprias contas, nunca a tabela inteira
+            with transaction.atomic(using=alias):
+                contas = list(
+                    Conta.objects.using(alias).select_for_update()
+                    .filter(numero__gt=ultimo_numero)
+                    .order_by('numero')
+                    .only('numero', 'saldo', 'limite')[:chunk_size]
+                )
+                if not contas:
+                    break
+
+                projecoes = {
+                    linha['conta']: linha
+                    for linha in Lancamento.objects.using(alias).filter(conta__in=contas)
+                    .values('conta')
+                    .annotate(saldo=soma_rubrica('S'), limite=soma_rubrica('L'))
+                    .order_by()
+                }
+
+                corrigir = []
+                for conta in contas:
+                    projecao = projecoes.get(conta.numero, {})
+                    saldo = projecao.get('saldo') or Decimal('0.00')
+                    limite = projecao.get('limite') or Decimal('0.00')
+                    if (conta.saldo, conta.limite) != (saldo, limite):
+                        divergentes += 1
+                        self.stdout.write(
+                            f'Conta {conta.numero}: saldo {conta.saldo} -> {saldo}, '
+                            f'limite {conta.limite} -> {limite}'
+                        )
+                        conta.saldo, conta.limite = saldo, limite
+                        corrigir.append(conta)
+
+                if corrigir and not verificar:
+                    Conta.objects.using(alias).bulk_update(corrigir, ['saldo', 'limite'])
+                    cache_fragmentos.invalidar_apos_commit((conta.numero for conta in corrigir), using=alias)
+
+            total_contas += len(contas)
+            ultimo_numero = contas[-1].numero
+
+        return total_contas, divergentes
@@ -0,0 +1,127 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from contas.models import ChavePix, DiretorioPix
+from contas.shards import primario_da_conta, shards
+
+
+class Command(BaseCommand):
+    help = (
+        'Confere o DiretorioPix (banco default) contra as chaves PIX de cada shard e corrige: '
+        'inclui chaves sem entrada, atualiza nome e ativa e apaga entradas sem chave'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Chaves conferidas por lote')
+        parser.add_argument(
+            '--carencia',
+            type=int,
+            default=10,
+            help='Minutos de vida de uma entrada antes de ela poder ser apagada por nao ter chave'
+        )
+        parser.add_argument(
+            '--verificar',
+            action='store_true',
+            help='Apenas informa as divergencias, sem corrigir o diretorio'
+        )
+
+    def handle(self, *args, **options):
+        # A chave e o diretorio ficam em bancos diferentes e nao ha commit atomico
+        # entre eles (ChavePix.save, importar_clientes): uma falha entre os dois
+        # commits deixa um lado sem o outro. A entrada e gravada antes do commit
+        # do shard, entao uma entrada recente sem chave pode ser de uma chave
+        # ainda em gravacao: so as mais antigas que a carencia sao apagadas.
+        chunk_size, verificar = options['chunk_size'], options['verificar']
+        faltando = divergentes = conflitos = 0
+        for alias in shards():
+            incluidas, atualizadas, em_conflito = self.conferir_chaves(alias, chunk_size, verificar)
+            faltando += incluidas
+            divergentes += atualizadas
+            conflitos += em_conflito
+        limite = timezone.now() - timedelta(minutes=options['carencia'])
+        orfas = self.conferir_diretorio(chunk_size, verificar, limite)
+
+        acao = 'encontradas' if verificar else 'corrigidas'
+        self.stdout.write(self.style.SUCCESS(
+            f'{faltando} chaves sem entrada, {divergentes} entradas divergentes e {orfas} entradas sem chave {acao}.'
+        ))
+        if conflitos:
+            self.stderr.write(
+                f'{conflitos} chaves cadastradas em uma conta com a entrada do diretorio apontando para outra; '
+                'nada foi alterado nelas.'
+            )
+
+    def conferir_chaves(self, alias, chunk_size, verificar):
+        """Chaves do shard sem entrada ou com entrada divergente; retorna (sem entrada, divergentes, conflitos).
+
+        Uma entrada de outra conta nunca e trocada: ou a chave dela ainda
+        existe (a mesma chave em dois shards, decidido por quem opera), ou a
+        entrada e apagada por conferir_diretorio e incluida na execucao seguinte.
+        """
+        ultimo_pk = 0
+        faltando = divergentes = conflitos = 0
+        while True:
+            chaves = list(
+                ChavePix.objects.using(alias).filter(pk__gt=ultimo_pk).order_by('pk')
+                .values_list('pk', 'chave', 'conta_id', 'ativa', 'conta__cliente__nome')[:chunk_size]
+            )
+            if not chaves:
+                break
+            ultimo_pk = chaves[-1][0]
+
+            entradas = {
+                entrada.chave: entrada
+                for entrada in DiretorioPix.objects.filter(chave__in=[chave for _, chave, *_ in chaves])
+            }
+            incluir, atualizar = [], []
+            for _, chave, numero, ativa, nome in chaves:
+                entrada = entradas.get(chave)
+                if entrada is None:
+                    incluir.append(DiretorioPix(chave=chave, conta_numero=numero, nome=nome, ativa=ativa))
+                elif entrada.conta_numero != numero:
+                    conflitos += 1
+                elif (entrada.nome, entrada.ativa) != (nome, ativa):
+                    entrada.nome, entrada.ativa = nome, ativa
+                    atualizar.append(entrada)
+
+            if not verificar:
+                with transaction.atomic():
+                    DiretorioPix.objects.bulk_create(incluir)
+                    DiretorioPix.objects.bulk_update(atualizar, ['nome', 'ativa'])
+            faltando += len(incluir)
+            divergentes += len(atualizar)
+        return faltando, divergentes, conflitos
+
+    def conferir_diretorio(self, chunk_size, verificar, limite):
+        """Entradas criadas antes de limite cuja chave nao existe no shard da conta; retorna quantas"""
+        ultimo_pk = 0
+        orfas = 0
+        while True:
+            entradas = list(
+                DiretorioPix.objects.filter(pk__gt=ultimo_pk, criado_em__lt=limite).order_by('pk')
+                .values_list('pk', 'chave', 'conta_numero')[:chunk_size]
+            )
+            if not entradas:
+                break
+            ultimo_pk = entradas[-1][0]
+
+            por_shard = {}
+            for pk, chave, numero in entradas:
+                por_shard.setdefault(primario_da_conta(numero), []).append((pk, chave, numero))
+            apagar = []
+            for alias, itens in por_shard.items():
+                # Conta fora das faixas dos shards: nenhuma chave pode existir
+                existentes = set(
+                    ChavePix.objects.using(alias).filter(chave__in=[chave for _, chave, _ in itens])
+                    .values_list('chave', 'conta_id')
+                ) if alias else set()
+                apagar += [pk for pk, chave, numero in itens if (chave, numero) not in existentes]
+
+            if apagar and not verificar:
+                # criado_em de novo: a entrada pode ter sido recriada (ChavePix.save) depois da leitura
+                DiretorioPix.objects.filter(pk__in=apagar, criado_em__lt=limite).delete()
+            orfas += len(apagar)
+        return orfas
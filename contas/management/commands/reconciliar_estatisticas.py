@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from contas.estatisticas import reconciliar
+
+
+class Command(BaseCommand):
+    help = 'Recalcula do zero as estatisticas do painel e corrige desvios (varre as tabelas)'
+
+    def handle(self, *args, **options):
+        divergencias = reconciliar()
+        for nome, antes, depois in divergencias:
+            self.stdout.write(f'{nome}: {antes[0]} / R$ {antes[1]} -> {depois[0]} / R$ {depois[1]}')
+        self.stdout.write(self.style.SUCCESS(f'{len(divergencias)} estatisticas corrigidas.'))
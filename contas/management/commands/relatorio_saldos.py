@@ -0,0 +1,32 @@
+import csv
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from contas.saldos import saldos_no_fim_do_dia
+
+
+class Command(BaseCommand):
+    help = 'Saldo de todas as contas no fim de um dia (fechamento do mes) em CSV, a partir das fotos diarias'
+
+    def add_arguments(self, parser):
+        parser.add_argument('data', help='Dia do fechamento (AAAA-MM-DD)')
+        parser.add_argument('--saida', help='Arquivo de saida (padrao: saida padrao)')
+
+    def handle(self, *args, **options):
+        dia = parse_date(options['data'])
+        if dia is None:
+            raise CommandError(f'Data invalida: {options["data"]}')
+        try:
+            linhas = saldos_no_fim_do_dia(dia)
+        except ValueError as erro:
+            raise CommandError(str(erro))
+
+        saida = open(options['saida'], 'w', encoding='utf-8', newline='') if options['saida'] else self.stdout
+        try:
+            escritor = csv.writer(saida, lineterminator='\n')
+            escritor.writerow(['conta', 'saldo', 'limite'])
+            escritor.writerows((numero, f'{saldo:.2f}', f'{limite:.2f}') for numero, saldo, limite in linhas)
+        finally:
+            if options['saida']:
+                saida.close()
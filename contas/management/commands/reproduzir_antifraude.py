@@ -0,0 +1,59 @@
+import csv
+from collections import Counter
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from contas.antifraude import historico_pix, reproduzir
+from contas.saldos import inicio_do_dia
+
+
+class Command(BaseCommand):
+    help = (
+        'Pontua o historico de PIX com as regras de settings.ANTIFRAUDE como se estivessem ativas: '
+        'recusas por regra e tempo de avaliacao'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--desde', help='Primeiro dia (AAAA-MM-DD)')
+        parser.add_argument('--ate', help='Ultimo dia (AAAA-MM-DD)')
+        parser.add_argument('--recusados', help='CSV com os PIX que seriam recusados')
+
+    def handle(self, *args, **options):
+        periodo = []
+        for opcao, deslocamento in (('desde', 0), ('ate', 1)):
+            dia = None
+            if options[opcao]:
+                dia = parse_date(options[opcao])
+                if dia is None:
+                    raise CommandError(f'Data invalida: {options[opcao]}')
+                dia = inicio_do_dia(dia + timedelta(days=deslocamento))
+            periodo.append(dia)
+
+        recusas, tempos = Counter(), []
+        arquivo = open(options['recusados'], 'w', encoding='utf-8', newline='') if options['recusados'] else None
+        try:
+            escritor = csv.writer(arquivo, lineterminator='\n') if arquivo else None
+            if escritor:
+                escritor.writerow(['data_hora', 'conta', 'destino', 'valor', 'regra', 'pontuacao'])
+            for (conta, destino, valor, momento), avaliacao, segundos in reproduzir(historico_pix(*periodo)):
+                tempos.append(segundos)
+                if not avaliacao.aprovado:
+                    recusas[avaliacao.regra] += 1
+                    if escritor:
+                        escritor.writerow([momento.isoformat(), conta, destino, f'{valor:.2f}', avaliacao.regra, avaliacao.pontuacao])
+        finally:
+            if arquivo:
+                arquivo.close()
+
+        if not tempos:
+            self.stdout.write('Nenhum PIX no periodo.')
+            return
+        tempos.sort()
+        p99 = tempos[min(len(tempos) - 1, int(len(tempos) * 0.99))] * 1_000_000
+        for regra, quantidade in recusas.most_common():
+            self.stdout.write(f'{regra}: {quantidade}')
+        self.stdout.write(self.style.SUCCESS(
+            f'{len(tempos)} PIX avaliados, {sum(recusas.values())} seriam recusados; p99 da avaliacao {p99:.1f} us.'
+        ))
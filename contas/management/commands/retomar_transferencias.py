@@ -0,0 +1,31 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from contas.models import TransferenciaEntreShards
+from contas.shards import shards
+
+
+class Command(BaseCommand):
+    help = 'Conclui (ou estorna) transferencias entre shards que ficaram pendentes (agendar a cada minuto)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--segundos', type=int, default=30,
+            help='So retoma as pendentes ha mais tempo, para nao competir com o on_commit da requisicao'
+        )
+
+    def handle(self, *args, **options):
+        limite = timezone.now() - timedelta(seconds=options['segundos'])
+        estados = {estado: 0 for estado, _ in TransferenciaEntreShards.ESTADO_CHOICES}
+        for alias in shards():
+            pendentes = TransferenciaEntreShards.objects.using(alias).filter(
+                estado=TransferenciaEntreShards.PENDENTE, criada_em__lt=limite
+            )
+            for transferencia in list(pendentes):
+                estados[transferencia.concluir()] += 1
+
+        self.stdout.write(self.style.SUCCESS(
+            f'{estados["C"]} transferencias concluidas, {estados["E"]} estornadas, {estados["P"]} ainda pendentes.'
+        ))
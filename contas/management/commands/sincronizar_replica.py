@@ -0,0 +1,31 @@
+import sqlite3
+from contextlib import closing
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from contas.roteador import configuracao
+
+
+class Command(BaseCommand):
+    help = (
+        'Copia o banco SQLite primario para o arquivo da replica (teste local do roteamento '
+        'de leituras; o intervalo entre execucoes simula o atraso de replicacao)'
+    )
+
+    def handle(self, *args, **options):
+        replica, _ = configuracao()
+        if replica not in connections.settings:
+            raise CommandError(f'Banco "{replica}" nao configurado em DATABASES.')
+
+        primario, destino = connections[DEFAULT_DB_ALIAS], connections[replica]
+        if primario.vendor != 'sqlite' or destino.vendor != 'sqlite':
+            raise CommandError('So copia bancos SQLite; use a replicacao do proprio servidor de banco.')
+        if str(primario.settings_dict['NAME']) == str(destino.settings_dict['NAME']):
+            raise CommandError('A replica usa o mesmo arquivo do primario: nada a copiar.')
+
+        # A API de backup copia uma imagem consistente mesmo com o primario em uso
+        with closing(sqlite3.connect(primario.settings_dict['NAME'])) as origem:
+            with closing(sqlite3.connect(destino.settings_dict['NAME'])) as alvo:
+                origem.backup(alvo)
+        self.stdout.write(self.style.SUCCESS(f'Replica {destino.settings_dict["NAME"]} atualizada.'))
@@ -0,0 +1,59 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:37
+
+import django.core.validators
+import django.db.models.deletion
+import uuid
+from decimal import Decimal
+from django.db import migrations, models
+
+
+def registrar_saldos_de_abertura(apps, schema_editor):
+    """Lanca no razao o saldo e o limite atuais de cada conta existente"""
+    Conta = apps.get_model('contas', 'Conta')
+    Lancamento = apps.get_model('contas', 'Lancamento')
+
+    lancamentos = []
+    for numero, saldo, limite in Conta.objects.values_list('numero', 'saldo', 'limite').iterator(chunk_size=2000):
+        movimento = uuid.uuid4()
+        for rubrica, valor in (('S', saldo), ('L', limite)):
+            if valor:
+                lancamentos += [
+                    Lancamento(movimento=movimento, conta_id=numero, rubrica=rubrica, natureza='C',
+                               valor=valor, historico='Saldo de abertura do razao'),
+                    Lancamento(movimento=movimento, conta_id=None, rubrica='S', natureza='D',
+                               valor=valor, historico='Saldo de abertura do razao'),
+                ]
+        if len(lancamentos) >= 2000:
+            Lancamento.objects.bulk_create(lancamentos)
+            lancamentos = []
+    Lancamento.objects.bulk_create(lancamentos)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contas', '0002_transacao_chave_pix_alter_transacao_descricao_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Lancamento',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('movimento', models.UUIDField(db_index=True, verbose_name='Movimento')),
+                ('rubrica', models.CharField(choices=[('S', 'Saldo'), ('L', 'Limite')], max_length=1, verbose_name='Rubrica')),
+                ('natureza', models.CharField(choices=[('C', 'Credito'), ('D', 'Debito')], max_length=1, verbose_name='Natureza')),
+                ('valor', models.DecimalField(decimal_places=2, max_digits=12, validators=[django.core.validators.MinValueValidator(Decimal('0.01'))], verbose_name='Valor')),
+                ('historico', models.CharField(blank=True, max_length=200, verbose_name='Historico')),
+                ('data_hora', models.DateTimeField(auto_now_add=True, verbose_name='Data/Hora')),
+                ('conta', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='lancamentos', to='contas.conta', verbose_name='Conta')),
+                ('transacao', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='lancamentos', to='contas.transacao', verbose_name='Transacao')),
+            ],
+            options={
+                'verbose_name': 'Lancamento',
+                'verbose_name_plural': 'Lancamentos',
+                'ordering': ['id'],
+            },
+        ),
+        migrations.RunPython(registrar_saldos_de_abertura, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contas', '0003_lancamento'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='transacao',
+            index=models.Index(fields=['conta', '-data_hora', '-id'], name='transacao_conta_data_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transacao',
+            index=models.Index(fields=['conta_destino', '-data_hora', '-id'], name='transacao_destino_data_idx'),
+        ),
+    ]
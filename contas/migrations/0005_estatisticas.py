@@ -0,0 +1,53 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:46
+
+from decimal import Decimal
+from django.db import migrations, models
+
+
+def contar_clientes_e_contas(apps, schema_editor):
+    """Inicializa os contadores mantidos por sinais; os volumes vem do primeiro atualizar_estatisticas"""
+    Estatistica = apps.get_model('contas', 'Estatistica')
+    for nome, modelo in (('clientes', 'Cliente'), ('contas', 'Conta')):
+        Estatistica.objects.create(nome=nome, quantidade=apps.get_model('contas', modelo).objects.count())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contas', '0004_transacao_indices_extrato'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Estatistica',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nome', models.CharField(max_length=50, unique=True, verbose_name='Nome')),
+                ('quantidade', models.BigIntegerField(default=0, verbose_name='Quantidade')),
+                ('valor', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=18, verbose_name='Valor')),
+                ('atualizado_em', models.DateTimeField(auto_now=True, verbose_name='Atualizado em')),
+            ],
+            options={
+                'verbose_name': 'Estatistica',
+                'verbose_name_plural': 'Estatisticas',
+                'ordering': ['nome'],
+            },
+        ),
+        migrations.CreateModel(
+            name='VolumeDiario',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('data', models.DateField(verbose_name='Data')),
+                ('tipo', models.CharField(choices=[('D', 'Deposito'), ('S', 'Saque'), ('T', 'Transferencia'), ('P', 'PIX')], max_length=1, verbose_name='Tipo')),
+                ('quantidade', models.BigIntegerField(default=0, verbose_name='Quantidade')),
+                ('total', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=18, verbose_name='Total')),
+            ],
+            options={
+                'verbose_name': 'Volume Diario',
+                'verbose_name_plural': 'Volumes Diarios',
+                'ordering': ['-data', 'tipo'],
+                'constraints': [models.UniqueConstraint(fields=('data', 'tipo'), name='volume_diario_data_tipo_unico')],
+            },
+        ),
+        migrations.RunPython(contar_clientes_e_contas, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:52
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contas', '0005_estatisticas'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Idempotencia',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('chave', models.CharField(max_length=100, verbose_name='Chave')),
+                ('operacao', models.CharField(max_length=1, verbose_name='Operacao')),
+                ('impressao', models.CharField(max_length=64, verbose_name='Impressao dos parametros')),
+                ('resultado', models.JSONField(verbose_name='Resultado')),
+                ('criada_em', models.DateTimeField(auto_now_add=True, db_index=True, verbose_name='Criada em')),
+                ('conta', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='idempotencias', to='contas.conta', verbose_name='Conta')),
+            ],
+            options={
+                'verbose_name': 'Chave de idempotencia',
+                'verbose_name_plural': 'Chaves de idempotencia',
+                'constraints': [models.UniqueConstraint(fields=('conta', 'chave'), name='idempotencia_conta_chave_unica')],
+            },
+        ),
+    ]
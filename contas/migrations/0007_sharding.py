@@ -0,0 +1,92 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:11
+
+import django.db.models.deletion
+import uuid
+from django.db import migrations, models
+
+
+def preencher_diretorio_pix(apps, schema_editor):
+    """Todas as chaves existentes estao no banco default, o unico shard antes desta migracao"""
+    alias = schema_editor.connection.alias
+    ChavePix = apps.get_model('contas', 'ChavePix')
+    DiretorioPix = apps.get_model('contas', 'DiretorioPix')
+    DiretorioPix.objects.using(alias).bulk_create(
+        [
+            DiretorioPix(chave=chave, conta_numero=conta_id, nome=nome, ativa=ativa)
+            for chave, conta_id, nome, ativa in ChavePix.objects.using(alias).values_list(
+                'chave', 'conta_id', 'conta__cliente__nome', 'ativa'
+            )
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contas', '0006_idempotencia'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DiretorioPix',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('chave', models.CharField(max_length=200, unique=True, verbose_name='Chave PIX')),
+                ('conta_numero', models.BigIntegerField(db_index=True, verbose_name='Conta')),
+                ('nome', models.CharField(max_length=200, verbose_name='Nome do cliente')),
+                ('ativa', models.BooleanField(default=True, verbose_name='Ativa')),
+            ],
+            options={
+                'verbose_name': 'Diretorio PIX',
+                'verbose_name_plural': 'Diretorio PIX',
+                'ordering': ['chave'],
+            },
+        ),
+        migrations.AddField(
+            model_name='transacao',
+            name='transferencia',
+            field=models.UUIDField(blank=True, db_index=True, null=True, verbose_name='Transferencia entre shards'),
+        ),
+        migrations.AlterField(
+            model_name='transacao',
+            name='conta',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='transacoes', to='contas.conta', verbose_name='Conta'),
+        ),
+        migrations.AlterField(
+            model_name='transacao',
+            name='conta_destino',
+            field=models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='transferencias_recebidas', to='contas.conta', verbose_name='Conta Destino'),
+        ),
+        migrations.AlterField(
+            model_name='transacao',
+            name='tipo',
+            field=models.CharField(choices=[('D', 'Deposito'), ('S', 'Saque'), ('T', 'Transferencia'), ('P', 'PIX'), ('E', 'Estorno')], max_length=1, verbose_name='Tipo'),
+        ),
+        migrations.AlterField(
+            model_name='volumediario',
+            name='tipo',
+            field=models.CharField(choices=[('D', 'Deposito'), ('S', 'Saque'), ('T', 'Transferencia'), ('P', 'PIX'), ('E', 'Estorno')], max_length=1, verbose_name='Tipo'),
+        ),
+        migrations.CreateModel(
+            name='TransferenciaEntreShards',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('numero_destino', models.BigIntegerField(verbose_name='Conta Destino')),
+                ('tipo', models.CharField(choices=[('D', 'Deposito'), ('S', 'Saque'), ('T', 'Transferencia'), ('P', 'PIX'), ('E', 'Estorno')], max_length=1, verbose_name='Tipo')),
+                ('valor', models.DecimalField(decimal_places=2, max_digits=12, verbose_name='Valor')),
+                ('chave_pix', models.CharField(blank=True, max_length=200, null=True, verbose_name='Chave PIX')),
+                ('descricao', models.TextField(blank=True, verbose_name='Descricao')),
+                ('estado', models.CharField(choices=[('P', 'Pendente'), ('C', 'Concluida'), ('E', 'Estornada')], db_index=True, default='P', max_length=1, verbose_name='Estado')),
+                ('criada_em', models.DateTimeField(auto_now_add=True, verbose_name='Criada em')),
+                ('atualizada_em', models.DateTimeField(auto_now=True, verbose_name='Atualizada em')),
+                ('conta', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='transferencias_entre_shards', to='contas.conta', verbose_name='Conta')),
+            ],
+            options={
+                'verbose_name': 'Transferencia entre shards',
+                'verbose_name_plural': 'Transferencias entre shards',
+                'ordering': ['criada_em'],
+            },
+        ),
+        migrations.RunPython(preencher_diretorio_pix, migrations.RunPython.noop),
+    ]
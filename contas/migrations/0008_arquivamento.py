@@ -0,0 +1,40 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:14
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contas', '0007_sharding'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='lancamento',
+            name='transacao',
+            field=models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='lancamentos', to='contas.transacao', verbose_name='Transacao'),
+        ),
+        migrations.CreateModel(
+            name='TransacaoArquivada',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False, verbose_name='ID')),
+                ('tipo', models.CharField(choices=[('D', 'Deposito'), ('S', 'Saque'), ('T', 'Transferencia'), ('P', 'PIX'), ('E', 'Estorno')], max_length=1, verbose_name='Tipo')),
+                ('valor', models.DecimalField(decimal_places=2, max_digits=12, verbose_name='Valor')),
+                ('chave_pix', models.CharField(blank=True, max_length=200, null=True, verbose_name='Chave PIX')),
+                ('data_hora', models.DateTimeField(verbose_name='Data/Hora')),
+                ('descricao', models.TextField(blank=True, verbose_name='Descricao')),
+                ('transferencia', models.UUIDField(blank=True, null=True, verbose_name='Transferencia entre shards')),
+                ('arquivada_em', models.DateTimeField(auto_now_add=True, verbose_name='Arquivada em')),
+                ('conta', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='contas.conta', verbose_name='Conta')),
+                ('conta_destino', models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='contas.conta', verbose_name='Conta Destino')),
+            ],
+            options={
+                'verbose_name': 'Transação arquivada',
+                'verbose_name_plural': 'Transações arquivadas',
+                'ordering': ['-data_hora'],
+                'indexes': [models.Index(fields=['conta', '-data_hora', '-id'], name='arquivada_conta_data_idx'), models.Index(fields=['conta_destino', '-data_hora', '-id'], name='arquivada_destino_data_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:17
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contas', '0008_arquivamento'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SaldoDiario',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('data', models.DateField(verbose_name='Data')),
+                ('saldo', models.DecimalField(decimal_places=2, max_digits=14, verbose_name='Saldo')),
+                ('limite', models.DecimalField(decimal_places=2, max_digits=14, verbose_name='Limite')),
+            ],
+            options={
+                'verbose_name': 'Saldo Diario',
+                'verbose_name_plural': 'Saldos Diarios',
+                'ordering': ['conta', '-data'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='lancamento',
+            index=models.Index(fields=['conta', 'data_hora'], name='lancamento_conta_data_idx'),
+        ),
+        migrations.AddField(
+            model_name='saldodiario',
+            name='conta',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='saldos_diarios', to='contas.conta', verbose_name='Conta'),
+        ),
+        migrations.AddConstraint(
+            model_name='saldodiario',
+            constraint=models.UniqueConstraint(fields=('conta', 'data'), name='saldo_diario_conta_data_unico'),
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:21
+
+import django.core.validators
+from decimal import Decimal
+from django.db import migrations, models
+
+
+def preencher_limite_contratado(apps, schema_editor):
+    """Sem historico do contrato, o limite contratado das contas existentes e o disponivel hoje"""
+    Conta = apps.get_model('contas', 'Conta')
+    Conta.objects.using(schema_editor.connection.alias).update(limite_contratado=models.F('limite'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contas', '0009_saldos_diarios'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conta',
+            name='limite_contratado',
+            field=models.DecimalField(decimal_places=2, default=Decimal('100.00'), max_digits=12, validators=[django.core.validators.MinValueValidator(Decimal('0.00'))], verbose_name='Limite contratado'),
+        ),
+        migrations.RunPython(preencher_limite_contratado, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='transacao',
+            name='tipo',
+            field=models.CharField(choices=[('D', 'Deposito'), ('S', 'Saque'), ('T', 'Transferencia'), ('P', 'PIX'), ('E', 'Estorno'), ('J', 'Juros'), ('F', 'Tarifa')], max_length=1, verbose_name='Tipo'),
+        ),
+        migrations.AlterField(
+            model_name='transacaoarquivada',
+            name='tipo',
+            field=models.CharField(choices=[('D', 'Deposito'), ('S', 'Saque'), ('T', 'Transferencia'), ('P', 'PIX'), ('E', 'Estorno'), ('J', 'Juros'), ('F', 'Tarifa')], max_length=1, verbose_name='Tipo'),
+        ),
+        migrations.AlterField(
+            model_name='transferenciaentreshards',
+            name='tipo',
+            field=models.CharField(choices=[('D', 'Deposito'), ('S', 'Saque'), ('T', 'Transferencia'), ('P', 'PIX'), ('E', 'Estorno'), ('J', 'Juros'), ('F', 'Tarifa')], max_length=1, verbose_name='Tipo'),
+        ),
+        migrations.AlterField(
+            model_name='volumediario',
+            name='tipo',
+            field=models.CharField(choices=[('D', 'Deposito'), ('S', 'Saque'), ('T', 'Transferencia'), ('P', 'PIX'), ('E', 'Estorno'), ('J', 'Juros'), ('F', 'Tarifa')], max_length=1, verbose_name='Tipo'),
+        ),
+    ]
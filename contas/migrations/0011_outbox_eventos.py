@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:27
+
+import django.core.serializers.json
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contas', '0010_fechamento_do_dia'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EventoTransacao',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('transacao_id', models.BigIntegerField(verbose_name='Transacao')),
+                ('dados', models.JSONField(encoder=django.core.serializers.json.DjangoJSONEncoder, verbose_name='Dados')),
+                ('criado_em', models.DateTimeField(auto_now_add=True, verbose_name='Criado em')),
+            ],
+            options={
+                'verbose_name': 'Evento de transacao',
+                'verbose_name_plural': 'Eventos de transacao',
+                'ordering': ['id'],
+            },
+        ),
+    ]
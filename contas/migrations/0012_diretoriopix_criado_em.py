@@ -0,0 +1,18 @@
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contas', '0011_outbox_eventos'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='diretoriopix',
+            name='criado_em',
+            field=models.DateTimeField(auto_now_add=True, default=django.utils.timezone.now, verbose_name='Criado em'),
+            preserve_default=False,
+        ),
+    ]
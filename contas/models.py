@@ -1,8 +1,97 @@
-from django.db import models
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, IntegrityError, models, router, transaction
+from django.db.models import Case, DecimalField, F, Sum, Value, When
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
 from django.core.validators import MinValueValidator
+from django.utils import timezone
 from decimal import Decimal
+import functools
+import hashlib
+import json
 import uuid
 
+from .antifraude import MENSAGENS as MENSAGENS_ANTIFRAUDE, motor_antifraude
+from .cache_pix import DestinoPix, resolvedor_pix
+from .fragmentos import cache_fragmentos
+from .perfil import secao
+from .shards import primario_da_conta
+
+MENSAGEM_CHAVE_REUTILIZADA = 'Chave de idempotencia ja utilizada em outra operacao!'
+# Maior valor de uma operacao: o que cabe em Transacao.valor e Lancamento.valor (12 digitos, 2 casas)
+VALOR_MAXIMO = Decimal('9999999999.99')
+MENSAGEM_VALOR_INVALIDO = 'Valor invalido: use no maximo duas casas decimais e ate R$ 9.999.999.999,99!'
+
+
+def _idempotente(operacao):
+    """Torna a operacao de Conta repetivel com o argumento chave_idempotencia.
+
+    O resultado da primeira execucao e gravado em Idempotencia na mesma
+    transacao que altera o saldo; repeticoes com a mesma chave devolvem o
+    resultado gravado com uma unica leitura, sem bloquear nem alterar Conta.
+    A mesma chave com outros parametros e recusada.
+    """
+    def decorador(metodo):
+        @functools.wraps(metodo)
+        def executar(self, *args, chave_idempotencia=None, **kwargs):
+            if not chave_idempotencia:
+                return metodo(self, *args, **kwargs)
+
+            banco = self.banco
+            impressao = _impressao(operacao, args, kwargs)
+            registros = Idempotencia.objects.using(banco).filter(conta_id=self.numero, chave=chave_idempotencia)
+            registro = registros.first()
+            if registro is not None:
+                return registro.repetir(operacao, impressao)
+            try:
+                with transaction.atomic(using=banco):
+                    # Confere de novo ja com a escrita reservada
+                    registro = registros.first()
+                    if registro is not None:
+                        return registro.repetir(operacao, impressao)
+                    resultado = metodo(self, *args, **kwargs)
+                    Idempotencia.objects.using(banco).create(
+                        conta_id=self.numero,
+                        chave=chave_idempotencia,
+                        operacao=operacao,
+                        impressao=impressao,
+                        resultado=list(resultado),
+                    )
+            except IntegrityError:
+                # Outra requisicao com a mesma chave gravou primeiro
+                registro = registros.first()
+                if registro is None:
+                    raise
+                return registro.repetir(operacao, impressao)
+            return resultado
+        return executar
+    return decorador
+
+
+def erro_de_valor(valor, mensagem_positivo):
+    """Mensagem de recusa do valor de uma operacao, ou None se ele pode ir para o razao sem arredondar"""
+    if not valor.is_finite():
+        return MENSAGEM_VALOR_INVALIDO
+    if valor <= 0:
+        return mensagem_positivo
+    if valor.as_tuple().exponent < -2 or valor > VALOR_MAXIMO:
+        return MENSAGEM_VALOR_INVALIDO
+    return None
+
+
+def _impressao(operacao, args, kwargs):
+    """Resumo dos parametros da operacao, para detectar a mesma chave com outros dados"""
+    def normalizar(valor):
+        if isinstance(valor, Conta):
+            return valor.numero
+        if isinstance(valor, (Decimal, float, int)):
+            return format(Decimal(str(valor)).normalize(), 'f')
+        return str(valor)
+
+    parametros = [
+        operacao, [normalizar(valor) for valor in args], sorted((k, normalizar(v)) for k, v in kwargs.items()),
+    ]
+    return hashlib.sha256(json.dumps(parametros).encode()).hexdigest()
+
 
 class Cliente(models.Model):
     """Modelo para representar um cliente do banco"""
@@ -44,6 +133,15 @@ class Conta(models.Model):
         validators=[MinValueValidator(Decimal('0.00'))],
         verbose_name='Limite'
     )
+    # limite e o que ainda esta disponivel; o fechamento do dia (contas/fechamento.py)
+    # cobra juros sobre a diferenca e recompoe o limite com o saldo que entrar
+    limite_contratado = models.DecimalField(
+        max_digits=12,
+        decimal_places=2,
+        default=Decimal('100.00'),
+        validators=[MinValueValidator(Decimal('0.00'))],
+        verbose_name='Limite contratado'
+    )
     data_abertura = models.DateTimeField(auto_now_add=True, verbose_name='Data de Abertura')
 
     class Meta:
@@ -59,95 +157,243 @@ class Conta(models.Model):
         """Calcula o saldo total (saldo + limite)"""
         return self.saldo + self.limite
 
+    @property
+    def banco(self):
+        """Alias do shard que guarda a conta e tudo o que e dela (contas/shards.py)"""
+        return primario_da_conta(self.numero)
+
+    def save(self, *args, **kwargs):
+        """Ao abrir a conta, registra no razao o saldo e o limite iniciais"""
+        nova = self._state.adding
+        banco = kwargs.get('using') or router.db_for_write(Conta, instance=self)
+        if nova:
+            self.limite_contratado = self.limite
+        with transaction.atomic(using=banco):
+            super().save(*args, **kwargs)
+            if nova:
+                if self.banco != banco:
+                    raise ValueError(
+                        f'Conta {self.numero} fora da faixa do shard {banco}: rode "manage.py preparar_shard {banco}"'
+                    )
+                partidas = []
+                if self.saldo:
+                    partidas += [(self.numero, 'S', 'C', self.saldo), _caixa('D', self.saldo)]
+                if self.limite:
+                    partidas += [(self.numero, 'L', 'C', self.limite), _caixa('D', self.limite)]
+                _lancar(partidas, historico='Abertura de conta')
+
+    def ajustar_limite(self, novo_limite):
+        """Altera o limite (contratado e disponivel) da conta registrando a diferenca no razao"""
+        novo_limite = Decimal(str(novo_limite))
+        with transaction.atomic(using=self.banco):
+            conta = _bloquear_contas(self.numero)[self.numero]
+            diferenca = novo_limite - conta.limite
+            Conta.objects.using(self.banco).filter(numero=self.numero).update(
+                limite=novo_limite, limite_contratado=novo_limite
+            )
+            if diferenca:
+                natureza, contrapartida = ('C', 'D') if diferenca > 0 else ('D', 'C')
+                _lancar(
+                    [(self.numero, 'L', natureza, abs(diferenca)), _caixa(contrapartida, abs(diferenca))],
+                    historico='Ajuste de limite'
+                )
+        self.limite = self.limite_contratado = novo_limite
+
+    @_idempotente('D')
     def depositar(self, valor):
         """Realiza um depósito na conta"""
-        if valor > 0:
-            self.saldo += Decimal(str(valor))
-            self.save()
-            return True, 'Depósito efetuado com sucesso!'
-        return False, 'Erro ao efetuar depósito. Valor deve ser positivo!'
+        valor = Decimal(str(valor))
+        erro = erro_de_valor(valor, 'Erro ao efetuar depósito. Valor deve ser positivo!')
+        if erro:
+            return False, erro
+
+        with transaction.atomic(using=self.banco):
+            partidas = _creditar(self.numero, valor) + [_caixa('D', valor)]
+            transacao = Transacao.objects.using(self.banco).create(
+                conta=self,
+                tipo='D',
+                valor=valor,
+                descricao='Depósito em conta'
+            )
+            _lancar(partidas, transacao)
 
+        self.refresh_from_db(fields=['saldo'])
+        return True, 'Depósito efetuado com sucesso!'
+
+    @_idempotente('S')
     def sacar(self, valor):
         """Realiza um saque na conta"""
         valor = Decimal(str(valor))
-        if valor <= 0:
-            return False, 'Valor do saque deve ser positivo!'
+        erro = erro_de_valor(valor, 'Valor do saque deve ser positivo!')
+        if erro:
+            return False, erro
 
-        if valor > self.saldo_total:
-            return False, 'Saque não realizado. Saldo insuficiente!'
+        with transaction.atomic(using=self.banco):
+            conta = _bloquear_contas(self.numero)[self.numero]
 
-        if self.saldo >= valor:
-            self.saldo -= valor
-        else:
-            # Usa parte do limite
-            restante = valor - self.saldo
-            self.saldo = Decimal('0.00')
-            self.limite -= restante
+            if valor > conta.saldo_total:
+                return False, 'Saque não realizado. Saldo insuficiente!'
+
+            partidas = _debitar(conta, valor) + [_caixa('C', valor)]
+            transacao = Transacao.objects.using(self.banco).create(
+                conta=self,
+                tipo='S',
+                valor=valor,
+                descricao='Saque em conta'
+            )
+            _lancar(partidas, transacao)
 
-        self.save()
+        self.saldo, self.limite = conta.saldo, conta.limite
         return True, 'Saque efetuado com sucesso!'
 
+    @_idempotente('T')
     def transferir(self, conta_destino, valor):
-        """Realiza uma transferência para outra conta"""
+        """Realiza uma transferência para outra conta.
+
+        Para conta de outro shard o credito no destino e feito logo depois do
+        commit do debito (ver TransferenciaEntreShards).
+        """
         valor = Decimal(str(valor))
 
-        if valor <= 0:
-            return False, 'Valor da transferência deve ser positivo!'
+        erro = erro_de_valor(valor, 'Valor da transferência deve ser positivo!')
+        if erro:
+            return False, erro
+
+        if conta_destino.numero == self.numero:
+            return False, 'Não é possível transferir para a mesma conta!'
 
-        if valor > self.saldo_total:
-            return False, 'Transferência não realizada. Saldo insuficiente!'
+        descricao = f'Transferência para conta {conta_destino.numero}'
+        if conta_destino.banco != self.banco:
+            enviada = self._enviar_para_outro_shard(conta_destino.numero, valor, 'T', descricao)
+            if enviada is None:
+                return False, 'Transferência não realizada. Saldo insuficiente!'
+            self.saldo, self.limite = enviada[0].saldo, enviada[0].limite
+            return True, 'Transferência efetuada com sucesso!'
 
-        # Debita da conta origem
-        if self.saldo >= valor:
-            self.saldo -= valor
-        else:
-            restante = valor - self.saldo
-            self.saldo = Decimal('0.00')
-            self.limite -= restante
+        with transaction.atomic(using=self.banco):
+            conta = _bloquear_contas(self.numero, conta_destino.numero)[self.numero]
 
-        # Credita na conta destino
-        conta_destino.saldo += valor
+            if valor > conta.saldo_total:
+                return False, 'Transferência não realizada. Saldo insuficiente!'
 
-        self.save()
-        conta_destino.save()
+            partidas = _debitar(conta, valor) + _creditar(conta_destino.numero, valor)
+            transacao = Transacao.objects.using(self.banco).create(
+                conta=self,
+                tipo='T',
+                valor=valor,
+                conta_destino=conta_destino,
+                descricao=descricao
+            )
+            _lancar(partidas, transacao)
 
+        self.saldo, self.limite = conta.saldo, conta.limite
+        conta_destino.refresh_from_db(fields=['saldo'])
         return True, 'Transferência efetuada com sucesso!'
 
+    @_idempotente('P')
     def transferir_pix(self, chave_pix, valor):
-        """Realiza uma transferencia via PIX"""
-        valor = Decimal(str(valor))
+        """Realiza uma transferencia via PIX.
 
-        if valor <= 0:
-            return False, 'Valor do PIX deve ser positivo!', None
+        Retorna (sucesso, mensagem, destino), onde destino e o DestinoPix
+        (numero da conta e nome do cliente) resolvido pela chave.
+        """
+        valor = Decimal(str(valor))
 
-        if valor > self.saldo_total:
-            return False, 'PIX nao realizado. Saldo insuficiente!', None
+        erro = erro_de_valor(valor, 'Valor do PIX deve ser positivo!')
+        if erro:
+            return False, erro, None
 
-        # Buscar conta destino pela chave PIX
-        try:
-            chave_obj = ChavePix.objects.get(chave=chave_pix, ativa=True)
-            conta_destino = chave_obj.conta
-        except ChavePix.DoesNotExist:
+        # Buscar conta destino pela chave PIX (DestinoPix com numero e nome do cliente)
+        with secao('pix.resolver_chave'):
+            destino = resolvedor_pix.resolver(chave_pix)
+        if destino is None:
             return False, 'Chave PIX nao encontrada ou inativa!', None
 
-        if conta_destino.numero == self.numero:
+        if destino.numero == self.numero:
             return False, 'Nao e possivel enviar PIX para a mesma conta!', None
 
-        # Debita da conta origem
-        if self.saldo >= valor:
-            self.saldo -= valor
-        else:
-            restante = valor - self.saldo
-            self.saldo = Decimal('0.00')
-            self.limite -= restante
+        if primario_da_conta(destino.numero) != self.banco:
+            with secao('pix.movimentar'):
+                enviada = self._enviar_para_outro_shard(
+                    destino.numero, valor, 'P', f'PIX para {destino.nome}', chave_pix,
+                    validar=lambda: _avaliar_pix(self.numero, destino.numero, valor, self.banco),
+                )
+            if enviada is None:
+                return False, 'PIX nao realizado. Saldo insuficiente!', None
+            if isinstance(enviada, str):
+                return False, enviada, None
+            self.saldo, self.limite = enviada[0].saldo, enviada[0].limite
+            return True, 'PIX efetuado com sucesso!', destino
+
+        # Inclui a espera pela reserva de escrita do banco (BEGIN IMMEDIATE)
+        with secao('pix.movimentar'), transaction.atomic(using=self.banco):
+            contas = _bloquear_contas(self.numero, destino.numero)
+            if destino.numero not in contas:
+                # Conta removida depois que a chave entrou no cache
+                return False, 'Chave PIX nao encontrada ou inativa!', None
+            conta = contas[self.numero]
+
+            if valor > conta.saldo_total:
+                return False, 'PIX nao realizado. Saldo insuficiente!', None
+
+            recusa = _avaliar_pix(self.numero, destino.numero, valor, self.banco)
+            if recusa:
+                return False, recusa, None
+
+            partidas = _debitar(conta, valor) + _creditar(destino.numero, valor)
+            transacao = Transacao.objects.using(self.banco).create(
+                conta=self,
+                tipo='P',
+                valor=valor,
+                conta_destino_id=destino.numero,
+                chave_pix=chave_pix,
+                descricao=f'PIX para {destino.nome}'
+            )
+            _lancar(partidas, transacao)
+
+        self.saldo, self.limite = conta.saldo, conta.limite
+        return True, 'PIX efetuado com sucesso!', destino
 
-        # Credita na conta destino
-        conta_destino.saldo += valor
+    def _enviar_para_outro_shard(self, numero_destino, valor, tipo, descricao, chave_pix=None, validar=None):
+        """Primeira etapa de uma transferencia para conta de outro shard.
 
-        self.save()
-        conta_destino.save()
+        Debita a origem contra o caixa do shard e grava a TransferenciaEntreShards
+        pendente na mesma transacao; o credito no destino roda depois do commit.
+        validar() roda com a origem ja bloqueada e o saldo conferido; se devolver
+        uma mensagem, nada e gravado e ela e o retorno. Senao retorna
+        (conta bloqueada, transacao de saida) ou None se o saldo nao basta.
+        """
+        with transaction.atomic(using=self.banco):
+            conta = _bloquear_contas(self.numero)[self.numero]
+            if valor > conta.saldo_total:
+                return None
+            recusa = validar() if validar else None
+            if recusa:
+                return recusa
 
-        return True, 'PIX efetuado com sucesso!', conta_destino
+            transferencia = TransferenciaEntreShards(
+                conta_id=self.numero,
+                numero_destino=numero_destino,
+                tipo=tipo,
+                valor=valor,
+                chave_pix=chave_pix,
+                descricao=descricao,
+            )
+            partidas = _debitar(conta, valor) + [_caixa('C', valor)]
+            transacao = Transacao.objects.using(self.banco).create(
+                conta_id=self.numero,
+                tipo=tipo,
+                valor=valor,
+                conta_destino_id=numero_destino,
+                chave_pix=chave_pix,
+                descricao=descricao,
+                transferencia=transferencia.id,
+            )
+            _lancar(partidas, transacao)
+            transferencia.save(using=self.banco)
+            # Uma falha aqui so deixa a transferencia pendente para retomar_transferencias
+            transaction.on_commit(transferencia.concluir, using=self.banco, robust=True)
+        return conta, transacao
 
     @property
     def chave_pix_principal(self):
@@ -156,6 +402,41 @@ class Conta(models.Model):
         return chave.chave if chave else None
 
 
+class Idempotencia(models.Model):
+    """Resultado gravado de uma operacao com chave de idempotencia do cliente"""
+    conta = models.ForeignKey(
+        Conta,
+        on_delete=models.CASCADE,
+        related_name='idempotencias',
+        verbose_name='Conta'
+    )
+    chave = models.CharField(max_length=100, verbose_name='Chave')
+    operacao = models.CharField(max_length=1, verbose_name='Operacao')
+    impressao = models.CharField(max_length=64, verbose_name='Impressao dos parametros')
+    resultado = models.JSONField(verbose_name='Resultado')
+    criada_em = models.DateTimeField(auto_now_add=True, db_index=True, verbose_name='Criada em')
+
+    class Meta:
+        verbose_name = 'Chave de idempotencia'
+        verbose_name_plural = 'Chaves de idempotencia'
+        constraints = [
+            models.UniqueConstraint(fields=['conta', 'chave'], name='idempotencia_conta_chave_unica'),
+        ]
+
+    def __str__(self):
+        return f'Conta {self.conta_id} - {self.chave}'
+
+    def repetir(self, operacao, impressao):
+        """Devolve o resultado gravado no mesmo formato do metodo de Conta"""
+        if (self.operacao, self.impressao) != (operacao, impressao):
+            # PIX tambem devolve o destino
+            return (False, MENSAGEM_CHAVE_REUTILIZADA) + ((None,) if operacao == 'P' else ())
+        resultado = list(self.resultado)
+        if operacao == 'P' and resultado[2] is not None:
+            resultado[2] = DestinoPix(*resultado[2])
+        return tuple(resultado)
+
+
 class ChavePix(models.Model):
     """Modelo para representar chaves PIX"""
     TIPO_CHAVE_CHOICES = [
@@ -192,6 +473,24 @@ class ChavePix(models.Model):
     def __str__(self):
         return f'{self.get_tipo_chave_display()}: {self.chave}'
 
+    def validate_unique(self, exclude=None):
+        """A chave tambem nao pode existir em outro shard (ver DiretorioPix)"""
+        super().validate_unique(exclude)
+        if exclude and 'chave' in exclude:
+            return
+        existentes = DiretorioPix.objects.filter(chave=self.chave)
+        if self.pk:
+            existentes = existentes.exclude(conta_numero=self.conta_id)
+        if existentes.exists():
+            raise ValidationError({'chave': [self.unique_error_message(ChavePix, ['chave'])]})
+
+    def save(self, *args, **kwargs):
+        """Grava a chave no shard da conta e no diretorio global, tudo ou nada"""
+        banco = kwargs.get('using') or router.db_for_write(ChavePix, instance=self)
+        with transaction.atomic(using=banco):
+            super().save(*args, **kwargs)
+            DiretorioPix.registrar(self)
+
     @staticmethod
     def gerar_chave_aleatoria():
         """Gera uma chave PIX aleatoria no formato UUID"""
@@ -205,11 +504,17 @@ class Transacao(models.Model):
         ('S', 'Saque'),
         ('T', 'Transferencia'),
         ('P', 'PIX'),
+        ('E', 'Estorno'),
+        ('J', 'Juros'),
+        ('F', 'Tarifa'),
     ]
 
+    # Sem constraint no banco: a transacao de entrada de uma transferencia entre
+    # shards fica no shard do destino e aponta para a conta de origem, que nao esta nele
     conta = models.ForeignKey(
         Conta,
         on_delete=models.CASCADE,
+        db_constraint=False,
         related_name='transacoes',
         verbose_name='Conta'
     )
@@ -223,6 +528,7 @@ class Transacao(models.Model):
     conta_destino = models.ForeignKey(
         Conta,
         on_delete=models.SET_NULL,
+        db_constraint=False,
         null=True,
         blank=True,
         related_name='transferencias_recebidas',
@@ -236,11 +542,540 @@ class Transacao(models.Model):
     )
     data_hora = models.DateTimeField(auto_now_add=True, verbose_name='Data/Hora')
     descricao = models.TextField(blank=True, verbose_name='Descricao')
+    # Liga as transacoes de saida, de entrada e de estorno de uma TransferenciaEntreShards
+    transferencia = models.UUIDField(null=True, blank=True, db_index=True, verbose_name='Transferencia entre shards')
 
     class Meta:
         verbose_name = 'Transação'
         verbose_name_plural = 'Transações'
         ordering = ['-data_hora']
+        indexes = [
+            # Historico e extrato: filtram pela conta e percorrem por data sem ordenar
+            models.Index(fields=['conta', '-data_hora', '-id'], name='transacao_conta_data_idx'),
+            models.Index(fields=['conta_destino', '-data_hora', '-id'], name='transacao_destino_data_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.get_tipo_display()} - R$ {self.valor} - {self.data_hora.strftime("%d/%m/%Y %H:%M")}'
+
+
+class TransacaoArquivada(models.Model):
+    """Transacao antiga movida da tabela quente por arquivar_transacoes, com o mesmo id.
+
+    Tem os campos de Transacao, entao o extrato mostra as duas do mesmo jeito.
+    """
+    id = models.BigIntegerField(primary_key=True, verbose_name='ID')
+    conta = models.ForeignKey(
+        Conta,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        related_name='+',
+        verbose_name='Conta'
+    )
+    tipo = models.CharField(max_length=1, choices=Transacao.TIPO_CHOICES, verbose_name='Tipo')
+    valor = models.DecimalField(max_digits=12, decimal_places=2, verbose_name='Valor')
+    conta_destino = models.ForeignKey(
+        Conta,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        null=True,
+        blank=True,
+        related_name='+',
+        verbose_name='Conta Destino'
+    )
+    chave_pix = models.CharField(max_length=200, null=True, blank=True, verbose_name='Chave PIX')
+    data_hora = models.DateTimeField(verbose_name='Data/Hora')
+    descricao = models.TextField(blank=True, verbose_name='Descricao')
+    transferencia = models.UUIDField(null=True, blank=True, verbose_name='Transferencia entre shards')
+    arquivada_em = models.DateTimeField(auto_now_add=True, verbose_name='Arquivada em')
+
+    CAMPOS = [
+        'id', 'conta_id', 'tipo', 'valor', 'conta_destino_id', 'chave_pix', 'data_hora', 'descricao', 'transferencia',
+    ]
+
+    class Meta:
+        verbose_name = 'Transação arquivada'
+        verbose_name_plural = 'Transações arquivadas'
+        ordering = ['-data_hora']
+        indexes = [
+            models.Index(fields=['conta', '-data_hora', '-id'], name='arquivada_conta_data_idx'),
+            models.Index(fields=['conta_destino', '-data_hora', '-id'], name='arquivada_destino_data_idx'),
+        ]
 
     def __str__(self):
         return f'{self.get_tipo_display()} - R$ {self.valor} - {self.data_hora.strftime("%d/%m/%Y %H:%M")}'
+
+    @classmethod
+    def de_transacao(cls, transacao):
+        return cls(**{campo: getattr(transacao, campo) for campo in cls.CAMPOS})
+
+
+class EventoTransacao(models.Model):
+    """Outbox: evento de cada transacao criada, gravado na mesma transacao do banco.
+
+    Fica no shard da transacao e e entregue aos destinos configurados pelo
+    despachante (contas/outbox.py), que guarda ate onde cada destino ja leu.
+    """
+    transacao_id = models.BigIntegerField(verbose_name='Transacao')
+    dados = models.JSONField(encoder=DjangoJSONEncoder, verbose_name='Dados')
+    criado_em = models.DateTimeField(auto_now_add=True, verbose_name='Criado em')
+
+    class Meta:
+        verbose_name = 'Evento de transacao'
+        verbose_name_plural = 'Eventos de transacao'
+        ordering = ['id']
+
+    def __str__(self):
+        return f'Evento {self.pk} - Transacao {self.transacao_id}'
+
+    @classmethod
+    def de_transacao(cls, transacao):
+        return cls(
+            transacao_id=transacao.pk,
+            dados={
+                'id': transacao.pk,
+                'tipo': transacao.tipo,
+                'valor': transacao.valor,
+                'conta': transacao.conta_id,
+                'conta_destino': transacao.conta_destino_id,
+                'chave_pix': transacao.chave_pix,
+                'descricao': transacao.descricao,
+                'data_hora': transacao.data_hora,
+                'transferencia': transacao.transferencia,
+            },
+        )
+
+
+class TransferenciaEntreShards(models.Model):
+    """Transferencia (ou PIX) para conta de outro shard, executada como saga.
+
+    1. No shard da origem, em uma unica transacao: debito da conta contra o
+       caixa do shard, Transacao de saida e este registro, pendente.
+    2. Depois do commit, no shard do destino: credito da conta contra o caixa
+       dele e a Transacao de entrada, com o mesmo campo transferencia.
+
+    A segunda etapa e idempotente e pode ser repetida (retomar_transferencias)
+    ate concluir; se a conta destino nao existe, a origem e estornada.
+    """
+    PENDENTE = 'P'
+    CONCLUIDA = 'C'
+    ESTORNADA = 'E'
+    ESTADO_CHOICES = [
+        (PENDENTE, 'Pendente'),
+        (CONCLUIDA, 'Concluida'),
+        (ESTORNADA, 'Estornada'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    conta = models.ForeignKey(
+        Conta,
+        on_delete=models.CASCADE,
+        related_name='transferencias_entre_shards',
+        verbose_name='Conta'
+    )
+    numero_destino = models.BigIntegerField(verbose_name='Conta Destino')
+    tipo = models.CharField(max_length=1, choices=Transacao.TIPO_CHOICES, verbose_name='Tipo')
+    valor = models.DecimalField(max_digits=12, decimal_places=2, verbose_name='Valor')
+    chave_pix = models.CharField(max_length=200, null=True, blank=True, verbose_name='Chave PIX')
+    descricao = models.TextField(blank=True, verbose_name='Descricao')
+    estado = models.CharField(
+        max_length=1,
+        choices=ESTADO_CHOICES,
+        default=PENDENTE,
+        db_index=True,
+        verbose_name='Estado'
+    )
+    criada_em = models.DateTimeField(auto_now_add=True, verbose_name='Criada em')
+    atualizada_em = models.DateTimeField(auto_now=True, verbose_name='Atualizada em')
+
+    class Meta:
+        verbose_name = 'Transferencia entre shards'
+        verbose_name_plural = 'Transferencias entre shards'
+        ordering = ['criada_em']
+
+    def __str__(self):
+        return f'Conta {self.conta_id} -> {self.numero_destino}: R$ {self.valor} ({self.get_estado_display()})'
+
+    def concluir(self):
+        """Segunda etapa: credita o destino no shard dele e retorna o novo estado"""
+        if self.estado != self.PENDENTE:
+            return self.estado
+        banco_destino = primario_da_conta(self.numero_destino)
+        creditada = False
+        if banco_destino is not None:
+            try:
+                with transaction.atomic(using=banco_destino):
+                    creditada = self._creditar_destino(banco_destino)
+            except DatabaseError:
+                # Shard do destino indisponivel: fica pendente
+                return self.estado
+        if not creditada:
+            return self.estornar()
+        self._marcar(self.CONCLUIDA)
+        return self.estado
+
+    def _creditar_destino(self, banco):
+        """Credita o destino uma unica vez; False se a conta destino nao existe"""
+        contas = _bloquear_contas(self.numero_destino)
+        if Transacao.objects.using(banco).filter(transferencia=self.id).exists():
+            return True
+        if self.numero_destino not in contas:
+            return False
+        transacao = Transacao.objects.using(banco).create(
+            conta_id=self.conta_id,
+            tipo=self.tipo,
+            valor=self.valor,
+            conta_destino_id=self.numero_destino,
+            chave_pix=self.chave_pix,
+            descricao=self.descricao,
+            transferencia=self.id,
+        )
+        _lancar(_creditar(self.numero_destino, self.valor) + [_caixa('D', self.valor)], transacao)
+        return True
+
+    def estornar(self):
+        """Devolve o valor a conta de origem e retorna o novo estado"""
+        banco = primario_da_conta(self.conta_id)
+        with transaction.atomic(using=banco):
+            if not self._marcar(self.ESTORNADA):
+                return self.estado
+            _bloquear_contas(self.conta_id)
+            transacao = Transacao.objects.using(banco).create(
+                conta_id=self.conta_id,
+                tipo='E',
+                valor=self.valor,
+                descricao=f'Estorno: conta {self.numero_destino} não encontrada',
+                transferencia=self.id,
+            )
+            _lancar(_creditar(self.conta_id, self.valor) + [_caixa('D', self.valor)], transacao)
+        return self.estado
+
+    def _marcar(self, estado):
+        """Sai de pendente no shard da origem; False se outra execucao ja tirou"""
+        alteradas = TransferenciaEntreShards.objects.using(primario_da_conta(self.conta_id)).filter(
+            pk=self.pk, estado=self.PENDENTE
+        ).update(estado=estado, atualizada_em=timezone.now())
+        if alteradas:
+            self.estado = estado
+        else:
+            self.refresh_from_db(fields=['estado'])
+        return bool(alteradas)
+
+
+class LancamentoQuerySet(models.QuerySet):
+    """Lancamentos nao podem ser alterados nem apagados em massa"""
+
+    def update(self, **kwargs):
+        raise ValueError('Lancamentos do razao sao imutaveis!')
+
+    def delete(self):
+        raise ValueError('Lancamentos do razao sao imutaveis!')
+
+
+class Lancamento(models.Model):
+    """Lancamento imutavel do razao em partidas dobradas.
+
+    Cada movimento grava debitos e creditos de mesmo total; conta vazia
+    representa o caixa do banco. Conta.saldo e Conta.limite sao projecoes
+    (cache) da soma dos lancamentos de cada rubrica.
+    """
+    NATUREZA_CHOICES = [
+        ('C', 'Credito'),
+        ('D', 'Debito'),
+    ]
+    RUBRICA_CHOICES = [
+        ('S', 'Saldo'),
+        ('L', 'Limite'),
+    ]
+
+    movimento = models.UUIDField(db_index=True, verbose_name='Movimento')
+    # Sem constraint: a transacao antiga sai da tabela quente e vai para
+    # TransacaoArquivada com o mesmo id (contas/arquivamento.py)
+    transacao = models.ForeignKey(
+        Transacao,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        null=True,
+        blank=True,
+        related_name='lancamentos',
+        verbose_name='Transacao'
+    )
+    conta = models.ForeignKey(
+        Conta,
+        on_delete=models.PROTECT,
+        null=True,
+        blank=True,
+        related_name='lancamentos',
+        verbose_name='Conta'
+    )
+    rubrica = models.CharField(max_length=1, choices=RUBRICA_CHOICES, verbose_name='Rubrica')
+    natureza = models.CharField(max_length=1, choices=NATUREZA_CHOICES, verbose_name='Natureza')
+    valor = models.DecimalField(
+        max_digits=12,
+        decimal_places=2,
+        validators=[MinValueValidator(Decimal('0.01'))],
+        verbose_name='Valor'
+    )
+    historico = models.CharField(max_length=200, blank=True, verbose_name='Historico')
+    data_hora = models.DateTimeField(auto_now_add=True, verbose_name='Data/Hora')
+
+    objects = LancamentoQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = 'Lancamento'
+        verbose_name_plural = 'Lancamentos'
+        ordering = ['id']
+        indexes = [
+            # Saldo em um momento: lancamentos da conta desde a ultima foto diaria
+            models.Index(fields=['conta', 'data_hora'], name='lancamento_conta_data_idx'),
+        ]
+
+    def __str__(self):
+        conta = f'Conta {self.conta_id}' if self.conta_id else 'Caixa'
+        return f'{conta} - {self.get_natureza_display()} {self.get_rubrica_display()} R$ {self.valor}'
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            raise ValueError('Lancamentos do razao sao imutaveis!')
+        super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        raise ValueError('Lancamentos do razao sao imutaveis!')
+
+
+class SaldoDiario(models.Model):
+    """Saldo e limite da conta no fim de um dia, gravados por fotografar_saldos (contas/saldos.py).
+
+    So os dias em que a conta teve lancamentos tem foto; nos outros vale a
+    foto anterior. Fica no shard da conta, como o razao.
+    """
+    conta = models.ForeignKey(Conta, on_delete=models.CASCADE, related_name='saldos_diarios', verbose_name='Conta')
+    data = models.DateField(verbose_name='Data')
+    saldo = models.DecimalField(max_digits=14, decimal_places=2, verbose_name='Saldo')
+    limite = models.DecimalField(max_digits=14, decimal_places=2, verbose_name='Limite')
+
+    class Meta:
+        verbose_name = 'Saldo Diario'
+        verbose_name_plural = 'Saldos Diarios'
+        ordering = ['conta', '-data']
+        constraints = [
+            # O indice da constraint tambem serve a busca da ultima foto ate uma data
+            models.UniqueConstraint(fields=['conta', 'data'], name='saldo_diario_conta_data_unico'),
+        ]
+
+    def __str__(self):
+        return f'Conta {self.conta_id} em {self.data:%d/%m/%Y}: R$ {self.saldo}'
+
+
+class DiretorioPix(models.Model):
+    """Indice global das chaves PIX de todos os shards, guardado no banco default.
+
+    Diz em qual conta (e portanto em qual shard) esta cada chave e garante que
+    a mesma chave nao seja cadastrada em dois shards. Mantido por ChavePix.save
+    e pelos sinais de remocao de chave e de alteracao do cliente. Para conta
+    fora do default a gravacao nao e atomica entre os dois bancos;
+    "manage.py reconciliar_diretorio_pix" confere e corrige.
+    """
+    chave = models.CharField(max_length=200, unique=True, verbose_name='Chave PIX')
+    conta_numero = models.BigIntegerField(db_index=True, verbose_name='Conta')
+    nome = models.CharField(max_length=200, verbose_name='Nome do cliente')
+    ativa = models.BooleanField(default=True, verbose_name='Ativa')
+    criado_em = models.DateTimeField(auto_now_add=True, verbose_name='Criado em')
+
+    class Meta:
+        verbose_name = 'Diretorio PIX'
+        verbose_name_plural = 'Diretorio PIX'
+        ordering = ['chave']
+
+    def __str__(self):
+        return f'{self.chave} -> Conta {self.conta_numero}'
+
+    @classmethod
+    def registrar(cls, chave_pix):
+        """Inclui ou atualiza a chave; IntegrityError se ela ja pertence a outra conta"""
+        anterior = getattr(chave_pix, '_chave_anterior', None)
+        if anterior and anterior != chave_pix.chave:
+            cls.objects.filter(chave=anterior, conta_numero=chave_pix.conta_id).delete()
+        nome = (
+            Cliente.objects.using(chave_pix._state.db)
+            .filter(conta__numero=chave_pix.conta_id)
+            .values_list('nome', flat=True)
+            .first()
+        )
+        dados = {'nome': nome or '', 'ativa': chave_pix.ativa}
+        if not cls.objects.filter(chave=chave_pix.chave, conta_numero=chave_pix.conta_id).update(**dados):
+            cls.objects.create(chave=chave_pix.chave, conta_numero=chave_pix.conta_id, **dados)
+
+
+class Estatistica(models.Model):
+    """Contador pre-calculado lido pelo painel (home e metricas) sem varrer tabelas"""
+    nome = models.CharField(max_length=50, unique=True, verbose_name='Nome')
+    quantidade = models.BigIntegerField(default=0, verbose_name='Quantidade')
+    valor = models.DecimalField(
+        max_digits=18,
+        decimal_places=2,
+        default=Decimal('0.00'),
+        verbose_name='Valor'
+    )
+    atualizado_em = models.DateTimeField(auto_now=True, verbose_name='Atualizado em')
+
+    class Meta:
+        verbose_name = 'Estatistica'
+        verbose_name_plural = 'Estatisticas'
+        ordering = ['nome']
+
+    def __str__(self):
+        return f'{self.nome}: {self.quantidade} / R$ {self.valor}'
+
+
+class VolumeDiario(models.Model):
+    """Quantidade e valor movimentado por dia e tipo de transacao"""
+    data = models.DateField(verbose_name='Data')
+    tipo = models.CharField(max_length=1, choices=Transacao.TIPO_CHOICES, verbose_name='Tipo')
+    quantidade = models.BigIntegerField(default=0, verbose_name='Quantidade')
+    total = models.DecimalField(
+        max_digits=18,
+        decimal_places=2,
+        default=Decimal('0.00'),
+        verbose_name='Total'
+    )
+
+    class Meta:
+        verbose_name = 'Volume Diario'
+        verbose_name_plural = 'Volumes Diarios'
+        ordering = ['-data', 'tipo']
+        constraints = [
+            models.UniqueConstraint(fields=['data', 'tipo'], name='volume_diario_data_tipo_unico'),
+        ]
+
+    def __str__(self):
+        return f'{self.data:%d/%m/%Y} - {self.get_tipo_display()}: {self.quantidade} / R$ {self.total}'
+
+
+def soma_rubrica(rubrica):
+    """Agregacao com creditos menos debitos de uma rubrica do razao"""
+    return Sum(
+        Case(
+            When(rubrica=rubrica, natureza='C', then=F('valor')),
+            When(rubrica=rubrica, natureza='D', then=-F('valor')),
+            default=Value(Decimal('0.00')),
+            output_field=DecimalField(max_digits=14, decimal_places=2),
+        )
+    )
+
+
+def _bloquear_contas(*numeros):
+    """Bloqueia as contas (SELECT ... FOR UPDATE) sempre em ordem crescente de numero.
+
+    A ordem fixa garante que transferencias cruzadas (A -> B e B -> A) nunca
+    fiquem esperando uma pela outra. As contas devem ser do mesmo shard, e a
+    chamada deve estar dentro de transaction.atomic() nesse shard.
+    """
+    contas = (
+        Conta.objects.using(primario_da_conta(numeros[0])).select_for_update()
+        .filter(numero__in=numeros)
+        .order_by('numero')
+        .only('numero', 'saldo', 'limite')
+    )
+    return {conta.numero: conta for conta in contas}
+
+
+def _avaliar_pix(numero, numero_destino, valor, using):
+    """Regras de velocidade do PIX, com a conta de origem ja bloqueada; retorna a mensagem de recusa ou None.
+
+    Com o bloqueio, dois PIX simultaneos da conta sao avaliados um depois do
+    outro. O aprovado so entra nas janelas do motor no commit: um rollback
+    (inclusive o do bloco de idempotencia) nao o conta.
+    """
+    with secao('pix.antifraude'):
+        avaliacao = motor_antifraude.avaliar(numero, numero_destino, valor)
+    if not avaliacao.aprovado:
+        return MENSAGENS_ANTIFRAUDE[avaliacao.regra]
+    transaction.on_commit(functools.partial(motor_antifraude.registrar, numero, numero_destino, valor), using=using)
+    return None
+
+
+def _debitar(conta, valor):
+    """Debita valor de uma conta ja bloqueada, usando o limite quando o saldo nao basta.
+
+    Atualiza somente as colunas saldo e limite, em vez de regravar a linha inteira,
+    e retorna as partidas do razao correspondentes.
+    """
+    partidas = _calcular_debito(conta, valor)
+    Conta.objects.using(primario_da_conta(conta.numero)).filter(numero=conta.numero).update(
+        saldo=conta.saldo, limite=conta.limite
+    )
+    return partidas
+
+
+def _calcular_debito(conta, valor):
+    """Aplica o debito apenas no objeto em memoria e retorna as partidas do razao"""
+    parcela_saldo = min(conta.saldo, valor)
+    # Usa parte do limite quando o saldo nao basta
+    parcela_limite = valor - parcela_saldo
+    conta.saldo -= parcela_saldo
+    conta.limite -= parcela_limite
+
+    partidas = []
+    if parcela_saldo:
+        partidas.append((conta.numero, 'S', 'D', parcela_saldo))
+    if parcela_limite:
+        partidas.append((conta.numero, 'L', 'D', parcela_limite))
+    return partidas
+
+
+def _creditar(numero, valor):
+    """Credita valor com um UPDATE atomico (saldo = saldo + valor), sem ler a linha antes"""
+    Conta.objects.using(primario_da_conta(numero)).filter(numero=numero).update(saldo=F('saldo') + valor)
+    return [(numero, 'S', 'C', valor)]
+
+
+def _caixa(natureza, valor):
+    """Contrapartida no caixa do banco (depositos, saques, aberturas e ajustes)"""
+    return (None, 'S', natureza, valor)
+
+
+def _lancar(partidas, transacao=None, historico=''):
+    """Grava no razao as partidas (conta, rubrica, natureza, valor) de um movimento.
+
+    Deve rodar no mesmo transaction.atomic() que alterou os saldos. Recusa
+    movimentos em que a soma dos debitos difere da soma dos creditos. Os
+    trechos de pagina das contas movimentadas saem do cache depois do commit.
+    """
+    with secao('razao.lancar'):
+        lancamentos = _montar_lancamentos(partidas, transacao, historico)
+        banco = _banco_do_movimento(partidas)
+        cache_fragmentos.invalidar_apos_commit((conta_id for conta_id, _, _, _ in partidas), using=banco)
+        return Lancamento.objects.using(banco).bulk_create(lancamentos)
+
+
+def _banco_do_movimento(partidas):
+    """Shard das contas de um movimento; o caixa existe em todos os shards"""
+    numeros = [conta_id for conta_id, _, _, _ in partidas if conta_id is not None]
+    return primario_da_conta(numeros[0]) if numeros else DEFAULT_DB_ALIAS
+
+
+def _montar_lancamentos(partidas, transacao=None, historico=''):
+    """Valida um movimento e devolve seus lancamentos ainda nao gravados"""
+    if not partidas:
+        return []
+
+    creditos = sum(valor for _, _, natureza, valor in partidas if natureza == 'C')
+    debitos = sum(valor for _, _, natureza, valor in partidas if natureza == 'D')
+    if creditos != debitos:
+        raise ValueError(f'Movimento desbalanceado: creditos {creditos} != debitos {debitos}')
+
+    movimento = uuid.uuid4()
+    historico = historico or (transacao.descricao if transacao else '')
+    return [
+        Lancamento(
+            movimento=movimento,
+            transacao=transacao,
+            conta_id=conta_id,
+            rubrica=rubrica,
+            natureza=natureza,
+            valor=valor,
+            historico=historico[:200],
+        )
+        for conta_id, rubrica, natureza, valor in partidas
+    ]
@@ -0,0 +1,238 @@
+"""Entrega assincrona dos eventos de transacao (outbox) aos sistemas externos.
+
+Cada operacao com dinheiro grava um EventoTransacao no mesmo commit da
+Transacao (contas/signals.py; lote e fechamento com bulk_create), entao a
+requisicao nunca espera notificacoes, antifraude ou contabilidade. O
+despachante (manage.py despachar_eventos) le os eventos em lotes, por shard e
+por destino, e so avanca o cursor do destino depois que ele aceitou o lote
+inteiro: a entrega e pelo menos uma vez (o campo "evento" permite descartar
+repetidos). Cada destino tem no maximo um lote em voo, entao um destino lento
+so atrasa a si mesmo, e a espera dele (fila cheia, webhook lento) segura a
+leitura de novos eventos. Eventos ja entregues a todos os destinos sao
+apagados.
+
+Os cursores ficam em Estatistica no proprio shard ('outbox:<destino>', com o
+id do ultimo evento entregue). O cursor so e seguro se nenhum id menor que ele
+for commitado depois. No SQLite e assim: as escritas sao em serie e o id e o
+commit saem na mesma ordem. Em outro banco (PostgreSQL) duas transacoes
+concorrentes podem commitar fora da ordem dos ids, entao cada lote para no
+primeiro evento com menos de JANELA_COMMIT segundos: o id e o criado_em saem
+no mesmo INSERT, e a janela precisa cobrir so o tempo entre o INSERT do
+evento e o commit, nao a transacao inteira.
+"""
+import asyncio
+import json
+from datetime import timedelta
+from pathlib import Path
+
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections
+from django.db.models import Count, Min
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import Estatistica, EventoTransacao
+from .shards import shards
+
+
+def configuracao():
+    config = getattr(settings, 'OUTBOX', {})
+    return config.get('DESTINOS', {}), config.get('TAMANHO_LOTE', 500), config.get('INTERVALO', 1.0)
+
+
+def janela_commit(alias):
+    """Segundos que um evento do shard espera antes de poder ser entregue (0 no SQLite)"""
+    if connections[alias].vendor == 'sqlite':
+        return 0
+    return getattr(settings, 'OUTBOX', {}).get('JANELA_COMMIT', 5.0)
+
+
+def nome_cursor(destino):
+    return f'outbox:{destino}'
+
+
+def destinos_configurados():
+    """{nome: destino} instanciados a partir de settings.OUTBOX['DESTINOS']"""
+    return {
+        nome: import_string(config['CLASSE'])(**config.get('OPCOES', {}))
+        for nome, config in configuracao()[0].items()
+    }
+
+
+class DestinoArquivo:
+    """Acrescenta cada evento como uma linha JSON em um arquivo local"""
+
+    def __init__(self, caminho):
+        self.caminho = Path(caminho)
+
+    async def entregar(self, eventos):
+        linhas = ''.join(json.dumps(evento, cls=DjangoJSONEncoder) + '\n' for evento in eventos)
+        await asyncio.to_thread(self._gravar, linhas)
+
+    def _gravar(self, linhas):
+        with self.caminho.open('a', encoding='utf-8') as arquivo:
+            arquivo.write(linhas)
+
+
+class DestinoWebhook:
+    """POST do lote em JSON para uma URL; qualquer resposta fora de 2xx e erro e o lote volta a ser enviado"""
+
+    def __init__(self, url, timeout=10):
+        self.url = url
+        self.timeout = timeout
+
+    async def entregar(self, eventos):
+        corpo = json.dumps({'eventos': eventos}, cls=DjangoJSONEncoder).encode()
+        await asyncio.to_thread(self._enviar, corpo)
+
+    def _enviar(self, corpo):
+        # Importado so no despachante: urllib.request traz ssl, email e http.client para os processos web
+        import urllib.request
+
+        requisicao = urllib.request.Request(self.url, data=corpo, headers={'Content-Type': 'application/json'})
+        with urllib.request.urlopen(requisicao, timeout=self.timeout):
+            pass
+
+
+class DestinoFila:
+    """Fila asyncio em memoria (consumidores no mesmo processo); cheia, segura o despachante"""
+
+    def __init__(self, tamanho_maximo=10_000):
+        self.fila = asyncio.Queue(maxsize=tamanho_maximo)
+
+    async def entregar(self, eventos):
+        for evento in eventos:
+            await self.fila.put(evento)
+
+
+class MetricasDestino:
+    def __init__(self):
+        self.entregues = 0
+        self.falhas = 0
+        self.ultimo_erro = ''
+
+
+class Despachante:
+    """Drena o outbox de todos os shards para os destinos, uma tarefa asyncio por destino"""
+
+    def __init__(self, destinos=None, tamanho_lote=None, intervalo=None, espera_maxima=60.0):
+        _, lote_padrao, intervalo_padrao = configuracao()
+        self.destinos = destinos_configurados() if destinos is None else destinos
+        self.tamanho_lote = tamanho_lote or lote_padrao
+        self.intervalo = intervalo_padrao if intervalo is None else intervalo
+        self.espera_maxima = espera_maxima
+        self.metricas = {nome: MetricasDestino() for nome in self.destinos}
+
+    async def executar(self, parar=None):
+        """Entrega ate parar.set(); sem parar, esvazia o outbox uma vez e retorna"""
+        await asyncio.gather(*(self._drenar_destino(nome, parar) for nome in self.destinos))
+        await self.limpar()
+
+    async def _drenar_destino(self, nome, parar):
+        espera = self.intervalo
+        while True:
+            try:
+                entregues = await self.entregar_lotes(nome)
+                espera = self.intervalo
+            except Exception as erro:
+                # O cursor nao avancou: o mesmo lote e reenviado, com espera crescente
+                entregues = 0
+                self.metricas[nome].falhas += 1
+                self.metricas[nome].ultimo_erro = f'{type(erro).__name__}: {erro}'
+                if parar is None:
+                    raise
+                espera = min(max(espera, 0.1) * 2, self.espera_maxima)
+            if parar is not None and parar.is_set():
+                return
+            if entregues:
+                continue
+            if parar is None:
+                return
+            try:
+                await asyncio.wait_for(parar.wait(), espera)
+            except asyncio.TimeoutError:
+                pass
+            await self.limpar()
+
+    async def entregar_lotes(self, nome):
+        """Entrega um lote de cada shard ao destino e retorna quantos eventos foram"""
+        total = 0
+        for alias in shards():
+            cursor, _ = await Estatistica.objects.using(alias).aget_or_create(nome=nome_cursor(nome))
+            eventos = [
+                evento async for evento in EventoTransacao.objects.using(alias)
+                .filter(pk__gt=cursor.quantidade).order_by('pk')[:self.tamanho_lote]
+            ]
+            janela = janela_commit(alias)
+            if janela:
+                # Um id menor ainda pode commitar: o lote para antes do primeiro evento recente
+                limite = timezone.now() - timedelta(seconds=janela)
+                recentes = [indice for indice, evento in enumerate(eventos) if evento.criado_em > limite]
+                eventos = eventos[:recentes[0]] if recentes else eventos
+            if not eventos:
+                continue
+            await self.destinos[nome].entregar([
+                {'evento': f'{alias}:{evento.pk}', 'banco': alias, 'criado_em': evento.criado_em, **evento.dados}
+                for evento in eventos
+            ])
+            await Estatistica.objects.using(alias).filter(pk=cursor.pk).aupdate(
+                quantidade=eventos[-1].pk, atualizado_em=timezone.now()
+            )
+            self.metricas[nome].entregues += len(eventos)
+            total += len(eventos)
+        return total
+
+    async def limpar(self):
+        """Apaga os eventos que todos os destinos ja receberam"""
+        if not self.destinos:
+            return
+        nomes = [nome_cursor(nome) for nome in self.destinos]
+        for alias in shards():
+            cursores = [
+                quantidade async for quantidade in
+                Estatistica.objects.using(alias).filter(nome__in=nomes).values_list('quantidade', flat=True)
+            ]
+            if len(cursores) == len(nomes):
+                await EventoTransacao.objects.using(alias).filter(pk__lte=min(cursores)).adelete()
+
+
+def atraso(nomes=None):
+    """{destino: (eventos pendentes, idade em segundos do mais antigo)} somando os shards"""
+    if nomes is None:
+        nomes = list(configuracao()[0])
+    agora = timezone.now()
+    resultado = {}
+    for nome in nomes:
+        pendentes, segundos = 0, 0.0
+        for alias in shards():
+            cursor = (
+                Estatistica.objects.using(alias).filter(nome=nome_cursor(nome))
+                .values_list('quantidade', flat=True).first() or 0
+            )
+            resumo = EventoTransacao.objects.using(alias).filter(pk__gt=cursor).aggregate(
+                pendentes=Count('pk'), mais_antigo=Min('criado_em'),
+            )
+            pendentes += resumo['pendentes']
+            if resumo['mais_antigo'] is not None:
+                segundos = max(segundos, (agora - resumo['mais_antigo']).total_seconds())
+        resultado[nome] = (pendentes, segundos)
+    return resultado
+
+
+def prometheus():
+    """Atraso dos destinos no formato texto do Prometheus"""
+    medidas = sorted(atraso().items())
+    linhas = []
+    for metrica, indice in (('bancopy_outbox_pendentes', 0), ('bancopy_outbox_atraso_segundos', 1)):
+        linhas.append(f'# TYPE {metrica} gauge')
+        linhas += [f'{metrica}{{destino="{nome}"}} {medida[indice]}' for nome, medida in medidas]
+    return '\n'.join(linhas) + '\n'
+
+
+def despachar(parar=None, **opcoes):
+    """Roda o despachante a partir de codigo sincrono (comando, testes)"""
+    despachante = Despachante(**opcoes)
+    async_to_sync(despachante.executar)(parar)
+    return despachante
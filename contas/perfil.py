@@ -0,0 +1,263 @@
+"""Perfil das requisicoes: consultas, tempo de banco, de template e total por URL.
+
+Tudo fica em memoria no proprio processo (histogramas por nome de URL) e e
+lido em /metricas/prometheus/ no formato texto do Prometheus. Requisicoes
+amostradas rodam sob o cProfile e, se passarem do limite configurado, o
+perfil e gravado em arquivo .prof para abrir com pstats ou snakeviz.
+
+Ativado por PERFIL_REQUISICOES['ATIVO'] nas settings; desligado, o
+middleware se retira da pilha e as secoes, as consultas (execute_wrapper posto
+em cada conexao por contas/signals.py) e os templates (backend
+TemplatesMedidos em TEMPLATES) custam uma leitura de ContextVar.
+"""
+import bisect
+import cProfile
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.template.backends.django import DjangoTemplates, Template
+from django.utils import timezone
+
+# Limites superiores dos baldes: tempos em ms e quantidade de consultas
+BALDES_MS = (0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+BALDES_CONSULTAS = (1, 2, 3, 5, 10, 20, 50, 100, 200, 500, 1000)
+QUANTIS = (0.5, 0.95, 0.99)
+
+_medicao_atual = ContextVar('medicao_perfil', default=None)
+
+
+class Histograma:
+    """Contagens por balde; os quantis sao interpolados dentro do balde"""
+
+    def __init__(self, baldes):
+        self.baldes = baldes
+        self.contagens = [0] * (len(baldes) + 1)
+        self.soma = 0
+        self.total = 0
+        self.maximo = 0
+
+    def observar(self, valor):
+        self.contagens[bisect.bisect_left(self.baldes, valor)] += 1
+        self.soma += valor
+        self.total += 1
+        self.maximo = max(self.maximo, valor)
+
+    def quantil(self, q):
+        if not self.total:
+            return 0.0
+        alvo = q * self.total
+        acumulado = 0
+        for indice, contagem in enumerate(self.contagens):
+            if contagem and acumulado + contagem >= alvo:
+                inferior = self.baldes[indice - 1] if indice else 0
+                superior = self.baldes[indice] if indice < len(self.baldes) else self.maximo
+                return inferior + (superior - inferior) * (alvo - acumulado) / contagem
+            acumulado += contagem
+        return self.maximo
+
+
+class Medicao:
+    """Acumuladores de uma requisicao em andamento"""
+
+    def __init__(self):
+        self.consultas = 0
+        self.banco_ms = 0.0
+        self.template_ms = 0.0
+        self.profundidade_template = 0
+        self.secoes = {}
+
+
+
+class RegistroPerfil:
+    """Histogramas por URL e por secao, compartilhados pelas threads do processo"""
+
+    METRICAS = {
+        'duracao_ms': BALDES_MS,
+        'banco_ms': BALDES_MS,
+        'template_ms': BALDES_MS,
+        'consultas': BALDES_CONSULTAS,
+    }
+
+    def __init__(self):
+        self._trava = threading.Lock()
+        self.limpar()
+
+    def limpar(self):
+        with self._trava:
+            self.urls = {}
+            self.secoes = {}
+
+    def registrar(self, url, duracao_ms, medicao):
+        with self._trava:
+            if url not in self.urls:
+                self.urls[url] = {metrica: Histograma(baldes) for metrica, baldes in self.METRICAS.items()}
+            histogramas = self.urls[url]
+            histogramas['duracao_ms'].observar(duracao_ms)
+            histogramas['banco_ms'].observar(medicao.banco_ms)
+            histogramas['template_ms'].observar(medicao.template_ms)
+            histogramas['consultas'].observar(medicao.consultas)
+            for secao, tempo_ms in medicao.secoes.items():
+                self.secoes.setdefault(secao, Histograma(BALDES_MS)).observar(tempo_ms)
+
+    def prometheus(self):
+        """Texto no formato de exposicao do Prometheus (summaries com p50, p95 e p99)"""
+        linhas = []
+        with self._trava:
+            for metrica in self.METRICAS:
+                nome = f'bancopy_requisicao_{metrica}'
+                linhas.append(f'# TYPE {nome} summary')
+                for url, histogramas in sorted(self.urls.items()):
+                    linhas += _summary(nome, f'url="{_rotulo(url)}"', histogramas[metrica])
+            if self.secoes:
+                linhas.append('# TYPE bancopy_secao_ms summary')
+                for secao, histograma in sorted(self.secoes.items()):
+                    linhas += _summary('bancopy_secao_ms', f'secao="{_rotulo(secao)}"', histograma)
+        return '\n'.join(linhas) + '\n'
+
+
+def _rotulo(valor):
+    return valor.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _summary(nome, rotulos, histograma):
+    linhas = [f'{nome}{{{rotulos},quantile="{q}"}} {histograma.quantil(q):.3f}' for q in QUANTIS]
+    linhas.append(f'{nome}_sum{{{rotulos}}} {histograma.soma:.3f}')
+    linhas.append(f'{nome}_count{{{rotulos}}} {histograma.total}')
+    return linhas
+
+
+registro_perfil = RegistroPerfil()
+
+
+@contextmanager
+def secao(nome):
+    """Cronometra um trecho quente dentro da requisicao medida (ex.: 'pix.resolver_chave')"""
+    medicao = _medicao_atual.get()
+    if medicao is None:
+        yield
+        return
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        medicao.secoes[nome] = medicao.secoes.get(nome, 0.0) + (time.perf_counter() - inicio) * 1000
+
+
+def medir_consulta(execute, sql, params, many, context):
+    """execute_wrapper de toda conexao (contas/signals.py): conta e cronometra as consultas da requisicao medida"""
+    medicao = _medicao_atual.get()
+    if medicao is None:
+        return execute(sql, params, many, context)
+    inicio = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        medicao.banco_ms += (time.perf_counter() - inicio) * 1000
+        medicao.consultas += 1
+
+
+class TemplateMedido(Template):
+    """Template do backend cronometrado na requisicao medida; renders aninhados contam uma vez so"""
+
+    def render(self, context=None, request=None):
+        medicao = _medicao_atual.get()
+        if medicao is None:
+            return super().render(context, request)
+        medicao.profundidade_template += 1
+        inicio = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            medicao.profundidade_template -= 1
+            if not medicao.profundidade_template:
+                medicao.template_ms += (time.perf_counter() - inicio) * 1000
+
+
+class TemplatesMedidos(DjangoTemplates):
+    """Backend DjangoTemplates (TEMPLATES nas settings) cujos templates alimentam o template_ms do perfil"""
+
+    def from_string(self, template_code):
+        return TemplateMedido(super().from_string(template_code).template, self)
+
+    def get_template(self, template_name):
+        return TemplateMedido(super().get_template(template_name).template, self)
+
+
+class PerfilMiddleware:
+    """Mede cada requisicao e alimenta registro_perfil (ver PERFIL_REQUISICOES nas settings).
+
+    Sob ASGI o cProfile amostrado nao roda: ele so enxerga a thread em que foi
+    ligado, e a requisicao passa pelo loop de eventos e pelas threads das views.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        config = getattr(settings, 'PERFIL_REQUISICOES', {})
+        if not config.get('ATIVO'):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.amostragem = config.get('AMOSTRAGEM_CPROFILE', 0.0)
+        self.limite_ms = config.get('LIMITE_CPROFILE_MS', 500)
+        self.diretorio = Path(config.get('DIRETORIO_CPROFILE') or settings.BASE_DIR / 'perfis')
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        medicao = Medicao()
+        perfil = cProfile.Profile() if self.amostragem and random.random() < self.amostragem else None
+        token = _medicao_atual.set(medicao)
+        inicio = time.perf_counter()
+        try:
+            if perfil is not None:
+                try:
+                    perfil.enable()
+                except ValueError:
+                    # Outro profiler ja ativo nesta thread
+                    perfil = None
+            try:
+                response = self.get_response(request)
+            finally:
+                if perfil is not None:
+                    perfil.disable()
+        finally:
+            _medicao_atual.reset(token)
+        duracao_ms = (time.perf_counter() - inicio) * 1000
+
+        url = self._registrar(request, duracao_ms, medicao)
+        if perfil is not None and duracao_ms >= self.limite_ms:
+            self._gravar_perfil(perfil, url, duracao_ms)
+        return response
+
+    async def __acall__(self, request):
+        medicao = Medicao()
+        token = _medicao_atual.set(medicao)
+        inicio = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _medicao_atual.reset(token)
+        self._registrar(request, (time.perf_counter() - inicio) * 1000, medicao)
+        return response
+
+    @staticmethod
+    def _registrar(request, duracao_ms, medicao):
+        correspondencia = request.resolver_match
+        url = correspondencia.view_name if correspondencia else '<nao_resolvida>'
+        registro_perfil.registrar(url, duracao_ms, medicao)
+        return url
+
+    def _gravar_perfil(self, perfil, url, duracao_ms):
+        self.diretorio.mkdir(parents=True, exist_ok=True)
+        carimbo = timezone.now().strftime('%Y%m%d-%H%M%S-%f')
+        nome = ''.join(caractere if caractere.isalnum() else '_' for caractere in url)
+        perfil.dump_stats(self.diretorio / f'{nome}-{carimbo}-{duracao_ms:.0f}ms.prof')
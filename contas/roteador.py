@@ -0,0 +1,199 @@
+"""Roteamento de leituras para a replica e de escritas para o primario.
+
+Por padrao tudo vai ao primario ("default"). So o codigo marcado com
+somente_leitura (views de consulta, extratos, listagens do admin) le da
+replica, e mesmo assim volta ao primario quando:
+
+- a requisicao ja escreveu algo, ou o navegador escreveu ha menos de
+  FIXAR_PRIMARIO_SEGUNDOS (cookie posto pelo RoteamentoMiddleware), para que
+  o cliente sempre veja as proprias escritas apesar do atraso da replica;
+- ha um transaction.atomic() aberto no primario (bloqueios e saldos);
+- a replica e o espelho de teste do primario (TestCase so enxerga os dados
+  dentro da transacao da conexao default).
+
+Objetos ja carregados levam consigo o banco de onde vieram: relacionados sao
+lidos do mesmo banco e gravacoes vao ao primario dele. E isso que mantem os
+dados de uma conta no shard dela (contas/shards.py); so o "default" tem replica.
+"""
+import functools
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+COOKIE_FIXACAO = 'fixar_primario'
+# Comandos que gravam; BEGIN, SAVEPOINT, RELEASE e COMMIT de um atomic() so de leitura nao contam
+COMANDOS_DE_ESCRITA = frozenset({'INSERT', 'UPDATE', 'DELETE', 'REPLACE', 'CREATE', 'ALTER', 'DROP', 'TRUNCATE'})
+
+_leitura = ContextVar('leitura_replica', default=False)
+_estado_requisicao = ContextVar('estado_roteamento', default=None)
+
+
+def configuracao():
+    config = getattr(settings, 'ROTEAMENTO_BANCO', {})
+    return config.get('REPLICA', 'replica'), config.get('FIXAR_PRIMARIO_SEGUNDOS', 5)
+
+
+def replica_disponivel():
+    """Alias da replica, ou None se ela nao estiver configurada ou for o espelho de teste do primario"""
+    replica, _ = configuracao()
+    if replica not in connections.settings:
+        return None
+    dados = connections[replica].settings_dict
+    espelho_de_teste = dados['TEST'].get('MIRROR') == DEFAULT_DB_ALIAS
+    if espelho_de_teste and dados['NAME'] == connections[DEFAULT_DB_ALIAS].settings_dict['NAME']:
+        return None
+    return replica
+
+
+def primario_de(alias):
+    """Banco que recebe as escritas dos dados lidos de alias"""
+    return DEFAULT_DB_ALIAS if alias == configuracao()[0] else alias
+
+
+def alias_de_leitura(primario=DEFAULT_DB_ALIAS):
+    """Banco para ler dados guardados em primario: a replica dele quando a leitura pode ir para ela"""
+    if primario != DEFAULT_DB_ALIAS or not _leitura.get():
+        return primario
+    estado = _estado_requisicao.get()
+    if estado is not None and (estado.fixado or estado.escreveu):
+        return primario
+    if connections[primario].in_atomic_block:
+        return primario
+    return replica_disponivel() or primario
+
+
+class EstadoRequisicao:
+    def __init__(self, fixado=False):
+        self.fixado = fixado
+        self.escreveu = False
+
+
+def observar_escritas(execute, sql, params, many, context):
+    """execute_wrapper de toda conexao (contas/signals.py): marca a requisicao em andamento que escreveu.
+
+    Conta DML e DDL, inclusive os feitos com .using() em um shard, que nao
+    passam pelo roteador. O estado vem de uma ContextVar, que acompanha a
+    requisicao tambem na thread em que uma view sincrona roda sob ASGI.
+    """
+    estado = _estado_requisicao.get()
+    if estado is not None and not estado.escreveu:
+        comando = sql.lstrip()[:9].split(None, 1)
+        estado.escreveu = bool(comando) and comando[0].upper() in COMANDOS_DE_ESCRITA
+    return execute(sql, params, many, context)
+
+
+class RoteadorLeituraEscrita:
+    """DATABASE_ROUTERS: leituras marcadas vao a replica, todo o resto ao primario"""
+
+    def db_for_read(self, model, **hints):
+        instancia = hints.get('instance')
+        if instancia is not None and instancia._state.db:
+            return instancia._state.db
+        return alias_de_leitura()
+
+    def db_for_write(self, model, **hints):
+        instancia = hints.get('instance')
+        if instancia is not None and instancia._state.db:
+            return primario_de(instancia._state.db)
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replica e primario tem os mesmos dados; entre shards as chaves nao tem constraint
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # A replica recebe o esquema por replicacao, nunca por migrate
+        if db == configuracao()[0]:
+            return False
+        # Shards novos comecam vazios: migracoes de dados (RunPython) so rodam no default
+        return db == DEFAULT_DB_ALIAS or model_name is not None
+
+
+@contextmanager
+def na_replica():
+    """As leituras feitas dentro do bloco podem ir para a replica"""
+    token = _leitura.set(True)
+    try:
+        yield
+    finally:
+        _leitura.reset(token)
+
+
+def _iterar_na_replica(iterador):
+    """Consome um iterador (resposta em streaming) lendo da replica a cada parte"""
+    iterador = iter(iterador)
+    while True:
+        with na_replica():
+            try:
+                parte = next(iterador)
+            except StopIteration:
+                return
+        yield parte
+
+
+def _concluir(response):
+    # TemplateResponse e streaming consultam o banco depois que a view retorna
+    if hasattr(response, 'render') and not response.is_rendered:
+        response.render()
+    estado = _estado_requisicao.get()
+    fixado = estado is not None and (estado.fixado or estado.escreveu)
+    if response.streaming and not response.is_async and not fixado:
+        response.streaming_content = _iterar_na_replica(response.streaming_content)
+    return response
+
+
+def somente_leitura(view):
+    """Decorator de views que so consultam: as leituras podem ir para a replica"""
+    if iscoroutinefunction(view):
+        @functools.wraps(view)
+        async def view_assincrona(request, *args, **kwargs):
+            with na_replica():
+                return _concluir(await view(request, *args, **kwargs))
+        return view_assincrona
+
+    @functools.wraps(view)
+    def view_sincrona(request, *args, **kwargs):
+        with na_replica():
+            return _concluir(view(request, *args, **kwargs))
+    return view_sincrona
+
+
+class RoteamentoMiddleware:
+    """Fixa no primario o navegador que acabou de escrever (leitura das proprias escritas)"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        estado = EstadoRequisicao(fixado=COOKIE_FIXACAO in request.COOKIES)
+        token = _estado_requisicao.set(estado)
+        try:
+            response = self.get_response(request)
+        finally:
+            _estado_requisicao.reset(token)
+        return self._fixar(estado, response)
+
+    async def __acall__(self, request):
+        estado = EstadoRequisicao(fixado=COOKIE_FIXACAO in request.COOKIES)
+        token = _estado_requisicao.set(estado)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _estado_requisicao.reset(token)
+        return self._fixar(estado, response)
+
+    @staticmethod
+    def _fixar(estado, response):
+        if estado.escreveu:
+            _, segundos = configuracao()
+            response.set_cookie(COOKIE_FIXACAO, '1', max_age=segundos, httponly=True, samesite='Lax')
+        return response
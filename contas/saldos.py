@@ -0,0 +1,148 @@
+"""Fotos diarias de saldo para saber o saldo de uma conta em qualquer momento.
+
+fotografar_saldos (agendar logo depois da meia-noite) grava, para cada dia
+fechado desde a ultima execucao, o saldo e o limite no fim do dia das contas
+que tiveram lancamentos nele: a foto anterior da conta mais os lancamentos do
+dia. O saldo em um momento passa a ser a ultima foto antes daquele dia mais os
+lancamentos desde o fim dela, em vez da soma do razao inteiro.
+
+Cada shard tem o seu checkpoint (ultimo dia fotografado) no banco default.
+"""
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+from itertools import islice
+
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import DecimalField, Min, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import Conta, Estatistica, Lancamento, SaldoDiario, soma_rubrica
+from .shards import shards
+
+# quantidade guarda o ultimo dia fotografado (date.toordinal())
+ULTIMO_DIA = 'saldos_ultimo_dia'
+# Lancamentos confirmados logo depois da meia-noite ainda podem ser do dia anterior
+MARGEM = timedelta(minutes=5)
+TAMANHO_LOTE = 2000
+ZERO = Decimal('0.00')
+VALOR = DecimalField(max_digits=14, decimal_places=2)
+
+
+def nome_checkpoint(alias):
+    return ULTIMO_DIA if alias == DEFAULT_DB_ALIAS else f'{ULTIMO_DIA}:{alias}'
+
+
+def inicio_do_dia(dia):
+    return timezone.make_aware(datetime.combine(dia, time.min))
+
+
+def ultimo_dia_fotografado(alias=DEFAULT_DB_ALIAS):
+    ordinal = Estatistica.objects.filter(nome=nome_checkpoint(alias)).values_list('quantidade', flat=True).first()
+    return date.fromordinal(ordinal) if ordinal else None
+
+
+def fotografar(ate=None):
+    """Grava as fotos dos dias fechados ainda nao fotografados em todos os shards e retorna quantas foram"""
+    if ate is None:
+        ate = timezone.localdate(timezone.now() - MARGEM) - timedelta(days=1)
+    return sum(_fotografar_shard(alias, ate) for alias in shards())
+
+
+def _fotografar_shard(alias, ate):
+    ultimo = ultimo_dia_fotografado(alias)
+    if ultimo is None:
+        primeiro = Lancamento.objects.using(alias).aggregate(primeiro=Min('data_hora'))['primeiro']
+        # Razao vazio: os dias ate ontem ja estao fechados sem nenhuma foto
+        dia = timezone.localdate(primeiro) if primeiro else ate + timedelta(days=1)
+        if primeiro is None:
+            Estatistica.objects.update_or_create(nome=nome_checkpoint(alias), defaults={'quantidade': ate.toordinal()})
+    else:
+        dia = ultimo + timedelta(days=1)
+
+    gravadas = 0
+    while dia <= ate:
+        gravadas += _fotografar_dia(alias, dia)
+        Estatistica.objects.update_or_create(nome=nome_checkpoint(alias), defaults={'quantidade': dia.toordinal()})
+        dia += timedelta(days=1)
+    return gravadas
+
+
+def _fotografar_dia(alias, dia):
+    anteriores = SaldoDiario.objects.using(alias).filter(conta=OuterRef('conta'), data__lt=dia).order_by('-data')
+    movimentos = (
+        Lancamento.objects.using(alias)
+        .filter(conta__isnull=False, data_hora__gte=inicio_do_dia(dia), data_hora__lt=inicio_do_dia(dia + timedelta(days=1)))
+        .values('conta')
+        .annotate(
+            saldo=soma_rubrica('S'),
+            limite=soma_rubrica('L'),
+            saldo_anterior=Subquery(anteriores.values('saldo')[:1]),
+            limite_anterior=Subquery(anteriores.values('limite')[:1]),
+        )
+        .order_by()
+    )
+    fotos = (
+        SaldoDiario(
+            conta_id=movimento['conta'],
+            data=dia,
+            saldo=(movimento['saldo_anterior'] or ZERO) + movimento['saldo'],
+            limite=(movimento['limite_anterior'] or ZERO) + movimento['limite'],
+        )
+        for movimento in movimentos.iterator(chunk_size=TAMANHO_LOTE)
+    )
+
+    # Refazer um dia (execucao interrompida entre o shard e o checkpoint) substitui as fotos dele
+    gravadas = 0
+    with transaction.atomic(using=alias):
+        SaldoDiario.objects.using(alias).filter(data=dia).delete()
+        while lote := list(islice(fotos, TAMANHO_LOTE)):
+            SaldoDiario.objects.using(alias).bulk_create(lote)
+            gravadas += len(lote)
+    return gravadas
+
+
+def saldo_em(conta, momento):
+    """(saldo, limite) da conta no momento: a ultima foto antes do dia mais os lancamentos desde o fim dela"""
+    foto = (
+        conta.saldos_diarios.filter(data__lt=timezone.localdate(momento))
+        .order_by('-data')
+        .values('data', 'saldo', 'limite')
+        .first()
+    )
+    lancamentos = conta.lancamentos.filter(data_hora__lt=momento)
+    saldo = limite = ZERO
+    if foto is not None:
+        saldo, limite = foto['saldo'], foto['limite']
+        lancamentos = lancamentos.filter(data_hora__gte=inicio_do_dia(foto['data'] + timedelta(days=1)))
+    delta = lancamentos.aggregate(saldo=soma_rubrica('S'), limite=soma_rubrica('L'))
+    return saldo + (delta['saldo'] or ZERO), limite + (delta['limite'] or ZERO)
+
+
+def saldos_no_fim_do_dia(dia):
+    """Iterador de (numero, saldo, limite) de todas as contas abertas ate o dia, em ordem de numero.
+
+    Uma busca no indice de fotos por conta, sem tocar no razao. Levanta
+    ValueError se o dia ainda nao foi fotografado em algum shard.
+    """
+    for alias in shards():
+        ultimo = ultimo_dia_fotografado(alias)
+        if ultimo is None or ultimo < dia:
+            raise ValueError(f'Saldos de {dia:%d/%m/%Y} ainda nao fotografados no banco {alias}!')
+    return _saldos_no_fim_do_dia(dia)
+
+
+def _saldos_no_fim_do_dia(dia):
+    for alias in shards():
+        fotos = SaldoDiario.objects.using(alias).filter(conta=OuterRef('numero'), data__lte=dia).order_by('-data')
+        contas = (
+            Conta.objects.using(alias)
+            .filter(data_abertura__lt=inicio_do_dia(dia + timedelta(days=1)))
+            .annotate(
+                saldo_dia=Coalesce(Subquery(fotos.values('saldo')[:1]), Value(ZERO), output_field=VALOR),
+                limite_dia=Coalesce(Subquery(fotos.values('limite')[:1]), Value(ZERO), output_field=VALOR),
+            )
+            .order_by('numero')
+            .values_list('numero', 'saldo_dia', 'limite_dia')
+        )
+        yield from contas.iterator(chunk_size=TAMANHO_LOTE)
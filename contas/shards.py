@@ -0,0 +1,129 @@
+"""Particionamento das contas entre bancos (shards) por faixa de numero.
+
+O shard de indice i em settings.SHARDING['SHARDS'] guarda as contas de
+numero entre i * FAIXA_NUMEROS e (i + 1) * FAIXA_NUMEROS - 1, junto com o
+cliente, as chaves PIX, as transacoes e o razao delas. O primeiro shard e o
+"default", que tambem guarda os dados globais (diretorio de chaves PIX e
+estatisticas). Contas novas vao para o shard escolhido pelo CPF entre os
+NOVAS_CONTAS, entao mais capacidade de escrita e mais um banco na lista,
+preparado com "manage.py preparar_shard".
+
+Com um unico shard (o padrao) tudo continua no "default".
+"""
+import zlib
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from .roteador import alias_de_leitura
+
+
+def configuracao():
+    config = getattr(settings, 'SHARDING', {})
+    shards = list(config.get('SHARDS', [DEFAULT_DB_ALIAS]))
+    return shards, config.get('FAIXA_NUMEROS', 100_000_000), config.get('NOVAS_CONTAS') or shards
+
+
+def shards():
+    return configuracao()[0]
+
+
+def faixa(alias):
+    """(primeiro, ultimo + 1) dos numeros de conta do shard"""
+    todos, tamanho, _ = configuracao()
+    indice = todos.index(alias)
+    return indice * tamanho, (indice + 1) * tamanho
+
+
+def primario_da_conta(numero):
+    """Alias do shard que guarda a conta, ou None se o numero esta fora de todas as faixas"""
+    todos, tamanho, _ = configuracao()
+    indice = int(numero) // tamanho
+    return todos[indice] if 0 <= indice < len(todos) else None
+
+
+def banco_da_conta(numero):
+    """Banco para ler os dados da conta: o shard, ou a replica dele em views somente_leitura"""
+    banco = primario_da_conta(numero)
+    return alias_de_leitura(banco) if banco else None
+
+
+def no_shard_da_conta(queryset, numero):
+    """queryset no banco da conta; vazio se o numero nao pertence a nenhum shard"""
+    banco = banco_da_conta(numero)
+    return queryset.using(banco) if banco else queryset.none()
+
+
+def shard_para_cpf(cpf):
+    """Shard que recebe o cadastro de um cliente novo"""
+    novas = configuracao()[2]
+    digitos = ''.join(caractere for caractere in str(cpf) if caractere.isdigit())
+    return novas[zlib.crc32(digitos.encode()) % len(novas)]
+
+
+class ConsultaEmShards:
+    """A mesma consulta em todos os shards, concatenada na ordem dos shards.
+
+    Como as faixas de numero sao crescentes, uma consulta de contas ordenada
+    por numero fica na ordem global. Suporta len, count e fatias (paginacao).
+    """
+
+    def __init__(self, queryset):
+        self.partes = [queryset.using(alias_de_leitura(alias)) for alias in shards()]
+        self._contagens = None
+
+    def count(self):
+        if self._contagens is None:
+            self._contagens = [parte.count() for parte in self.partes]
+        return sum(self._contagens)
+
+    __len__ = count
+
+    def __iter__(self):
+        for parte in self.partes:
+            yield from parte
+
+    def __getitem__(self, indice):
+        if not isinstance(indice, slice):
+            return self[indice:indice + 1][0]
+        self.count()
+        inicio = indice.start or 0
+        fim = self.count() if indice.stop is None else indice.stop
+        resultado = []
+        for parte, contagem in zip(self.partes, self._contagens):
+            if inicio < contagem and fim > 0:
+                resultado += list(parte[max(inicio, 0):min(fim, contagem)])
+            inicio -= contagem
+            fim -= contagem
+        return resultado
+
+
+def em_todos_os_shards(queryset):
+    """queryset se houver um so shard; senao a ConsultaEmShards equivalente"""
+    return queryset if len(shards()) == 1 else ConsultaEmShards(queryset)
+
+
+def preparar_sequencias(alias, tabelas=('contas_cliente', 'contas_conta')):
+    """Faz os proximos codigos de cliente e numeros de conta do shard comecarem na faixa dele"""
+    inicio, _ = faixa(alias)
+    if not inicio:
+        return
+    conexao = connections[alias]
+    with conexao.cursor() as cursor:
+        for tabela in tabelas:
+            if conexao.vendor == 'sqlite':
+                cursor.execute('SELECT seq FROM sqlite_sequence WHERE name = %s', [tabela])
+                linha = cursor.fetchone()
+                if linha is None:
+                    cursor.execute('INSERT INTO sqlite_sequence (name, seq) VALUES (%s, %s)', [tabela, inicio])
+                elif linha[0] < inicio:
+                    cursor.execute('UPDATE sqlite_sequence SET seq = %s WHERE name = %s', [inicio, tabela])
+            elif conexao.vendor == 'postgresql':
+                coluna = 'numero' if tabela == 'contas_conta' else 'codigo'
+                cursor.execute(
+                    f"SELECT setval(pg_get_serial_sequence('{tabela}', '{coluna}'), "
+                    f'GREATEST(%s, (SELECT COALESCE(MAX({coluna}), 0) FROM {tabela})))',
+                    [inicio],
+                )
+            else:
+                raise NotImplementedError(f'Sequencias de {conexao.vendor} nao suportadas')
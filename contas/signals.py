@@ -0,0 +1,107 @@
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from . import estatisticas
+from .cache_pix import resolvedor_pix
+from .fragmentos import cache_fragmentos
+from .models import ChavePix, Cliente, Conta, DiretorioPix, EventoTransacao, Transacao
+from .perfil import medir_consulta
+from .roteador import configuracao as configuracao_roteamento, observar_escritas
+
+
+def _invalidar_apos_commit(*chaves, using=DEFAULT_DB_ALIAS):
+    """Invalida so depois do commit, para que nenhuma leitura reabasteca o cache com dados antigos"""
+    chaves = [chave for chave in chaves if chave]
+    if chaves:
+        transaction.on_commit(lambda: resolvedor_pix.invalidar(*chaves), using=using)
+
+
+@receiver(pre_save, sender=ChavePix)
+def lembrar_chave_anterior(sender, instance, using, **kwargs):
+    """Guarda o valor antigo da chave, caso ela seja alterada (ex.: pelo admin)"""
+    instance._chave_anterior = None
+    if instance.pk:
+        instance._chave_anterior = (
+            ChavePix.objects.using(using).filter(pk=instance.pk).values_list('chave', flat=True).first()
+        )
+
+
+@receiver(post_save, sender=ChavePix)
+def invalidar_chave_salva(sender, instance, created, using, **kwargs):
+    _invalidar_apos_commit(instance.chave, getattr(instance, '_chave_anterior', None), using=using)
+
+
+@receiver(post_delete, sender=ChavePix)
+def invalidar_chave_removida(sender, instance, using, **kwargs):
+    DiretorioPix.objects.filter(chave=instance.chave, conta_numero=instance.conta_id).delete()
+    _invalidar_apos_commit(instance.chave, using=using)
+
+
+@receiver(post_save, sender=Cliente)
+def invalidar_chaves_do_cliente(sender, instance, created, using, **kwargs):
+    """O nome do cliente tambem fica no diretorio e no cache das suas chaves"""
+    if not created:
+        numeros = Conta.objects.using(using).filter(cliente=instance).values_list('numero', flat=True)
+        DiretorioPix.objects.filter(conta_numero__in=list(numeros)).update(nome=instance.nome)
+        chaves = ChavePix.objects.using(using).filter(conta__cliente=instance).values_list('chave', flat=True)
+        _invalidar_apos_commit(*chaves, using=using)
+
+
+@receiver(post_save, sender=Cliente)
+@receiver(post_save, sender=Conta)
+@receiver(post_delete, sender=Conta)
+@receiver(post_save, sender=ChavePix)
+@receiver(post_delete, sender=ChavePix)
+def invalidar_fragmentos(sender, instance, using, **kwargs):
+    """Trechos de pagina das contas afetadas (as operacoes com dinheiro invalidam em _lancar)"""
+    if sender is Cliente:
+        if kwargs.get('created'):
+            return
+        numeros = list(Conta.objects.using(using).filter(cliente=instance).values_list('numero', flat=True))
+    else:
+        numeros = [instance.pk if sender is Conta else instance.conta_id]
+    cache_fragmentos.invalidar_apos_commit(numeros, using=using)
+
+
+@receiver(post_save, sender=Transacao)
+def registrar_evento(sender, instance, created, using, **kwargs):
+    """Outbox: o evento e gravado no mesmo transaction.atomic() da operacao (bulk_create grava o seu)"""
+    if created:
+        EventoTransacao.de_transacao(instance).save(using=using)
+
+
+@receiver(post_save, sender=Cliente)
+@receiver(post_save, sender=Conta)
+def contar_cadastro(sender, instance, created, **kwargs):
+    if created:
+        estatisticas.incrementar(estatisticas.CLIENTES if sender is Cliente else estatisticas.CONTAS)
+
+
+@receiver(post_delete, sender=Cliente)
+@receiver(post_delete, sender=Conta)
+def descontar_cadastro(sender, instance, **kwargs):
+    estatisticas.incrementar(estatisticas.CLIENTES if sender is Cliente else estatisticas.CONTAS, -1)
+
+
+@receiver(connection_created)
+def observar_conexao(sender, connection, **kwargs):
+    """Escritas da requisicao (roteamento) e consultas da requisicao medida (perfil), em qualquer thread"""
+    for observador in (observar_escritas, medir_consulta):
+        # A mesma conexao dispara o sinal de novo a cada reconexao
+        if observador not in connection.execute_wrappers:
+            connection.execute_wrappers.append(observador)
+
+
+@receiver(connection_created)
+def configurar_sqlite(sender, connection, **kwargs):
+    """Aplica settings.SQLITE_PRAGMAS a cada nova conexao SQLite"""
+    if connection.vendor != 'sqlite':
+        return
+    for pragma, valor in getattr(settings, 'SQLITE_PRAGMAS', {}).items():
+        connection.connection.execute(f'PRAGMA {pragma} = {valor}')
+    if connection.alias == configuracao_roteamento()[0]:
+        # A replica nunca recebe escritas, nem por engano
+        connection.connection.execute('PRAGMA query_only = ON')
@@ -1,3 +1,1646 @@
-from django.test import TestCase
+import asyncio
+import csv
+import gzip
+import importlib
+import itertools
+import os
+import pstats
+import sys
+import tempfile
+import threading
+import tracemalloc
+from xml.dom import minidom
+from datetime import date, datetime, time, timedelta
+from decimal import ROUND_HALF_UP, Decimal
+from io import StringIO
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, iscoroutinefunction
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import OperationalError, close_old_connections, connection, connections, transaction
+from django.db.models import Sum
+from django.http import HttpResponse
+from django.template import engines
+from django.template.base import Template as DjangoTemplate
+from django.test import (
+    AsyncClient, Client, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings,
+)
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from . import estatisticas, models
+from .antifraude import MotorAntifraude, motor_antifraude, reproduzir
+from .aquecimento import aquecer, aquecer_templates
+from .arquivamento import inicio_tabela_quente
+from .benchmarks import comparar
+from .cache_pix import ResolvedorChavesPix, resolvedor_pix
+from .estaticos import ArmazenamentoEstatico, EstaticosMiddleware
+from .exportacao import extrato_csv, extrato_ofx, linhas_extrato
+from .extrato import pagina_extrato
+from .fechamento import calcular, fechar
+from .fragmentos import CacheFragmentos, cache_fragmentos
+from .limites import BaldesCache, BaldesMemoria, LimiteRequisicoesMiddleware
+from .importacao import importar_clientes
+from .lote import processar_lote
+from .outbox import DestinoFila, Despachante, atraso, despachar
+from .perfil import Histograma, PerfilMiddleware, registro_perfil
+from .saldos import fotografar, saldo_em
+from .roteador import (
+    COOKIE_FIXACAO, EstadoRequisicao, RoteadorLeituraEscrita, RoteamentoMiddleware, _estado_requisicao, na_replica,
+)
+from .shards import preparar_sequencias, shard_para_cpf
+from .models import (
+    MENSAGEM_CHAVE_REUTILIZADA, MENSAGEM_VALOR_INVALIDO, Cliente, Conta, ChavePix, DiretorioPix, Estatistica,
+    EventoTransacao, Idempotencia, Lancamento,
+    SaldoDiario, Transacao, TransacaoArquivada, TransferenciaEntreShards, VolumeDiario, soma_rubrica,
+)
+
+_cpfs = itertools.count(1)
+
+
+def criar_conta(nome, saldo='0.00', limite='100.00', banco='default'):
+    """Cria um cliente com sua conta para uso nos testes"""
+    cliente = Cliente.objects.using(banco).create(
+        nome=nome,
+        email=f'{nome.lower().replace(" ", ".")}@exemplo.com',
+        cpf=f'{next(_cpfs):011d}',
+        data_nascimento=date(1990, 1, 1),
+    )
+    return Conta.objects.using(banco).create(cliente=cliente, saldo=Decimal(saldo), limite=Decimal(limite))
+
+
+def assincrono(classe_middleware):
+    """True se o middleware, montado sobre um handler async, e ele mesmo uma corrotina (sem passar por thread)"""
+    async def get_response(request):
+        return HttpResponse('ok')
+
+    middleware = classe_middleware(get_response)
+    resposta = async_to_sync(middleware)(RequestFactory().get('/'))
+    return iscoroutinefunction(middleware) and resposta.content == b'ok'
+
+
+class BancoTestCase(TestCase):
+    """TestCase que descarta caches de processo entre os testes"""
+
+    def setUp(self):
+        super().setUp()
+        # O rollback do TestCase nao dispara on_commit, que e quando os caches sao invalidados
+        resolvedor_pix.limpar()
+        motor_antifraude.limpar()
+        # Os numeros de conta se repetem entre os testes, e os trechos guardados nao
+        cache_fragmentos.cache.clear()
+        cache_fragmentos.zerar_estatisticas()
+
+
+class OperacoesContaTest(BancoTestCase):
+    """Regras de negocio dos metodos de movimentacao da Conta"""
+
+    def setUp(self):
+        super().setUp()
+        self.origem = criar_conta('Ana Souza', saldo='100.00')
+        self.destino = criar_conta('Bruno Lima')
+
+    def test_deposito_registra_transacao(self):
+        sucesso, _ = self.origem.depositar('50,00'.replace(',', '.'))
+
+        self.assertTrue(sucesso)
+        self.assertEqual(self.origem.saldo, Decimal('150.00'))
+        self.assertEqual(self.origem.transacoes.get().tipo, 'D')
+
+    def test_valor_que_nao_cabe_no_razao_e_recusado(self):
+        for valor in ('0.004', '1e20', '10000000000.00', 'NaN'):
+            self.assertEqual(self.origem.depositar(valor), (False, MENSAGEM_VALOR_INVALIDO))
+        self.assertEqual(
+            self.origem.transferir_pix('qualquer@pix.com', '0.001'), (False, MENSAGEM_VALOR_INVALIDO, None)
+        )
+
+        self.assertFalse(Transacao.objects.exists())
+        self.origem.refresh_from_db()
+        self.assertEqual(self.origem.saldo, Decimal('100.00'))
+
+    def test_saque_usa_limite_quando_saldo_nao_basta(self):
+        sucesso, _ = self.origem.sacar(Decimal('150.00'))
+
+        self.assertTrue(sucesso)
+        self.origem.refresh_from_db()
+        self.assertEqual(self.origem.saldo, Decimal('0.00'))
+        self.assertEqual(self.origem.limite, Decimal('50.00'))
+
+    def test_saque_acima_do_saldo_total_nao_altera_conta(self):
+        sucesso, _ = self.origem.sacar(Decimal('200.01'))
+
+        self.assertFalse(sucesso)
+        self.origem.refresh_from_db()
+        self.assertEqual(self.origem.saldo_total, Decimal('200.00'))
+        self.assertFalse(Transacao.objects.exists())
+
+    def test_transferencia_debita_credita_e_registra(self):
+        sucesso, _ = self.origem.transferir(self.destino, Decimal('30.00'))
+
+        self.assertTrue(sucesso)
+        self.assertEqual(self.origem.saldo, Decimal('70.00'))
+        self.assertEqual(self.destino.saldo, Decimal('30.00'))
+        transacao = Transacao.objects.get()
+        self.assertEqual((transacao.tipo, transacao.conta_destino), ('T', self.destino))
+
+    def test_transferencia_usa_saldo_do_banco_e_nao_o_objeto_em_memoria(self):
+        # Outra instancia da mesma conta ja gastou o saldo
+        Conta.objects.get(pk=self.origem.pk).sacar(Decimal('100.00'))
+
+        sucesso, _ = self.origem.transferir(self.destino, Decimal('150.00'))
+
+        self.assertFalse(sucesso)
+        self.destino.refresh_from_db()
+        self.assertEqual(self.destino.saldo, Decimal('0.00'))
+
+    def test_pix(self):
+        ChavePix.objects.create(conta=self.destino, tipo_chave='EMAIL', chave='bruno@pix.com')
+
+        sucesso, _, destino = self.origem.transferir_pix('bruno@pix.com', Decimal('10.00'))
+
+        self.assertTrue(sucesso)
+        self.assertEqual(destino, (self.destino.numero, 'Bruno Lima'))
+        self.destino.refresh_from_db()
+        self.assertEqual(self.destino.saldo, Decimal('10.00'))
+        self.assertEqual(Transacao.objects.get().descricao, 'PIX para Bruno Lima')
+
+
+class RazaoTest(BancoTestCase):
+    """Lancamentos em partidas dobradas e saldos como projecao do razao"""
+
+    def setUp(self):
+        super().setUp()
+        self.origem = criar_conta('Ana Souza', saldo='50.00')
+        self.destino = criar_conta('Bruno Lima')
+
+    def soma(self, **filtros):
+        return Lancamento.objects.filter(**filtros).aggregate(total=Sum('valor'))['total'] or Decimal('0.00')
+
+    def test_movimentos_sao_balanceados(self):
+        self.origem.depositar(Decimal('10.00'))
+        self.origem.transferir(self.destino, Decimal('80.00'))
+        self.destino.sacar(Decimal('5.00'))
+
+        self.assertEqual(self.soma(natureza='C'), self.soma(natureza='D'))
+        transferencia = Transacao.objects.get(tipo='T')
+        self.assertEqual(
+            sorted(transferencia.lancamentos.values_list('conta', 'rubrica', 'natureza', 'valor')),
+            [
+                (self.origem.numero, 'L', 'D', Decimal('20.00')),
+                (self.origem.numero, 'S', 'D', Decimal('60.00')),
+                (self.destino.numero, 'S', 'C', Decimal('80.00')),
+            ],
+        )
+
+    def test_lancamentos_sao_imutaveis(self):
+        lancamento = Lancamento.objects.first()
+
+        with self.assertRaises(ValueError):
+            lancamento.save()
+        with self.assertRaises(ValueError):
+            Lancamento.objects.update(valor=Decimal('1.00'))
+        with self.assertRaises(ValueError):
+            Lancamento.objects.all().delete()
+
+    def test_rebuild_balances_corrige_saldo_divergente(self):
+        self.origem.transferir(self.destino, Decimal('80.00'))
+        self.destino.ajustar_limite(Decimal('300.00'))
+        Conta.objects.filter(pk=self.origem.pk).update(saldo=Decimal('999.00'))
+
+        saida = StringIO()
+        call_command('rebuild_balances', chunk_size=1, stdout=saida)
+
+        self.origem.refresh_from_db()
+        self.destino.refresh_from_db()
+        self.assertEqual((self.origem.saldo, self.origem.limite), (Decimal('0.00'), Decimal('70.00')))
+        self.assertEqual((self.destino.saldo, self.destino.limite), (Decimal('80.00'), Decimal('300.00')))
+        self.assertIn('1 divergencias corrigidas', saida.getvalue())
+
+    def test_rebuild_balances_verificar_nao_altera(self):
+        Conta.objects.filter(pk=self.origem.pk).update(saldo=Decimal('999.00'))
+
+        call_command('rebuild_balances', verificar=True, stdout=StringIO())
+
+        self.origem.refresh_from_db()
+        self.assertEqual(self.origem.saldo, Decimal('999.00'))
+
+
+class ExtratoTest(BancoTestCase):
+    """Extrato paginado por cursor (data_hora, id)"""
+
+    def setUp(self):
+        super().setUp()
+        self.conta = criar_conta('Ana Souza', saldo='1000.00')
+        self.outra = criar_conta('Bruno Lima', saldo='1000.00')
+        for indice in range(7):
+            self.conta.transferir(self.outra, Decimal('1.00'))
+            self.outra.transferir(self.conta, Decimal('2.00'))
+
+    def test_paginas_cobrem_enviadas_e_recebidas_sem_repetir(self):
+        vistas, cursor = [], None
+        while True:
+            transacoes, proximo = pagina_extrato(self.conta, cursor, tamanho=4)
+            vistas += [transacao.pk for transacao in transacoes]
+            if proximo is None:
+                break
+            cursor = (transacoes[-1].data_hora, transacoes[-1].pk)
+
+        esperadas = Transacao.objects.order_by('-data_hora', '-id').values_list('pk', flat=True)
+        self.assertEqual(vistas, list(esperadas))
+
+    def test_consultas_nao_usam_offset(self):
+        with CaptureQueriesContext(connection) as consultas:
+            pagina_extrato(self.conta, (Transacao.objects.last().data_hora, Transacao.objects.last().pk))
+
+        self.assertTrue(consultas.captured_queries)
+        self.assertFalse(any('OFFSET' in consulta['sql'] for consulta in consultas.captured_queries))
+
+    def test_view_segue_cursor_e_rejeita_cursor_invalido(self):
+        url = reverse('extrato', args=[self.conta.numero])
+
+        resposta = self.client.get(url)
+        self.assertEqual(len(resposta.context['transacoes']), 14)
+        self.assertIsNone(resposta.context['proximo_cursor'])
+        self.assertEqual(self.client.get(url, {'cursor': 'invalido'}).status_code, 404)
+
+        # ?cursor= vazio (formulario ou link sem valor) e a primeira pagina
+        vazio = self.client.get(url, {'cursor': ''})
+        self.assertEqual(vazio.status_code, 200)
+        self.assertTrue(vazio.context['primeira_pagina'])
+        self.assertEqual(len(vazio.context['transacoes']), 14)
+
+
+class ArquivamentoTest(BancoTestCase):
+    """Transacoes antigas na tabela fria, ainda visiveis no extrato"""
+
+    def setUp(self):
+        super().setUp()
+        self.conta = criar_conta('Ana Souza', saldo='1000.00')
+        self.outra = criar_conta('Bruno Lima', saldo='1000.00')
+        for indice in range(3):
+            self.conta.transferir(self.outra, Decimal('1.00'))
+            self.outra.transferir(self.conta, Decimal('2.00'))
+        antigas = Transacao.objects.order_by('pk')[:4].values_list('pk', flat=True)
+        passado = inicio_tabela_quente() - timedelta(days=1)
+        Transacao.objects.filter(pk__in=list(antigas)).update(data_hora=passado)
+        Conta.objects.update(data_abertura=passado - timedelta(days=1))
+        self.conta.refresh_from_db()
+        self.esperadas = list(Transacao.objects.order_by('-data_hora', '-id').values_list('pk', flat=True))
+        estatisticas.atualizar_volumes(margem=timedelta(0))
+        call_command('arquivar_transacoes', '--lote', '3', stdout=StringIO())
+
+    def test_move_em_lotes_e_extrato_une_as_tabelas(self):
+        self.assertEqual((Transacao.objects.count(), TransacaoArquivada.objects.count()), (2, 4))
+        arquivadas = TransacaoArquivada.objects.values_list('pk', flat=True)
+        self.assertTrue(Lancamento.objects.filter(transacao_id__in=list(arquivadas)).exists())
+
+        vistas, cursor = [], None
+        while True:
+            transacoes, proximo = pagina_extrato(self.conta, cursor, tamanho=4)
+            vistas += [transacao.pk for transacao in transacoes]
+            if proximo is None:
+                break
+            cursor = (transacoes[-1].data_hora, transacoes[-1].pk)
+        self.assertEqual(vistas, self.esperadas)
+        self.assertContains(self.client.get(reverse('extrato', args=[self.conta.numero])), 'Recebido da conta')
+
+    def test_exportacao_e_reconciliacao_contam_o_arquivo(self):
+        descricoes = [linha.descricao for linha in linhas_extrato(self.conta)]
+        self.assertEqual(sum('Recebido da conta' in descricao for descricao in descricoes), 3)
+        self.assertEqual(estatisticas.reconciliar(margem=timedelta(0)), [])
+
+
+class SaldoDiarioTest(BancoTestCase):
+    """Fotos de saldo no fim do dia e saldo em um momento passado"""
+
+    def setUp(self):
+        super().setUp()
+        self.dias = [timezone.localdate() - timedelta(days=atras) for atras in (10, 9, 7, 6)]
+        with self.no_dia(self.dias[0]):
+            self.conta = criar_conta('Ana Souza', saldo='100.00', limite='50.00')
+        with self.no_dia(self.dias[1]):
+            self.conta.depositar(Decimal('20.00'))
+        with self.no_dia(self.dias[2]):
+            self.conta.sacar(Decimal('150.00'))
+
+    def no_dia(self, dia, hora=12):
+        return mock.patch('django.utils.timezone.now', return_value=timezone.make_aware(datetime.combine(dia, time(hora))))
+
+    def fim_do_dia(self, dia):
+        return timezone.make_aware(datetime.combine(dia + timedelta(days=1), time.min))
+
+    def test_fotos_so_nos_dias_com_movimento(self):
+        self.assertEqual(fotografar(ate=self.dias[3]), 3)
+        self.assertEqual(fotografar(ate=self.dias[3]), 0)
+
+        fotos = SaldoDiario.objects.filter(conta=self.conta).order_by('data')
+        self.assertEqual(
+            [(foto.data, foto.saldo, foto.limite) for foto in fotos],
+            [
+                (self.dias[0], Decimal('100.00'), Decimal('50.00')),
+                (self.dias[1], Decimal('120.00'), Decimal('50.00')),
+                (self.dias[2], Decimal('0.00'), Decimal('20.00')),
+            ],
+        )
+
+    def test_saldo_em_soma_a_foto_e_o_movimento_do_dia(self):
+        fotografar(ate=self.dias[1])
+        with self.no_dia(self.dias[3], hora=9):
+            self.conta.depositar(Decimal('5.00'))
+
+        self.assertEqual(saldo_em(self.conta, self.fim_do_dia(self.dias[1])), (Decimal('120.00'), Decimal('50.00')))
+        with self.assertNumQueries(2):
+            saldo = saldo_em(self.conta, self.fim_do_dia(self.dias[3]) - timedelta(hours=1))
+        self.assertEqual(saldo, (Decimal('5.00'), Decimal('20.00')))
+        self.assertEqual(saldo_em(self.conta, self.fim_do_dia(self.dias[0]) - timedelta(days=2)), (Decimal('0.00'), Decimal('0.00')))
+
+    def test_relatorio_e_detalhe_da_conta(self):
+        with self.assertRaises(CommandError):
+            call_command('relatorio_saldos', str(self.dias[1]), stdout=StringIO())
+        call_command('fotografar_saldos', stdout=StringIO())
+        saida = StringIO()
+        call_command('relatorio_saldos', str(self.dias[1]), stdout=saida)
+
+        self.assertEqual(saida.getvalue().splitlines(), ['conta,saldo,limite', f'{self.conta.numero},120.00,50.00'])
+        resposta = self.client.get(reverse('conta_detail', args=[self.conta.numero]), {'data': str(self.dias[2])})
+        self.assertContains(resposta, 'Saldo R$ 0,00')
+        self.assertContains(
+            self.client.get(reverse('conta_detail', args=[self.conta.numero]), {'data': '2026-02-30'}), 'Data invalida!'
+        )
+
+
+@override_settings(FECHAMENTO={'JUROS_LIMITE_DIA': '0.0033', 'TARIFA_MENSAL': '12.50', 'TAMANHO_BLOCO': 1})
+class FechamentoTest(BancoTestCase):
+    """Fechamento do dia em blocos: recomposicao do limite, juros e tarifa"""
+
+    def setUp(self):
+        super().setUp()
+        self.devedora = criar_conta('Ana Souza', saldo='0.00', limite='100.00')
+        self.devedora.sacar(Decimal('60.00'))
+        self.devedora.depositar(Decimal('30.00'))
+        self.outra_devedora = criar_conta('Bruno Lima', saldo='0.00', limite='100.00')
+        self.outra_devedora.sacar(Decimal('90.00'))
+        self.em_dia = criar_conta('Carla Dias', saldo='50.00')
+
+    def razao(self, conta):
+        return tuple(conta.lancamentos.aggregate(saldo=soma_rubrica('S'), limite=soma_rubrica('L')).values())
+
+    def test_recompoe_o_limite_e_cobra_juros_uma_vez(self):
+        self.assertEqual(fechar(ate=date(2026, 10, 14)), 2)
+        self.assertEqual(fechar(ate=date(2026, 10, 14)), 0)
+
+        self.devedora.refresh_from_db()
+        self.outra_devedora.refresh_from_db()
+        # 30,00 de saldo voltam para o limite; juros de 0,33% sobre os 30,00 ainda usados
+        self.assertEqual((self.devedora.saldo, self.devedora.limite), (Decimal('0.00'), Decimal('69.90')))
+        self.assertEqual((self.outra_devedora.saldo, self.outra_devedora.limite), (Decimal('0.00'), Decimal('9.70')))
+        self.assertEqual(
+            list(Transacao.objects.filter(tipo='J').order_by('conta').values_list('conta', 'valor')),
+            [(self.devedora.numero, Decimal('0.10')), (self.outra_devedora.numero, Decimal('0.30'))],
+        )
+        for conta in (self.devedora, self.outra_devedora):
+            self.assertEqual(self.razao(conta), (conta.saldo, conta.limite))
+
+    def test_tarifa_no_primeiro_dia_do_mes_e_retomada(self):
+        fechar(ate=date(2026, 9, 30))
+        self.assertEqual(Transacao.objects.filter(tipo='F').count(), 0)
+        self.assertEqual(fechar(ate=date(2026, 10, 1)), 3)
+
+        self.em_dia.refresh_from_db()
+        self.assertEqual(self.em_dia.saldo, Decimal('37.50'))
+        self.assertEqual(self.razao(self.em_dia), (Decimal('37.50'), Decimal('100.00')))
+        self.assertEqual(Estatistica.objects.get(nome='fechamento_ultima_conta').quantidade, 0)
+
+    def test_centavos_arredondam_como_decimal(self):
+        for usado, taxa in [(100, '0.005'), (149, '0.0033'), (151, '0.0033'), (12_345_678, '0.0001')]:
+            esperado = (Decimal(usado) / 100 * Decimal(taxa)).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+            juros_limite = calcular(0, 100_000_000 - usado, 100_000_000, Decimal(taxa), 0)[2]
+            self.assertEqual(Decimal(juros_limite) / 100, esperado)
+
+
+class ImportacaoTest(BancoTestCase):
+    """Importacao de clientes em blocos com relatorio de linhas recusadas"""
+
+    def setUp(self):
+        super().setUp()
+        self.existente = criar_conta('Ana Souza')
+        Cliente.objects.filter(pk=self.existente.cliente_id).update(cpf='52998224725')
+
+    def test_importa_em_blocos_e_recusa_invalidas(self):
+        arquivo = StringIO(
+            'nome,email,cpf,data_nascimento\n'
+            'Bruno Lima,bruno@exemplo.com,111.444.777-35,1990-05-01\n'
+            'Carla Dias,CARLA@exemplo.com,12345678909,15/08/1985\n'
+            'Outra Ana,ana2@exemplo.com,529.982.247-25,1990-01-01\n'
+            'Repetido,bruno@exemplo.com,935.411.347-80,1990-01-01\n'
+            'Digito Errado,errado@exemplo.com,111.444.777-36,1990-01-01\n'
+            'Sem Email,,935.411.347-80,1990-01-01\n'
+            'Data Ruim,data@exemplo.com,935.411.347-80,31/02/1990\n'
+            'Daniel Reis,daniel@exemplo.com,935.411.347-80,1979-12-31\n'
+        )
+        importados, rejeitadas = importar_clientes(arquivo, gerar_chave_pix=True, tamanho_bloco=4)
+
+        self.assertEqual(importados, 3)
+        self.assertEqual(
+            [(rejeitada.linha, rejeitada.motivo) for rejeitada in rejeitadas],
+            [
+                (4, 'CPF ou e-mail ja cadastrado!'),
+                (5, 'CPF ou e-mail repetido no arquivo!'),
+                (6, 'CPF invalido!'),
+                (7, 'E-mail invalido!'),
+                (8, 'Data de nascimento invalida!'),
+            ],
+        )
+        carla = Conta.objects.select_related('cliente').get(cliente__cpf='123.456.789-09')
+        self.assertEqual((carla.cliente.email, carla.limite, carla.limite_contratado), ('carla@exemplo.com', Decimal('100.00'), Decimal('100.00')))
+        self.assertEqual(DiretorioPix.objects.get(conta_numero=carla.numero).nome, 'Carla Dias')
+        self.assertEqual(estatisticas.painel()[estatisticas.CONTAS].quantidade, 4)
+        saida = StringIO()
+        call_command('rebuild_balances', verificar=True, stdout=saida)
+        self.assertIn('0 divergencias', saida.getvalue())
+
+
+class OutboxTest(BancoTestCase):
+    """Eventos de transacao gravados com a operacao e entregues pelo despachante"""
+
+    def setUp(self):
+        super().setUp()
+        self.conta = criar_conta('Ana Souza', saldo='100.00')
+        self.outra = criar_conta('Bruno Lima')
+        self.conta.depositar(Decimal('10.00'))
+        processar_lote([{'origem': self.conta.numero, 'conta_destino': self.outra.numero, 'valor': '5.00'}])
+
+    def test_entrega_pelo_menos_uma_vez_e_limpa(self):
+        fila = DestinoFila()
+        despachar(destinos={'fila': fila}, tamanho_lote=1)
+
+        eventos = [fila.fila.get_nowait() for _ in range(fila.fila.qsize())]
+        self.assertEqual([evento['id'] for evento in eventos], list(Transacao.objects.order_by('pk').values_list('pk', flat=True)))
+        self.assertEqual((eventos[0]['tipo'], eventos[0]['valor'], eventos[0]['conta']), ('D', '10.00', self.conta.numero))
+        self.assertFalse(EventoTransacao.objects.exists())
+        self.assertEqual(atraso(['fila']), {'fila': (0, 0.0)})
+
+        self.outra.depositar(Decimal('1.00'))
+        self.assertEqual(atraso(['fila'])['fila'][0], 1)
+        despachar(destinos={'fila': fila})
+        self.assertEqual(fila.fila.get_nowait()['conta'], self.outra.numero)
+
+    def test_destino_com_falha_recebe_o_lote_de_novo(self):
+        recebidos, parar = [], asyncio.Event()
+
+        class Instavel:
+            falhas = 1
+
+            async def entregar(self, eventos):
+                if self.falhas:
+                    self.falhas -= 1
+                    raise ConnectionError('destino fora do ar')
+                recebidos.extend(eventos)
+                parar.set()
+
+        despachante = Despachante(destinos={'instavel': Instavel()}, intervalo=0)
+        async_to_sync(despachante.executar)(parar)
+
+        self.assertEqual(len(recebidos), Transacao.objects.count())
+        self.assertEqual(despachante.metricas['instavel'].falhas, 1)
+        self.assertIn('destino fora do ar', despachante.metricas['instavel'].ultimo_erro)
+        self.assertEqual(atraso(['instavel'])['instavel'][0], 0)
+
+    def test_fora_do_sqlite_cursor_nao_passa_de_evento_recente(self):
+        # Simula um banco em que ids concorrentes commitam fora de ordem
+        antigos = list(EventoTransacao.objects.order_by('pk'))
+        EventoTransacao.objects.filter(pk=antigos[0].pk).update(criado_em=timezone.now() - timedelta(minutes=1))
+        fila = DestinoFila()
+
+        with mock.patch('contas.outbox.janela_commit', return_value=30):
+            despachar(destinos={'fila': fila})
+            self.assertEqual(fila.fila.qsize(), 1)
+            self.assertEqual(atraso(['fila'])['fila'][0], len(antigos) - 1)
+
+            EventoTransacao.objects.update(criado_em=timezone.now() - timedelta(minutes=1))
+            despachar(destinos={'fila': fila})
+
+        self.assertEqual(fila.fila.qsize(), len(antigos))
+        self.assertFalse(EventoTransacao.objects.exists())
+
+
+class AntifraudeTest(BancoTestCase):
+    """Regras de velocidade do PIX avaliadas em memoria"""
+
+    def setUp(self):
+        super().setUp()
+        self.origem = criar_conta('Ana Souza', saldo='1000.00')
+        self.destinos = [criar_conta(f'Cliente {indice}') for indice in range(3)]
+        for destino in self.destinos:
+            destino.chaves_pix.create(tipo_chave='EMAIL', chave=f'cliente{destino.numero}@pix.com')
+        self.meio_dia = timezone.make_aware(datetime(2026, 10, 15, 12, 0))
+
+    def test_pix_por_minuto_sem_consultar_transacoes(self):
+        chave = f'cliente{self.destinos[0].numero}@pix.com'
+        with mock.patch('contas.models.motor_antifraude', MotorAntifraude({'PIX_POR_MINUTO': 2})):
+            for _ in range(2):
+                with self.captureOnCommitCallbacks(execute=True):
+                    self.assertTrue(self.origem.transferir_pix(chave, Decimal('1.00'))[0])
+            with CaptureQueriesContext(connection) as consultas:
+                sucesso, mensagem, _ = self.origem.transferir_pix(chave, Decimal('1.00'))
+
+        self.assertFalse(sucesso)
+        self.assertEqual(mensagem, 'Muitos PIX em sequencia, aguarde alguns minutos!')
+        self.assertFalse([consulta for consulta in consultas.captured_queries if 'contas_transacao' in consulta['sql']])
+        self.assertEqual(Transacao.objects.filter(tipo='P').count(), 2)
+
+    def test_avalia_com_a_conta_bloqueada_e_so_registra_no_commit(self):
+        chave = f'cliente{self.destinos[0].numero}@pix.com'
+        motor = MotorAntifraude({'PIX_POR_MINUTO': 1})
+        ordem = []
+        bloquear, avaliar = models._bloquear_contas, motor.avaliar
+
+        def bloquear_espiando(*numeros):
+            ordem.append('bloquear')
+            return bloquear(*numeros)
+
+        def avaliar_espiando(*args):
+            ordem.append('avaliar')
+            return avaliar(*args)
+
+        with mock.patch('contas.models.motor_antifraude', motor), \
+                mock.patch('contas.models._bloquear_contas', bloquear_espiando), \
+                mock.patch.object(motor, 'avaliar', avaliar_espiando):
+            # PIX desfeito pelo rollback (como o do bloco de idempotencia) nao conta na janela
+            with self.captureOnCommitCallbacks(execute=True):
+                with self.assertRaises(RuntimeError), transaction.atomic():
+                    self.assertTrue(self.origem.transferir_pix(chave, Decimal('1.00'))[0])
+                    raise RuntimeError
+            with self.captureOnCommitCallbacks(execute=True):
+                self.assertTrue(self.origem.transferir_pix(chave, Decimal('1.00'))[0])
+            recusado = self.origem.transferir_pix(chave, Decimal('1.00'))
+
+        self.assertEqual(ordem, ['bloquear', 'avaliar'] * 3)
+        self.assertEqual(recusado[1], 'Muitos PIX em sequencia, aguarde alguns minutos!')
+        self.assertEqual(Transacao.objects.filter(tipo='P').count(), 1)
+
+    def test_janelas_deslizantes_e_limite_noturno(self):
+        motor = MotorAntifraude({'PIX_POR_HORA': 3, 'VALOR_POR_HORA': '100.00', 'NOVOS_DESTINOS_POR_HORA': 2})
+        conta = self.origem.numero
+        um, dois, tres = (destino.numero for destino in self.destinos)
+        for minuto, destino in ((0, um), (10, dois), (20, um)):
+            motor.registrar(conta, destino, '30.00', self.meio_dia + timedelta(minutes=minuto))
+
+        self.assertEqual(motor.avaliar(conta, um, '1.00', self.meio_dia + timedelta(minutes=30)).regra, 'PIX_POR_HORA')
+        # Uma hora depois do primeiro PIX ele sai da janela
+        self.assertEqual(motor.avaliar(conta, um, '10.00', self.meio_dia + timedelta(minutes=61)), (True, '', 1.0))
+        motor.registrar(conta, tres, '1.00', self.meio_dia + timedelta(minutes=61))
+        self.assertEqual(
+            motor.avaliar(conta, 999, '1.00', self.meio_dia + timedelta(minutes=65)),
+            (False, 'NOVOS_DESTINOS_POR_HORA', 1.5),
+        )
+
+        noite = timezone.make_aware(datetime(2026, 10, 15, 23, 0))
+        self.assertEqual(MotorAntifraude().avaliar(conta, um, '1000.01', noite).regra, 'NOTURNO_VALOR_MAXIMO')
+        self.assertTrue(MotorAntifraude().avaliar(conta, um, '1000.01', self.meio_dia).aprovado)
+
+    def test_reproduzir_historico(self):
+        historico = [
+            (self.origem.numero, self.destinos[0].numero, Decimal('600.00'), self.meio_dia + timedelta(seconds=segundo))
+            for segundo in range(0, 50, 5)
+        ]
+        avaliacoes = [avaliacao for _, avaliacao, _ in reproduzir(historico, MotorAntifraude())]
+
+        # Recusados nao entram na janela: o decimo tambem passa dos 5000 por minuto
+        self.assertEqual([avaliacao.regra for avaliacao in avaliacoes], [''] * 8 + ['VALOR_POR_MINUTO'] * 2)
+        self.origem.transferir_pix(f'cliente{self.destinos[0].numero}@pix.com', Decimal('5.00'))
+        saida = StringIO()
+        call_command('reproduzir_antifraude', stdout=saida)
+        self.assertIn('1 PIX avaliados, 0 seriam recusados', saida.getvalue())
+
+
+class LimiteRequisicoesTest(BancoTestCase):
+    """Baldes de fichas por conta e por IP nas URLs de operacao"""
+
+    def setUp(self):
+        super().setUp()
+        self.ana = criar_conta('Ana Souza', saldo='100.00')
+        self.bruno = criar_conta('Bruno Lima')
+
+    @override_settings(LIMITE_REQUISICOES={'ATIVO': True, 'REGRAS': {'efetuar_deposito': {'POR_CONTA': '2/m'}}})
+    def test_limite_por_conta(self):
+        url = reverse('efetuar_deposito', args=[self.ana.numero])
+        respostas = [self.client.post(url, {'valor': '10,00'}) for _ in range(3)]
+
+        self.assertEqual([resposta.status_code for resposta in respostas], [302, 302, 429])
+        self.assertEqual(respostas[2]['Retry-After'], '30')
+        self.assertEqual(Conta.objects.get(pk=self.ana.pk).saldo, Decimal('120.00'))
+        # Outra conta tem o seu balde e leituras nao gastam fichas
+        self.assertEqual(self.client.post(reverse('efetuar_deposito', args=[self.bruno.numero]), {'valor': '1,00'}).status_code, 302)
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+    @override_settings(LIMITE_REQUISICOES={'ATIVO': True, 'REGRAS': {'api_deposito': {'POR_IP': '1/h'}}})
+    def test_limite_por_ip_na_api(self):
+        self.client.post(reverse('api_deposito', args=[self.ana.numero]), {'valor': '1'}, content_type='application/json')
+        resposta = self.client.post(reverse('api_deposito', args=[self.bruno.numero]), {'valor': '1'}, content_type='application/json')
+
+        self.assertEqual(resposta.status_code, 429)
+        self.assertEqual(resposta['Retry-After'], '3600')
+        self.assertFalse(resposta.json()['sucesso'])
+        outro_ip = self.client.post(
+            reverse('api_deposito', args=[self.bruno.numero]), {'valor': '1'}, content_type='application/json', REMOTE_ADDR='10.0.0.2'
+        )
+        self.assertEqual(outro_ip.status_code, 200)
+
+    def test_fichas_se_recompoem(self):
+        for baldes in (BaldesMemoria(), BaldesCache('default')):
+            with self.subTest(baldes=type(baldes).__name__), mock.patch('contas.limites.time') as relogio:
+                relogio.monotonic.return_value = relogio.time.return_value = 1000.0
+                self.assertEqual([baldes.consumir('k', 2, 0.5) for _ in range(3)], [0, 0, 2.0])
+                relogio.monotonic.return_value = relogio.time.return_value = 1001.0
+                self.assertEqual(baldes.consumir('k', 2, 0.5), 1.0)
+                relogio.monotonic.return_value = relogio.time.return_value = 1002.0
+                self.assertEqual((baldes.consumir('k', 2, 0.5), baldes.consumir('k', 2, 0.5)), (0, 2.0))
+
+    def test_recusada_por_um_balde_nao_gasta_os_outros(self):
+        for baldes in (BaldesMemoria(), BaldesCache('default')):
+            with self.subTest(baldes=type(baldes).__name__), mock.patch('contas.limites.time') as relogio:
+                relogio.monotonic.return_value = relogio.time.return_value = 1000.0
+                self.assertEqual(baldes.consumir('ip', 1, 0.5), 0)
+                # O IP esta sem fichas: a conta continua com as duas
+                self.assertEqual(baldes.consumir_todos([('conta', 2, 0.5), ('ip', 1, 0.5)]), 2.0)
+                self.assertEqual([baldes.consumir('conta', 2, 0.5) for _ in range(3)], [0, 0, 2.0])
+
+    @override_settings(LIMITE_REQUISICOES={'ATIVO': True, 'REGRAS': {'efetuar_deposito': {'POR_CONTA': '2/m'}}})
+    def test_post_recusado_pelo_csrf_nao_gasta_fichas(self):
+        url = reverse('efetuar_deposito', args=[self.ana.numero])
+        cliente = Client(enforce_csrf_checks=True)
+
+        self.assertEqual([cliente.post(url, {'valor': '1,00'}).status_code for _ in range(3)], [403] * 3)
+        cliente.get(url)
+        dados = {'valor': '1,00', 'csrfmiddlewaretoken': cliente.cookies['csrftoken'].value}
+        self.assertEqual([cliente.post(url, dados).status_code for _ in range(3)], [302, 302, 429])
+        self.assertTrue(assincrono(LimiteRequisicoesMiddleware))
+
+
+class CachePixTest(BancoTestCase):
+    """Resolucao de chaves PIX em cache e invalidacao por sinais"""
+
+    def setUp(self):
+        super().setUp()
+        self.origem = criar_conta('Ana Souza', saldo='100.00')
+        self.destino = criar_conta('Bruno Lima')
+        self.chave = ChavePix.objects.create(conta=self.destino, tipo_chave='EMAIL', chave='bruno@pix.com')
+        resolvedor_pix.zerar_estatisticas()
+
+    def consultas_de_chave(self, funcao):
+        with CaptureQueriesContext(connection) as consultas:
+            funcao()
+        return [consulta for consulta in consultas.captured_queries if 'contas_diretoriopix' in consulta['sql']]
+
+    def test_segundo_pix_nao_consulta_chave(self):
+        pix = lambda: self.origem.transferir_pix('bruno@pix.com', Decimal('1.00'))  # noqa: E731
+
+        self.assertEqual(len(self.consultas_de_chave(pix)), 1)
+        self.assertEqual(self.consultas_de_chave(pix), [])
+        estatisticas = resolvedor_pix.estatisticas()
+        self.assertEqual((estatisticas['acertos_locais'], estatisticas['consultas_banco']), (1, 1))
+        self.assertEqual(estatisticas['taxa_acerto'], 0.5)
+
+    def test_desativar_chave_invalida_cache(self):
+        self.origem.transferir_pix('bruno@pix.com', Decimal('1.00'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.get(reverse('desativar_chave_pix', args=[self.destino.numero, self.chave.pk]))
+
+        sucesso, mensagem, _ = self.origem.transferir_pix('bruno@pix.com', Decimal('1.00'))
+        self.assertFalse(sucesso)
+        self.assertEqual(mensagem, 'Chave PIX nao encontrada ou inativa!')
+
+    def test_renomear_cliente_invalida_nome_em_cache(self):
+        resolvedor_pix.resolver('bruno@pix.com')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            cliente = self.destino.cliente
+            cliente.nome = 'Bruno Lima Filho'
+            cliente.save()
+
+        self.assertEqual(resolvedor_pix.resolver('bruno@pix.com').nome, 'Bruno Lima Filho')
+
+    def test_cache_compartilhado_entre_processos(self):
+        primeiro = ResolvedorChavesPix(alias_cache='default')
+        segundo = ResolvedorChavesPix(alias_cache='default')
+        primeiro.resolver('bruno@pix.com')
+
+        self.assertEqual(self.consultas_de_chave(lambda: segundo.resolver('bruno@pix.com')), [])
+        self.assertEqual(segundo.estatisticas()['acertos_compartilhados'], 1)
+        primeiro.invalidar('bruno@pix.com')
+
+    def test_ttl_expirado_consulta_banco(self):
+        resolvedor = ResolvedorChavesPix(ttl=0)
+        resolvedor.resolver('bruno@pix.com')
+        resolvedor.resolver('bruno@pix.com')
+
+        self.assertEqual(resolvedor.estatisticas()['consultas_banco'], 2)
+
+
+class FragmentosTest(BancoTestCase):
+    """Trechos das paginas de conta em cache, invalidados pelas escritas depois do commit"""
+
+    def setUp(self):
+        super().setUp()
+        self.conta = criar_conta('Ana Souza', saldo='100.00')
+        self.outra = criar_conta('Bruno Lima')
+        self.detalhe = reverse('conta_detail', args=[self.conta.numero])
+
+    def consultas(self, url):
+        with CaptureQueriesContext(connection) as consultas:
+            resposta = self.client.get(url)
+        self.assertEqual(resposta.status_code, 200)
+        return resposta, len(consultas)
+
+    def test_acerto_nao_consulta_banco(self):
+        primeira, consultas = self.consultas(self.detalhe)
+        self.assertGreater(consultas, 0)
+
+        segunda, consultas = self.consultas(self.detalhe)
+        self.assertEqual(consultas, 0)
+        self.assertEqual(primeira.content, segunda.content)
+        self.assertEqual(
+            cache_fragmentos.estatisticas()['saldos'], {'acertos': 1, 'faltas': 1, 'taxa_acerto': 0.5}
+        )
+
+    def test_operacao_invalida_depois_do_commit(self):
+        self.client.get(self.detalhe)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.conta.transferir(self.outra, Decimal('40.00'))
+
+        resposta = self.client.get(self.detalhe)
+        self.assertContains(resposta, 'R$ 60,00')
+        self.assertContains(resposta, f'Conta {self.outra.numero}')
+        self.assertEqual(cache_fragmentos.estatisticas()['saldos']['acertos'], 0)
+
+    def test_cliente_e_chave_pix_invalidam(self):
+        self.client.get(self.detalhe)
+        with self.captureOnCommitCallbacks(execute=True):
+            cliente = self.conta.cliente
+            cliente.nome = 'Ana Souza Lima'
+            cliente.save()
+        self.assertContains(self.client.get(self.detalhe), 'Ana Souza Lima')
+
+        versao = cache_fragmentos._versoes([self.conta.numero])
+        with self.captureOnCommitCallbacks(execute=True):
+            ChavePix.objects.create(conta=self.conta, tipo_chave='EMAIL', chave='ana@pix.com')
+        self.assertNotEqual(cache_fragmentos._versoes([self.conta.numero]), versao)
+
+    def test_lista_so_renderiza_linhas_alteradas(self):
+        self.client.get(reverse('conta_list'))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.conta.depositar(Decimal('5.00'))
+        cache_fragmentos.zerar_estatisticas()
+
+        self.assertContains(self.client.get(reverse('conta_list')), 'R$ 105,00')
+        self.assertEqual(
+            cache_fragmentos.estatisticas()['linha_conta'], {'acertos': 1, 'faltas': 1, 'taxa_acerto': 0.5}
+        )
+
+    def test_desativado_sempre_renderiza(self):
+        fragmentos = CacheFragmentos(ativo=False)
+        contexto = mock.Mock(return_value={'conta': self.conta, 'transacoes': []})
+        fragmentos.renderizar(self.conta.numero, ['saldos'], contexto)
+        fragmentos.renderizar(self.conta.numero, ['saldos'], contexto)
+
+        self.assertEqual(contexto.call_count, 2)
+
+
+class LoteTest(BancoTestCase):
+    """Pagamentos em lote"""
+
+    def setUp(self):
+        super().setUp()
+        self.empresa = criar_conta('Empresa', saldo='100.00', limite='0.00')
+        self.ana = criar_conta('Ana Souza')
+        self.bruno = criar_conta('Bruno Lima')
+        self.bruno.chaves_pix.create(tipo_chave='EMAIL', chave='bruno@pix.com')
+
+    def test_relatorio_por_linha(self):
+        relatorio = processar_lote([
+            {'origem': self.empresa.numero, 'conta_destino': self.ana.numero, 'valor': '40,00'},
+            {'origem': self.empresa.numero, 'chave_pix': 'bruno@pix.com', 'valor': '50.00'},
+            {'origem': self.empresa.numero, 'chave_pix': 'inexistente', 'valor': '1.00'},
+            {'origem': self.empresa.numero, 'conta_destino': self.ana.numero, 'valor': '20.00'},
+            {'origem': self.empresa.numero, 'valor': '1.00'},
+            {'origem': self.empresa.numero, 'conta_destino': self.ana.numero, 'valor': '0.001'},
+            {'origem': self.empresa.numero, 'conta_destino': self.ana.numero, 'valor': '1e20'},
+        ])
+
+        self.assertEqual([linha['sucesso'] for linha in relatorio], [True, True, False, False, False, False, False])
+        self.assertEqual(relatorio[6]['mensagem'], 'Valor acima do maximo de uma operacao!')
+        self.assertEqual(relatorio[3]['mensagem'], 'Pagamento não realizado. Saldo insuficiente!')
+        self.assertEqual(Transacao.objects.get(pk=relatorio[1]['transacao']).descricao, 'PIX para Bruno Lima')
+        saldos = dict(Conta.objects.values_list('numero', 'saldo'))
+        self.assertEqual(
+            [saldos[self.empresa.numero], saldos[self.ana.numero], saldos[self.bruno.numero]],
+            [Decimal('10.00'), Decimal('40.00'), Decimal('50.00')],
+        )
+        saida = StringIO()
+        call_command('rebuild_balances', verificar=True, stdout=saida)
+        self.assertIn('0 divergencias', saida.getvalue())
+
+    def test_consultas_nao_crescem_com_o_lote(self):
+        def consultas(quantidade):
+            itens = [{'origem': self.ana.numero, 'chave_pix': 'bruno@pix.com', 'valor': '0.01'}] * quantidade
+            with CaptureQueriesContext(connection) as capturadas:
+                processar_lote(itens)
+            return len(capturadas)
+
+        self.assertEqual(consultas(5), consultas(50))
+
+    def test_pix_do_lote_nao_passa_pelo_antifraude(self):
+        motor = MotorAntifraude({'PIX_POR_MINUTO': 2, 'NOVOS_DESTINOS_POR_HORA': 1})
+        itens = [{'origem': self.empresa.numero, 'chave_pix': 'bruno@pix.com', 'valor': '10.00'}] * 5
+
+        with mock.patch('contas.models.motor_antifraude', motor):
+            with self.captureOnCommitCallbacks(execute=True):
+                relatorio = processar_lote(itens)
+
+        self.assertTrue(all(linha['sucesso'] for linha in relatorio))
+        self.assertEqual(motor._janelas, {})
+
+    def test_view_recebe_csv(self):
+        conteudo = (
+            'origem,chave_pix,conta_destino,valor\n'
+            f'{self.empresa.numero},bruno@pix.com,,10.00\n'
+            f'{self.empresa.numero},,999999,10.00\n'
+        )
+        arquivo = SimpleUploadedFile('folha.csv', conteudo.encode())
+
+        with self.settings(LOTE_PAGAMENTOS={'TOKENS': ['segredo-da-folha']}):
+            resposta = self.client.post(
+                reverse('lote_pagamentos'), {'arquivo': arquivo}, headers={'Authorization': 'Bearer segredo-da-folha'},
+            )
+
+        self.assertEqual(resposta.status_code, 200)
+        dados = resposta.json()
+        self.assertEqual((dados['efetuados'], dados['recusados']), (1, 1))
+        self.assertEqual(dados['linhas'][1]['mensagem'], 'Conta 999999 não encontrada!')
+
+    def test_view_recusa_arquivo_invalido(self):
+        self.client.force_login(User.objects.create_user('operador', is_staff=True))
+        arquivo = SimpleUploadedFile('folha.json', b'{"nao": "lista"}')
+
+        resposta = self.client.post(reverse('lote_pagamentos'), {'arquivo': arquivo})
+
+        self.assertEqual(resposta.status_code, 400)
+
+    def test_view_exige_token_ou_staff(self):
+        conteudo = f'origem,chave_pix,conta_destino,valor\n{self.empresa.numero},bruno@pix.com,,10.00\n'.encode()
+
+        def enviar(cliente=None, **extras):
+            arquivo = SimpleUploadedFile('folha.csv', conteudo)
+            return (cliente or self.client).post(reverse('lote_pagamentos'), {'arquivo': arquivo}, **extras).status_code
+
+        with self.settings(LOTE_PAGAMENTOS={'TOKENS': ['segredo-da-folha']}):
+            self.assertEqual(enviar(), 403)
+            self.assertEqual(enviar(headers={'Authorization': 'Bearer outro'}), 403)
+            self.client.force_login(User.objects.create_user('cliente'))
+            self.assertEqual(enviar(), 403)
+
+        # Sessao de staff passa pelo CSRF; o token dispensa
+        staff = Client(enforce_csrf_checks=True)
+        staff.force_login(User.objects.create_user('operador', is_staff=True))
+        self.assertEqual(enviar(staff), 403)
+        with self.settings(LOTE_PAGAMENTOS={'TOKENS': []}):
+            self.assertEqual(enviar(Client(enforce_csrf_checks=True), headers={'Authorization': 'Bearer '}), 403)
+
+        self.empresa.refresh_from_db()
+        self.assertEqual(self.empresa.saldo, Decimal('100.00'))
+
+
+class ExportacaoExtratoTest(BancoTestCase):
+    """Exportacao do extrato em CSV e OFX com saldo corrente"""
+
+    def setUp(self):
+        super().setUp()
+        self.conta = criar_conta('Ana Souza', saldo='10.00')
+        self.outra = criar_conta('Bruno Lima', saldo='100.00')
+        self.conta.depositar(Decimal('5.00'))
+        self.conta.sacar(Decimal('40.00'))
+        self.outra.transferir(self.conta, Decimal('30.00'))
+
+    def test_csv_com_saldo_corrente(self):
+        linhas = list(csv.reader(''.join(extrato_csv(self.conta)).splitlines()))
+
+        self.assertEqual(linhas[0], ['data_hora', 'transacao', 'descricao', 'valor', 'saldo', 'limite'])
+        self.assertEqual(
+            [linha[2:] for linha in linhas[1:]],
+            [
+                ['Abertura de conta', '110.00', '10.00', '100.00'],
+                ['Depósito em conta', '5.00', '15.00', '100.00'],
+                ['Saque em conta', '-40.00', '0.00', '75.00'],
+                [f'Recebido da conta {self.outra.numero} (Transferencia)', '30.00', '30.00', '75.00'],
+            ],
+        )
+
+    def test_ofx_bem_formado(self):
+        documento = minidom.parseString(''.join(extrato_ofx(self.conta)))
+
+        valores = [no.firstChild.data for no in documento.getElementsByTagName('TRNAMT')]
+        self.assertEqual(valores, ['110.00', '5.00', '-40.00', '30.00'])
+        self.assertEqual(documento.getElementsByTagName('BALAMT')[0].firstChild.data, '30.00')
+
+    def test_view_faz_streaming(self):
+        resposta = self.client.get(reverse('exportar_extrato', args=[self.conta.numero]), {'formato': 'ofx'})
+
+        self.assertTrue(resposta.streaming)
+        self.assertIn('extrato-', resposta['Content-Disposition'])
+        self.assertIn(b'<LEDGERBAL>', b''.join(resposta.streaming_content))
+        self.assertEqual(
+            self.client.get(reverse('exportar_extrato', args=[self.conta.numero]), {'inicio': 'ontem'}).status_code,
+            404,
+        )
+
+    def test_memoria_nao_cresce_com_o_historico(self):
+        def pico_de_memoria():
+            tracemalloc.start()
+            for _ in linhas_extrato(self.conta, chunk_size=100):
+                pass
+            pico = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            return pico
+
+        def receber(quantidade):
+            processar_lote([{'origem': self.outra.numero, 'conta_destino': self.conta.numero, 'valor': '0.01'}] * quantidade)
+
+        receber(300)
+        pico_pequeno = pico_de_memoria()
+        receber(3000)
+        pico_grande = pico_de_memoria()
+
+        # Dez vezes mais historico nao pode custar perto de dez vezes mais memoria
+        self.assertLess(pico_grande, pico_pequeno * 1.5)
+
+
+class EstatisticasTest(BancoTestCase):
+    """Contadores pre-calculados do painel"""
+
+    def setUp(self):
+        super().setUp()
+        self.ana = criar_conta('Ana Souza', saldo='100.00')
+        self.bruno = criar_conta('Bruno Lima')
+
+    def test_home_le_contadores_sem_contar_tabelas(self):
+        with CaptureQueriesContext(connection) as consultas:
+            resposta = self.client.get(reverse('home'))
+
+        self.assertEqual((resposta.context['total_clientes'], resposta.context['total_contas']), (2, 2))
+        self.assertFalse(any('COUNT' in consulta['sql'] for consulta in consultas.captured_queries))
+
+    def test_cadastro_e_exclusao_de_cliente(self):
+        cliente = Cliente.objects.create(
+            nome='Sem Conta', email='sem@conta.com', cpf='99999999999', data_nascimento=date(2000, 1, 1)
+        )
+        self.assertEqual(estatisticas.painel()[estatisticas.CLIENTES].quantidade, 3)
+
+        cliente.delete()
+        self.assertEqual(estatisticas.painel()[estatisticas.CLIENTES].quantidade, 2)
+
+    def test_atualizar_volumes_e_incremental(self):
+        self.ana.depositar(Decimal('10.00'))
+        self.ana.transferir(self.bruno, Decimal('5.00'))
+        self.ana.depositar(Decimal('2.50'))
+
+        self.assertEqual(estatisticas.atualizar_volumes(margem=timedelta(0)), 3)
+        self.assertEqual(estatisticas.atualizar_volumes(margem=timedelta(0)), 0)
+        self.assertEqual(estatisticas.atualizar_volumes(), 0)
+
+        contadores = estatisticas.painel()
+        deposito = contadores[estatisticas.nome_volume('D')]
+        self.assertEqual((deposito.quantidade, deposito.valor), (2, Decimal('12.50')))
+        self.assertEqual(VolumeDiario.objects.get(tipo='T').total, Decimal('5.00'))
+        self.assertContains(self.client.get(reverse('metricas')), 'R$ 12,50')
+
+    def test_reconciliar_corrige_desvio(self):
+        self.ana.depositar(Decimal('10.00'))
+        Transacao.objects.update(data_hora=timezone.now() - timedelta(minutes=5))
+        estatisticas.atualizar_volumes()
+        Estatistica.objects.filter(nome=estatisticas.CONTAS).update(quantidade=40)
+        VolumeDiario.objects.update(quantidade=7)
+
+        saida = StringIO()
+        call_command('reconciliar_estatisticas', stdout=saida)
+
+        self.assertIn('1 estatisticas corrigidas', saida.getvalue())
+        self.assertEqual(estatisticas.painel()[estatisticas.CONTAS].quantidade, 2)
+        self.assertEqual(VolumeDiario.objects.get().quantidade, 1)
+
+    def test_reconciliar_deixa_as_recentes_para_a_atualizacao(self):
+        self.ana.depositar(Decimal('10.00'))
+        Transacao.objects.update(data_hora=timezone.now() - timedelta(minutes=5))
+        self.ana.depositar(Decimal('2.50'))
+
+        estatisticas.reconciliar()
+        deposito = estatisticas.painel()[estatisticas.nome_volume('D')]
+        self.assertEqual((deposito.quantidade, deposito.valor), (1, Decimal('10.00')))
+
+        self.assertEqual(estatisticas.atualizar_volumes(margem=timedelta(0)), 1)
+        deposito = estatisticas.painel()[estatisticas.nome_volume('D')]
+        self.assertEqual((deposito.quantidade, deposito.valor), (2, Decimal('12.50')))
+
+
+class IdempotenciaTest(BancoTestCase):
+    """Repeticoes com a mesma chave de idempotencia"""
+
+    def setUp(self):
+        super().setUp()
+        self.ana = criar_conta('Ana Souza', saldo='100.00')
+        self.bruno = criar_conta('Bruno Lima')
+
+    def test_repeticao_devolve_resultado_sem_alterar_conta(self):
+        self.assertEqual(self.ana.sacar('30', chave_idempotencia='k1'), (True, 'Saque efetuado com sucesso!'))
+        with self.assertNumQueries(1):
+            resultado = self.ana.sacar(Decimal('30.00'), chave_idempotencia='k1')
+
+        self.assertEqual(resultado, (True, 'Saque efetuado com sucesso!'))
+        self.assertEqual(Conta.objects.get(pk=self.ana.pk).saldo, Decimal('70.00'))
+        self.assertEqual(Transacao.objects.filter(tipo='S').count(), 1)
+
+    def test_mesma_chave_com_outros_dados_e_recusada(self):
+        self.ana.transferir(self.bruno, '10', chave_idempotencia='k1')
+        self.assertEqual(self.ana.transferir(self.bruno, '20', chave_idempotencia='k1'), (False, MENSAGEM_CHAVE_REUTILIZADA))
+        # A chave e por conta: outra conta pode usar o mesmo valor
+        self.assertTrue(self.bruno.depositar('5', chave_idempotencia='k1')[0])
+
+    def test_pix_repetido_devolve_destino(self):
+        chave = ChavePix.objects.create(conta=self.bruno, tipo_chave='EMAIL', chave='bruno@exemplo.com')
+        primeiro = self.ana.transferir_pix(chave.chave, '10', chave_idempotencia='k1')
+        self.assertEqual(self.ana.transferir_pix(chave.chave, '10', chave_idempotencia='k1'), primeiro)
+        self.assertEqual(Conta.objects.get(pk=self.bruno.pk).saldo, Decimal('10.00'))
+
+    def test_formulario_reenviado_nao_repete_operacao(self):
+        url = reverse('efetuar_deposito', args=[self.ana.numero])
+        chave = self.client.get(url).context['form']['chave_idempotencia'].value()
+        for _ in range(2):
+            self.client.post(url, {'valor': '25,00', 'chave_idempotencia': chave})
+
+        self.assertEqual(Conta.objects.get(pk=self.ana.pk).saldo, Decimal('125.00'))
+
+    def test_api_aceita_cabecalho(self):
+        url = reverse('api_saque', args=[self.ana.numero])
+        respostas = [
+            self.client.post(url, {'valor': '500'}, content_type='application/json', headers={'Idempotency-Key': 'k1'})
+            for _ in range(2)
+        ]
+        self.assertEqual([resposta.status_code for resposta in respostas], [422, 422])
+        self.assertEqual(respostas[0].json(), respostas[1].json())
+        self.assertEqual(Idempotencia.objects.count(), 1)
+
+
+class PerfilTest(BancoTestCase):
+    """Middleware de perfil das requisicoes"""
+
+    def setUp(self):
+        super().setUp()
+        registro_perfil.limpar()
+        self.ana = criar_conta('Ana Souza', saldo='100.00')
+        self.bruno = criar_conta('Bruno Lima')
+        ChavePix.objects.create(conta=self.bruno, tipo_chave='EMAIL', chave='bruno@exemplo.com')
+
+    def test_histograma_interpola_quantis(self):
+        histograma = Histograma((10, 20, 30))
+        for valor in range(1, 31):
+            histograma.observar(valor)
+
+        self.assertEqual(histograma.quantil(0.5), 15)
+        self.assertEqual(histograma.quantil(0.99), 29.7)
+        self.assertEqual((histograma.total, histograma.soma), (30, 465))
+
+    def test_metricas_por_url(self):
+        with self.settings(PERFIL_REQUISICOES={'ATIVO': True}):
+            cliente = Client()
+            for _ in range(2):
+                cliente.get(reverse('conta_detail', args=[self.ana.numero]))
+            cliente.post(reverse('efetuar_pix', args=[self.ana.numero]), {'chave_pix': 'bruno@exemplo.com', 'valor': '10'})
+            texto = cliente.get(reverse('metricas_prometheus')).content.decode()
+
+        self.assertIn('bancopy_requisicao_duracao_ms_count{url="conta_detail"} 2', texto)
+        self.assertIn('bancopy_requisicao_consultas{url="efetuar_pix",quantile="0.95"}', texto)
+        self.assertIn('bancopy_secao_ms_count{secao="pix.resolver_chave"} 1', texto)
+        detalhe = registro_perfil.urls['conta_detail']
+        self.assertGreater(detalhe['consultas'].soma, 0)
+        self.assertGreater(detalhe['template_ms'].soma, 0)
+        self.assertLessEqual(detalhe['banco_ms'].soma, detalhe['duracao_ms'].soma)
+
+    def test_grava_cprofile_de_requisicao_lenta(self):
+        with tempfile.TemporaryDirectory() as diretorio:
+            config = {'ATIVO': True, 'AMOSTRAGEM_CPROFILE': 1.0, 'LIMITE_CPROFILE_MS': 0, 'DIRETORIO_CPROFILE': diretorio}
+            with self.settings(PERFIL_REQUISICOES=config):
+                Client().get(reverse('conta_detail', args=[self.ana.numero]))
+            perfis = list(Path(diretorio).glob('conta_detail-*.prof'))
+            self.assertEqual(len(perfis), 1)
+            self.assertGreater(pstats.Stats(str(perfis[0])).total_calls, 0)
+
+    def test_desativado_nao_mede_nem_expoe(self):
+        self.client.get(reverse('conta_detail', args=[self.ana.numero]))
+        self.assertEqual(self.client.get(reverse('metricas_prometheus')).status_code, 404)
+        self.assertEqual(registro_perfil.urls, {})
+
+    def test_mede_sem_alterar_o_django_e_sob_asgi(self):
+        render_original = DjangoTemplate.render
+        with self.settings(PERFIL_REQUISICOES={'ATIVO': True}):
+            self.assertTrue(assincrono(PerfilMiddleware))
+            async_to_sync(AsyncClient().get)(reverse('conta_detail', args=[self.ana.numero]))
+
+        self.assertIs(DjangoTemplate.render, render_original)
+        detalhe = registro_perfil.urls['conta_detail']
+        self.assertGreater(detalhe['consultas'].soma, 0)
+        self.assertGreater(detalhe['template_ms'].soma, 0)
+
+
+class ProducaoTest(SimpleTestCase):
+    """Perfil de producao: estaticos pre-comprimidos com cache longo, aquecimento e partida"""
+    databases = {'default'}
+
+    def setUp(self):
+        self.diretorio = tempfile.TemporaryDirectory()
+        self.addCleanup(self.diretorio.cleanup)
+        self.raiz = Path(self.diretorio.name)
+        self.conteudo = b'body { color: #333; }\n' * 100
+        (self.raiz / 'app.css').write_bytes(self.conteudo)
+        (self.raiz / 'app.0123456789ab.css').write_bytes(self.conteudo)
+        (self.raiz / 'staticfiles.json').write_text(
+            '{"paths": {"app.css": "app.0123456789ab.css"}, "version": "1.1"}'
+        )
+        ArmazenamentoEstatico(location=self.raiz).comprimir('app.0123456789ab.css')
+
+    def get(self, caminho, **cabecalhos):
+        armazenamento = {'BACKEND': 'contas.estaticos.ArmazenamentoEstatico'}
+        with override_settings(STATIC_ROOT=self.raiz, STORAGES={**settings.STORAGES, 'staticfiles': armazenamento}):
+            middleware = EstaticosMiddleware(lambda request: HttpResponse(status=404))
+            return middleware(RequestFactory().get(caminho, headers=cabecalhos))
+
+    def test_serve_versao_comprimida_com_cache_longo(self):
+        resposta = self.get('/static/app.0123456789ab.css', accept_encoding='gzip, deflate')
+
+        self.assertEqual(resposta['Content-Encoding'], 'gzip')
+        self.assertEqual(resposta['Cache-Control'], 'public, max-age=31536000, immutable')
+        self.assertEqual(gzip.decompress(b''.join(resposta.streaming_content)), self.conteudo)
+
+    def test_nome_sem_hash_e_navegador_sem_gzip(self):
+        resposta = self.get('/static/app.css')
+
+        self.assertFalse(resposta.has_header('Content-Encoding'))
+        self.assertEqual(resposta['Cache-Control'], 'public, max-age=60')
+        self.assertEqual(b''.join(resposta.streaming_content), self.conteudo)
+        self.assertEqual(self.get('/static/../staticfiles.json').status_code, 404)
+
+    def test_estaticos_sob_asgi(self):
+        armazenamento = {'BACKEND': 'contas.estaticos.ArmazenamentoEstatico'}
+        with override_settings(STATIC_ROOT=self.raiz, STORAGES={**settings.STORAGES, 'staticfiles': armazenamento}):
+            self.assertTrue(assincrono(EstaticosMiddleware))
+
+            async def get_response(request):
+                return HttpResponse(status=404)
+            middleware = EstaticosMiddleware(get_response)
+            resposta = async_to_sync(middleware)(RequestFactory().get('/static/app.css'))
+
+        self.assertEqual(resposta.status_code, 200)
+        self.assertEqual(resposta['Cache-Control'], 'public, max-age=60')
+
+    def test_producao_exige_secret_key(self):
+        with mock.patch.dict(os.environ, {'DJANGO_SECRET_KEY': ''}):
+            with self.assertRaisesMessage(ImproperlyConfigured, 'DJANGO_SECRET_KEY'):
+                importlib.reload(importlib.import_module('bancoprojeto.settings_producao'))
+
+    def test_aquecimento_compila_templates(self):
+        carregador = engines['django'].engine.template_loaders[0]
+        carregador.reset()
+
+        self.assertGreater(aquecer_templates(['contas/']), 10)
+        self.assertIn('contas/conta_detail.html', carregador.get_template_cache)
+        self.assertNotIn('admin/base.html', carregador.get_template_cache)
+
+    @override_settings(AQUECIMENTO={'ATIVO': True, 'URLS': True, 'TEMPLATES': ['contas/'], 'CONEXOES': True})
+    def test_aquecimento(self):
+        connections['default'].close()
+        medidas = aquecer()
+
+        self.assertEqual(set(medidas), {'urls', 'templates', 'conexoes'})
+        self.assertGreater(medidas['urls'][0], 50)
+        self.assertEqual(medidas['conexoes'][0], 1)
+        self.assertIsNotNone(connections['default'].connection)
+
+    def test_aquecimento_so_no_servidor(self):
+        with mock.patch('contas.aquecimento.aquecer') as aquecer_mock:
+            apps.get_app_config('contas').ready()
+            aquecer_mock.assert_not_called()
+            for modulo in ('bancoprojeto.wsgi', 'bancoprojeto.asgi'):
+                sys.modules.pop(modulo, None)
+                importlib.import_module(modulo)
+        self.assertEqual(aquecer_mock.call_count, 2)
+
+    def test_perfil_partida(self):
+        saida = StringIO()
+        call_command('perfil_partida', '--limite', '5', stdout=saida)
+
+        linhas = saida.getvalue().splitlines()
+        self.assertEqual(len(linhas), 8)
+        self.assertTrue(linhas[1].endswith('bancoprojeto.wsgi'))
+        self.assertEqual(linhas[-2], 'Aquecimento: desligado')
+
+
+class RoteamentoTest(TransactionTestCase):
+    """Leituras marcadas na replica, escritas e leituras logo apos escrever no primario"""
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        # Trata o espelho de teste como uma replica de verdade (mesmo arquivo, outra conexao)
+        self.teste_replica = connections['replica'].settings_dict['TEST']
+        self.mirror = self.teste_replica['MIRROR']
+        self.teste_replica['MIRROR'] = None
+        cache_fragmentos.cache.clear()
+        self.conta = criar_conta('Ana Souza', saldo='100.00')
+
+    def tearDown(self):
+        self.teste_replica['MIRROR'] = self.mirror
+
+    def consultas(self, alias, url, metodo='get', **dados):
+        with CaptureQueriesContext(connections[alias]) as consultas:
+            resposta = getattr(self.client, metodo)(url, dados)
+        self.assertIn(resposta.status_code, (200, 302))
+        return len(consultas)
+
+    def test_views_de_consulta_leem_da_replica(self):
+        detalhe = reverse('conta_detail', args=[self.conta.numero])
+        self.assertGreater(self.consultas('replica', detalhe), 0)
+        self.assertGreater(self.consultas('replica', reverse('api_conta', args=[self.conta.numero])), 0)
+        self.assertEqual(self.consultas('replica', reverse('efetuar_deposito', args=[self.conta.numero])), 0)
+
+    def test_depois_de_escrever_le_do_primario(self):
+        self.consultas('default', reverse('efetuar_deposito', args=[self.conta.numero]), 'post', valor='10')
+        self.assertIn(COOKIE_FIXACAO, self.client.cookies)
+
+        self.assertEqual(self.consultas('replica', reverse('conta_detail', args=[self.conta.numero])), 0)
+        self.client.cookies.pop(COOKIE_FIXACAO)
+        # Os trechos lidos do primario ficaram em cache; sem eles a pagina volta a ler da replica
+        cache_fragmentos.cache.clear()
+        self.assertGreater(self.consultas('replica', reverse('conta_detail', args=[self.conta.numero])), 0)
+
+    def test_transacao_aberta_e_escritas_ficam_no_primario(self):
+        roteador = RoteadorLeituraEscrita()
+        with na_replica():
+            self.assertEqual(roteador.db_for_read(Conta), 'replica')
+            with transaction.atomic():
+                self.assertEqual(roteador.db_for_read(Conta), 'default')
+            self.assertEqual(roteador.db_for_write(Conta), 'default')
+
+    def test_replica_recusa_escrita(self):
+        with self.assertRaises(OperationalError):
+            Conta.objects.using('replica').filter(pk=self.conta.pk).update(limite=0)
+
+    def test_transacao_so_de_leitura_nao_fixa_no_primario(self):
+        # BEGIN IMMEDIATE, SAVEPOINT e RELEASE nao sao escritas
+        estado = EstadoRequisicao()
+        token = _estado_requisicao.set(estado)
+        try:
+            with transaction.atomic(), transaction.atomic():
+                Conta.objects.count()
+            self.assertFalse(estado.escreveu)
+            Conta.objects.filter(pk=self.conta.pk).update(limite=0)
+            self.assertTrue(estado.escreveu)
+        finally:
+            _estado_requisicao.reset(token)
+
+    def test_asgi_fixa_no_primario_sem_sair_do_loop(self):
+        async def requisicoes():
+            cliente = AsyncClient()
+            leitura = await cliente.get(reverse('api_conta', args=[self.conta.numero]))
+            escrita = await cliente.post(
+                reverse('api_deposito', args=[self.conta.numero]), {'valor': '10'}, content_type='application/json'
+            )
+            return leitura, escrita
+
+        # A view sincrona roda em outra thread; a escrita dela chega ao estado da requisicao
+        leitura, escrita = async_to_sync(requisicoes)()
+        self.assertNotIn(COOKIE_FIXACAO, leitura.cookies)
+        self.assertIn(COOKIE_FIXACAO, escrita.cookies)
+        self.assertTrue(assincrono(RoteamentoMiddleware))
+
+
+@override_settings(SHARDING={'SHARDS': ['default', 'shard1'], 'FAIXA_NUMEROS': 100_000_000})
+class ShardingTest(TransactionTestCase):
+    """Contas em dois shards: roteamento, diretorio PIX e saga entre shards"""
+    databases = {'default', 'shard1'}
+
+    def setUp(self):
+        resolvedor_pix.limpar()
+        cache_fragmentos.cache.clear()
+        preparar_sequencias('shard1')
+        self.ana = criar_conta('Ana Souza', saldo='100.00', limite='0.00')
+        self.bruno = criar_conta('Bruno Lima', banco='shard1')
+
+    def test_conta_nova_vai_para_o_shard_do_cpf(self):
+        cpf = next(f'{n:011d}' for n in itertools.count(900) if shard_para_cpf(f'{n:011d}') == 'shard1')
+        resposta = self.client.post(reverse('criar_conta'), {
+            'nome': 'Carla Dias', 'email': 'carla@exemplo.com', 'cpf': cpf, 'data_nascimento': '1990-01-01',
+        })
+
+        conta = Conta.objects.using('shard1').get(cliente__cpf=cpf)
+        self.assertGreaterEqual(conta.numero, 100_000_000)
+        self.assertRedirects(resposta, reverse('conta_detail', args=[conta.numero]))
+        self.assertContains(self.client.get(reverse('conta_detail', args=[conta.numero])), 'Carla Dias')
+        self.assertEqual(self.bruno.banco, 'shard1')
+
+    def test_transferencia_entre_shards(self):
+        sucesso, _ = self.ana.transferir(self.bruno, Decimal('30.00'))
+
+        self.assertTrue(sucesso)
+        self.bruno.refresh_from_db()
+        self.assertEqual((self.ana.saldo, self.bruno.saldo), (Decimal('70.00'), Decimal('30.00')))
+        transferencia = TransferenciaEntreShards.objects.get()
+        self.assertEqual(transferencia.estado, TransferenciaEntreShards.CONCLUIDA)
+        entrada = Transacao.objects.using('shard1').get(transferencia=transferencia.id)
+        self.assertEqual((entrada.conta_id, entrada.conta_destino_id), (self.ana.numero, self.bruno.numero))
+        # Repetir a segunda etapa nao credita de novo
+        transferencia.estado = TransferenciaEntreShards.PENDENTE
+        transferencia.concluir()
+        self.assertEqual(Conta.objects.using('shard1').get().saldo, Decimal('30.00'))
+        self.assertContains(self.client.get(reverse('extrato', args=[self.bruno.numero])), 'Recebido da conta')
+
+    def test_pix_resolve_pelo_diretorio(self):
+        self.bruno.chaves_pix.create(tipo_chave='EMAIL', chave='bruno@pix.com')
+
+        self.assertEqual(DiretorioPix.objects.get().conta_numero, self.bruno.numero)
+        sucesso, _, destino = self.ana.transferir_pix('bruno@pix.com', Decimal('10.00'))
+        self.assertTrue(sucesso)
+        self.assertEqual(destino.nome, 'Bruno Lima')
+        self.assertEqual(Conta.objects.using('shard1').get().saldo, Decimal('10.00'))
+        resposta = self.client.post(
+            reverse('cadastrar_chave_pix', args=[self.ana.numero]), {'tipo_chave': 'EMAIL', 'chave': 'bruno@pix.com'}
+        )
+        self.assertFormError(resposta.context['form'], 'chave', 'Chave PIX com este Chave PIX já existe.')
+
+    def test_pix_para_outro_shard_passa_pelo_antifraude_no_commit(self):
+        self.bruno.chaves_pix.create(tipo_chave='EMAIL', chave='bruno@pix.com')
+
+        with mock.patch('contas.models.motor_antifraude', MotorAntifraude({'PIX_POR_MINUTO': 1})):
+            self.assertTrue(self.ana.transferir_pix('bruno@pix.com', Decimal('10.00'))[0])
+            recusado = self.ana.transferir_pix('bruno@pix.com', Decimal('10.00'))
+
+        self.assertEqual(recusado, (False, 'Muitos PIX em sequencia, aguarde alguns minutos!', None))
+        self.assertEqual(TransferenciaEntreShards.objects.count(), 1)
+
+    def test_reconciliar_diretorio_pix(self):
+        self.bruno.chaves_pix.create(tipo_chave='EMAIL', chave='bruno@pix.com')
+        self.ana.chaves_pix.create(tipo_chave='EMAIL', chave='ana@pix.com')
+        # Falhas entre os commits do shard e do default
+        DiretorioPix.objects.filter(chave='bruno@pix.com').delete()
+        DiretorioPix.objects.create(chave='sem-chave@pix.com', conta_numero=self.bruno.numero, nome='Bruno Lima')
+        DiretorioPix.objects.filter(chave='ana@pix.com').update(nome='Nome antigo')
+
+        # Entrada recente sem chave pode ser de uma chave ainda em gravacao no shard
+        saida = StringIO()
+        call_command('reconciliar_diretorio_pix', stdout=saida)
+        self.assertIn('1 chaves sem entrada, 1 entradas divergentes e 0 entradas sem chave corrigidas', saida.getvalue())
+        self.assertTrue(DiretorioPix.objects.filter(chave='sem-chave@pix.com').exists())
+
+        DiretorioPix.objects.filter(chave='sem-chave@pix.com').update(criado_em=timezone.now() - timedelta(hours=1))
+        saida = StringIO()
+        call_command('reconciliar_diretorio_pix', verificar=True, stdout=saida)
+        self.assertIn('0 chaves sem entrada, 0 entradas divergentes e 1 entradas sem chave encontradas', saida.getvalue())
+        call_command('reconciliar_diretorio_pix', stdout=StringIO())
+        self.assertEqual(
+            sorted(DiretorioPix.objects.values_list('chave', 'conta_numero', 'nome')),
+            [('ana@pix.com', self.ana.numero, 'Ana Souza'), ('bruno@pix.com', self.bruno.numero, 'Bruno Lima')],
+        )
+
+    def test_reconciliar_nao_troca_a_conta_de_uma_entrada(self):
+        self.ana.chaves_pix.create(tipo_chave='EMAIL', chave='repetida@pix.com')
+        # A mesma chave no outro shard, gravada sem passar pelo diretorio
+        ChavePix.objects.using('shard1').bulk_create([
+            ChavePix(conta_id=self.bruno.numero, tipo_chave='EMAIL', chave='repetida@pix.com'),
+        ])
+
+        erros = StringIO()
+        call_command('reconciliar_diretorio_pix', stdout=StringIO(), stderr=erros)
+
+        self.assertIn('1 chaves cadastradas em uma conta com a entrada do diretorio apontando para outra', erros.getvalue())
+        self.assertEqual(DiretorioPix.objects.get(chave='repetida@pix.com').conta_numero, self.ana.numero)
+
+    def test_destino_inexistente_e_estornado(self):
+        self.ana._enviar_para_outro_shard(150_000_000, Decimal('40.00'), 'T', 'Transferência para conta 150000000')
+
+        self.ana.refresh_from_db()
+        self.assertEqual(self.ana.saldo, Decimal('100.00'))
+        self.assertEqual(TransferenciaEntreShards.objects.get().estado, TransferenciaEntreShards.ESTORNADA)
+        self.assertEqual(Transacao.objects.filter(tipo='E').get().valor, Decimal('40.00'))
+        saida = StringIO()
+        call_command('rebuild_balances', '--verificar', stdout=saida)
+        self.assertIn('2 contas verificadas, 0 divergencias', saida.getvalue())
+
+
+class SqliteTest(TestCase):
+    """Perfil de producao do SQLite aplicado pelo hook connection_created"""
+
+    def test_pragmas_aplicados_na_conexao(self):
+        with connection.cursor() as cursor:
+            valores = {
+                pragma: cursor.execute(f'PRAGMA {pragma}').fetchone()[0]
+                for pragma in ('journal_mode', 'synchronous', 'busy_timeout', 'temp_store')
+            }
+        self.assertEqual(valores, {'journal_mode': 'wal', 'synchronous': 1, 'busy_timeout': 20000, 'temp_store': 2})
+        self.assertEqual(connection.transaction_mode, 'IMMEDIATE')
+
+
+class BenchmarkTest(TestCase):
+    """Comparacao entre execucoes do manage.py bench"""
+
+    def test_comparar_detecta_regressoes(self):
+        base = [
+            {'item': 'conta:sacar', 'clientes': 1, 'p95_ms': 10.0, 'operacoes_por_segundo': 200},
+            {'item': 'conta:sacar', 'clientes': 8, 'p95_ms': 50.0, 'operacoes_por_segundo': 100},
+        ]
+        atual = [
+            {'item': 'conta:sacar', 'clientes': 1, 'p95_ms': 11.0, 'operacoes_por_segundo': 250},
+            {'item': 'conta:sacar', 'clientes': 8, 'p95_ms': 40.0, 'operacoes_por_segundo': 70},
+            {'item': 'conta:depositar', 'clientes': 1, 'p95_ms': 99.0, 'operacoes_por_segundo': 1},
+        ]
+
+        self.assertEqual(comparar(base, atual, tolerancia=0.2), [
+            {'item': 'conta:sacar', 'clientes': 8, 'metrica': 'operacoes_por_segundo', 'antes': 100, 'depois': 70},
+            {'item': 'conta:depositar', 'clientes': 1, 'metrica': 'linha', 'antes': 'ausente', 'depois': 'presente'},
+        ])
+
+    def test_comparar_casa_linhas_pelos_campos_de_identidade(self):
+        base = [
+            {'perfil': 'padrao', 'journal_mode': 'delete', 'clientes': 4, 'erros_lock': 3, 'p95_ms': 10.0},
+            {'perfil': 'producao', 'journal_mode': 'wal', 'clientes': 4, 'erros_lock': 0, 'p95_ms': 5.0},
+            {'modo': 'cache', 'taxa_acerto': 0.9, 'consultas_por_segundo': 1000},
+        ]
+        # Campos que nao identificam a linha mudaram; a linha do cache sumiu
+        atual = [
+            {'perfil': 'padrao', 'journal_mode': 'wal', 'clientes': 4, 'erros_lock': 0, 'p95_ms': 20.0},
+            {'perfil': 'producao', 'journal_mode': 'wal', 'clientes': 4, 'erros_lock': 1, 'p95_ms': 5.0},
+        ]
+
+        self.assertEqual(comparar(base, atual, tolerancia=0.2), [
+            {'perfil': 'padrao', 'clientes': 4, 'metrica': 'p95_ms', 'antes': 10.0, 'depois': 20.0},
+            {'modo': 'cache', 'metrica': 'linha', 'antes': 'presente', 'depois': 'ausente'},
+        ])
+
+
+class ApiTest(BancoTestCase):
+    """API JSON de contas e operacoes"""
+
+    def setUp(self):
+        super().setUp()
+        self.ana = criar_conta('Ana Souza', saldo='100.00')
+        self.bruno = criar_conta('Bruno Lima')
+
+    def post(self, nome_url, dados, *args):
+        url = reverse(nome_url, args=args or [self.ana.numero])
+        return self.client.post(url, dados, content_type='application/json')
+
+    def test_consulta_conta(self):
+        dados = self.client.get(reverse('api_conta', args=[self.ana.numero])).json()
+
+        self.assertEqual(dados['cliente']['nome'], 'Ana Souza')
+        self.assertEqual((dados['saldo'], dados['saldo_total']), ('100.00', '200.00'))
+        self.assertEqual(self.client.get(reverse('api_conta', args=[999999])).status_code, 404)
+
+    def test_operacoes(self):
+        self.assertEqual(self.post('api_deposito', {'valor': '10,50'}).json()['saldo'], '110.50')
+        self.assertEqual(self.post('api_saque', {'valor': '20.50'}).json()['saldo'], '90.00')
+
+        resposta = self.post('api_transferencia', {'conta_destino': self.bruno.numero, 'valor': '500'})
+        self.assertEqual(resposta.status_code, 422)
+        self.assertEqual(resposta.json()['mensagem'], 'Transferência não realizada. Saldo insuficiente!')
+        self.assertEqual(self.post('api_transferencia', {'conta_destino': 'x', 'valor': '1'}).status_code, 400)
+        self.assertEqual(self.post('api_saque', {'valor': 'abc'}).status_code, 400)
+        for valor in ('1e20', '0.004'):
+            self.assertEqual(self.post('api_deposito', {'valor': valor}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('api_conta', args=[self.ana.numero])).json()['saldo'], '90.00')
+
+        criada = self.post('api_chaves', {'tipo_chave': 'ALEATORIA'}, self.bruno.numero)
+        self.assertEqual(criada.status_code, 201)
+        chave = criada.json()['chave']
+        pix = self.post('api_pix', {'chave_pix': chave['chave'], 'valor': '40'}).json()
+        self.assertEqual(pix['destino'], {'numero': self.bruno.numero, 'nome': 'Bruno Lima'})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.post('api_desativar_chave', {}, self.bruno.numero, chave['id'])
+        self.assertEqual(self.post('api_pix', {'chave_pix': chave['chave'], 'valor': '1'}).status_code, 422)
+
+    def test_leituras_sao_assincronas_e_paginam(self):
+        for _ in range(25):
+            self.ana.transferir(self.bruno, Decimal('1.00'))
+
+        async def ler():
+            cliente = AsyncClient()
+            primeira = (await cliente.get(reverse('api_extrato', args=[self.bruno.numero]))).json()
+            segunda = (await cliente.get(
+                reverse('api_extrato', args=[self.bruno.numero]), {'cursor': primeira['proximo_cursor']}
+            )).json()
+            chaves = (await cliente.get(reverse('api_chaves', args=[self.bruno.numero]))).json()
+            vazio = await cliente.get(reverse('api_extrato', args=[self.bruno.numero]), {'cursor': ''})
+            invalido = await cliente.get(reverse('api_extrato', args=[self.bruno.numero]), {'cursor': 'invalido'})
+            self.assertEqual((vazio.status_code, invalido.status_code), (200, 400))
+            self.assertEqual(vazio.json(), primeira)
+            return primeira, segunda, chaves
+
+        primeira, segunda, chaves = async_to_sync(ler)()
+        self.assertEqual((len(primeira['transacoes']), len(segunda['transacoes'])), (20, 5))
+        self.assertTrue(all(transacao['entrada'] for transacao in primeira['transacoes']))
+        self.assertIsNone(segunda['proximo_cursor'])
+        self.assertEqual(chaves, {'chaves': []})
+
+
+class NumeroDeConsultasTest(BancoTestCase):
+    """Listagens e detalhes fazem o mesmo numero de consultas qualquer que seja o volume"""
+
+    def setUp(self):
+        super().setUp()
+        self.conta = criar_conta('Ana Souza', saldo='1000.00')
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@exemplo.com', 'senha'))
+        self.povoar(2)
+
+    def povoar(self, quantidade):
+        """Cria contas com chave PIX e movimenta a conta principal com cada uma"""
+        for _ in range(quantidade):
+            outra = criar_conta(f'Cliente {Conta.objects.count()}')
+            chave = ChavePix.objects.create(conta=outra, tipo_chave='ALEATORIA', chave=ChavePix.gerar_chave_aleatoria())
+            ChavePix.objects.create(conta=self.conta, tipo_chave='ALEATORIA', chave=ChavePix.gerar_chave_aleatoria())
+            self.conta.transferir(outra, Decimal('1.00'))
+            self.conta.transferir_pix(chave.chave, Decimal('1.00'))
+            outra.transferir(self.conta, Decimal('1.00'))
+
+    def contar_consultas(self, url):
+        # Sem trechos em cache: mede o caminho que consulta o banco
+        cache_fragmentos.cache.clear()
+        with CaptureQueriesContext(connection) as consultas:
+            resposta = self.client.get(url)
+        self.assertEqual(resposta.status_code, 200)
+        return len(consultas)
+
+    def assertConsultasConstantes(self, nome_url, *args):
+        url = reverse(nome_url, args=args)
+        antes = self.contar_consultas(url)
+        self.povoar(5)
+        self.assertEqual(self.contar_consultas(url), antes, f'{url} faz consultas por linha')
+
+    def test_lista_de_contas(self):
+        self.assertConsultasConstantes('conta_list')
+
+    def test_detalhe_da_conta(self):
+        self.assertConsultasConstantes('conta_detail', self.conta.numero)
+
+    def test_extrato(self):
+        self.assertConsultasConstantes('extrato', self.conta.numero)
+
+    def test_chaves_pix(self):
+        self.assertConsultasConstantes('listar_chaves_pix', self.conta.numero)
+
+    def test_admin(self):
+        for modelo in ('cliente', 'conta', 'transacao', 'chavepix', 'lancamento'):
+            with self.subTest(modelo=modelo):
+                self.assertConsultasConstantes(f'admin:contas_{modelo}_changelist')
+
+
+class ConcorrenciaTransferenciasTest(TransactionTestCase):
+    """Transferencias concorrentes nao podem perder atualizacoes de saldo"""
+
+    THREADS = 8
+    TRANSFERENCIAS_POR_THREAD = 50
+
+    def test_transferencias_cruzadas_mantem_saldos_exatos(self):
+        contas = [criar_conta(f'Cliente {i}', saldo='1000.00', limite='0.00') for i in range(4)]
+        erros = []
+
+        def trabalhador(indice):
+            try:
+                for n in range(self.TRANSFERENCIAS_POR_THREAD):
+                    origem = contas[(indice + n) % len(contas)]
+                    destino = contas[(indice + n + 1) % len(contas)]
+                    # Instancias novas simulam workers diferentes com dados defasados
+                    Conta.objects.get(pk=origem.pk).transferir(Conta.objects.get(pk=destino.pk), Decimal('1.00'))
+            except Exception as exc:  # pragma: no cover - reportado abaixo
+                erros.append(exc)
+            finally:
+                close_old_connections()
+                connection.close()
+
+        threads = [threading.Thread(target=trabalhador, args=(i,)) for i in range(self.THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(erros, [])
+        total = sum(Conta.objects.values_list('saldo', flat=True), Decimal('0.00'))
+        self.assertEqual(total, Decimal('4000.00'))
+        self.assertEqual(
+            Transacao.objects.count(),
+            self.THREADS * self.TRANSFERENCIAS_POR_THREAD,
+        )
@@ -1,54 +1,213 @@
+import csv
+
+from django.conf import settings
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
 from django.shortcuts import render, redirect, get_object_or_404
+from django.views.decorators.csrf import csrf_exempt, csrf_protect
+from django.views.decorators.http import require_POST
 from django.contrib import messages
+from django.utils.dateparse import parse_date
+from django.utils.decorators import method_decorator
 from django.views.generic import ListView, DetailView, CreateView
 from django.urls import reverse_lazy
-from .models import Cliente, Conta, Transacao, ChavePix
+from . import estatisticas, outbox
+from .models import Cliente, Conta, ChavePix, Estatistica, Transacao, VolumeDiario
+from .extrato import pagina_extrato, decodificar_cursor
+from .exportacao import FORMATOS, periodo_extrato
+from .fragmentos import cache_fragmentos
+from .lote import ler_lote, processar_lote, token_valido
+from .perfil import registro_perfil
+from .roteador import somente_leitura
+from .saldos import inicio_do_dia, saldo_em
+from .shards import banco_da_conta, em_todos_os_shards, no_shard_da_conta, shard_para_cpf
 from .forms import ClienteForm, ContaForm, DepositoForm, SaqueForm, TransferenciaForm, ChavePixForm, PixForm
+from datetime import timedelta
 from decimal import Decimal
 
 
+def _obter_conta(pk):
+    """Busca a conta, no shard dela, ja com o cliente exibido em todas as paginas da conta"""
+    return get_object_or_404(no_shard_da_conta(Conta.objects.select_related('cliente'), pk), pk=pk)
+
+
+def _chave_idempotencia(request, form):
+    """Chave enviada no cabecalho Idempotency-Key ou no campo oculto do formulario"""
+    return request.headers.get('Idempotency-Key') or form.cleaned_data.get('chave_idempotencia')
+
+
+@somente_leitura
 def home(request):
     """View para página inicial"""
-    total_contas = Conta.objects.count()
-    total_clientes = Cliente.objects.count()
+    # Contadores pre-calculados: nao varre as tabelas de clientes e contas
+    contadores = estatisticas.painel()
+    vazio = Estatistica()
     context = {
-        'total_contas': total_contas,
-        'total_clientes': total_clientes,
+        'total_contas': contadores.get(estatisticas.CONTAS, vazio).quantidade,
+        'total_clientes': contadores.get(estatisticas.CLIENTES, vazio).quantidade,
     }
     return render(request, 'contas/home.html', context)
 
 
+@somente_leitura
+def metricas(request):
+    """View com os volumes movimentados, lidos das estatisticas pre-calculadas"""
+    contadores = estatisticas.painel()
+    vazio = Estatistica()
+    volumes_por_tipo = [
+        (descricao, contadores.get(estatisticas.nome_volume(tipo), vazio))
+        for tipo, descricao in Transacao.TIPO_CHOICES
+    ]
+    context = {
+        'total_contas': contadores.get(estatisticas.CONTAS, vazio).quantidade,
+        'total_clientes': contadores.get(estatisticas.CLIENTES, vazio).quantidade,
+        'volumes_por_tipo': volumes_por_tipo,
+        'volumes_diarios': VolumeDiario.objects.all()[:30 * len(Transacao.TIPO_CHOICES)],
+        'atualizado_em': contadores.get(estatisticas.ULTIMA_TRANSACAO, vazio).atualizado_em,
+    }
+    return render(request, 'contas/metricas.html', context)
+
+
+def metricas_prometheus(request):
+    """Metricas de perfil das requisicoes, atraso do outbox e cache de trechos no formato texto do Prometheus"""
+    if not getattr(settings, 'PERFIL_REQUISICOES', {}).get('ATIVO'):
+        raise Http404('Perfil de requisicoes desativado')
+    texto = registro_perfil.prometheus() + outbox.prometheus() + cache_fragmentos.prometheus()
+    return HttpResponse(texto, content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+@method_decorator(somente_leitura, name='dispatch')
 class ContaListView(ListView):
     """View para listar todas as contas"""
     model = Conta
     template_name = 'contas/conta_list.html'
     context_object_name = 'contas'
     paginate_by = 10
+    # So os numeros da pagina; as linhas vem do cache de trechos
+    queryset = Conta.objects.values_list('numero', flat=True)
+
+    def get_queryset(self):
+        return em_todos_os_shards(super().get_queryset())
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['linhas'] = cache_fragmentos.renderizar_lista('linha_conta', list(context['contas']), self.contas_por_numero)
+        return context
+
+    def contas_por_numero(self, numeros):
+        """Contexto da linha de cada conta que faltou no cache, uma consulta por shard"""
+        por_banco = {}
+        for numero in numeros:
+            por_banco.setdefault(banco_da_conta(numero), []).append(numero)
+        return {
+            conta.numero: {'conta': conta}
+            for banco, numeros_do_banco in por_banco.items()
+            for conta in Conta.objects.using(banco).select_related('cliente')
+            .only('numero', 'saldo', 'limite', 'cliente__nome', 'cliente__cpf').filter(numero__in=numeros_do_banco)
+        }
 
 
+FRAGMENTOS_CONTA = ('cliente', 'saldos', 'transacoes')
+
+
+@method_decorator(somente_leitura, name='dispatch')
 class ContaDetailView(DetailView):
     """View para detalhar uma conta específica"""
     model = Conta
     template_name = 'contas/conta_detail.html'
     context_object_name = 'conta'
+    queryset = Conta.objects.select_related('cliente')
+
+    def get_queryset(self):
+        return no_shard_da_conta(super().get_queryset(), self.kwargs['pk'])
+
+    def get(self, request, *args, **kwargs):
+        # A conta so e lida do banco se faltar algum trecho no cache ou para o saldo historico
+        self.object = None
+        numero = self.kwargs['pk']
+        context = self.get_context_data(
+            numero=numero,
+            fragmentos=cache_fragmentos.renderizar(numero, FRAGMENTOS_CONTA, self.contexto_fragmentos),
+        )
+        return self.render_to_response(context)
+
+    def contexto_fragmentos(self):
+        conta = self.obter_conta()
+        return {'conta': conta, 'transacoes': conta.transacoes.all()[:10]}
+
+    def obter_conta(self):
+        if self.object is None:
+            self.object = self.get_object()
+        return self.object
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['transacoes'] = self.object.transacoes.all()[:10]
+        # Saldo historico: ?data=AAAA-MM-DD mostra o saldo no fim daquele dia
+        data = self.request.GET.get('data')
+        if data:
+            try:
+                dia = parse_date(data)
+            except ValueError:
+                dia = None
+            if dia is None:
+                context['erro_data'] = 'Data invalida!'
+            else:
+                saldo, limite = saldo_em(self.obter_conta(), inicio_do_dia(dia + timedelta(days=1)))
+                context['saldo_historico'] = {'data': dia, 'saldo': saldo, 'limite': limite}
         return context
 
 
+@somente_leitura
+def extrato(request, pk):
+    """View para o extrato completo, paginado por cursor"""
+    conta = _obter_conta(pk)
+
+    cursor = request.GET.get('cursor') or None
+    if cursor:
+        cursor = decodificar_cursor(cursor)
+        if cursor is None:
+            raise Http404('Cursor de extrato invalido')
+
+    transacoes, proximo_cursor = pagina_extrato(conta, cursor)
+    context = {
+        'conta': conta,
+        'transacoes': transacoes,
+        'proximo_cursor': proximo_cursor,
+        'primeira_pagina': cursor is None,
+    }
+    return render(request, 'contas/extrato.html', context)
+
+
+@somente_leitura
+def exportar_extrato(request, pk):
+    """View para baixar o extrato em CSV ou OFX, gerado aos poucos (streaming)"""
+    conta = get_object_or_404(no_shard_da_conta(Conta.objects, pk), pk=pk)
+
+    formato = request.GET.get('formato', 'csv')
+    if formato not in FORMATOS:
+        raise Http404('Formato de extrato desconhecido')
+    try:
+        inicio, fim = periodo_extrato(request.GET.get('inicio'), request.GET.get('fim'))
+    except ValueError:
+        raise Http404('Periodo de extrato invalido')
+
+    gerador, content_type = FORMATOS[formato]
+    resposta = StreamingHttpResponse(gerador(conta, inicio, fim), content_type=content_type)
+    resposta['Content-Disposition'] = f'attachment; filename="extrato-{conta.numero}.{formato}"'
+    return resposta
+
+
 def criar_conta(request):
     """View para criar uma nova conta"""
     if request.method == 'POST':
         cliente_form = ClienteForm(request.POST)
         if cliente_form.is_valid():
             try:
-                # Cria o cliente
-                cliente = cliente_form.save()
+                # Cria o cliente no shard escolhido pelo CPF
+                cliente = cliente_form.save(commit=False)
+                cliente.save(using=shard_para_cpf(cliente.cpf))
 
-                # Cria a conta para o cliente
-                conta = Conta.objects.create(cliente=cliente)
+                # Cria a conta para o cliente, no mesmo shard
+                conta = Conta.objects.using(cliente._state.db).create(cliente=cliente)
 
                 messages.success(request, f'Conta {conta.numero} criada com sucesso para {cliente.nome}!')
                 return redirect('conta_detail', pk=conta.numero)
@@ -62,7 +221,7 @@ def criar_conta(request):
 
 def efetuar_deposito(request, pk):
     """View para efetuar depósito"""
-    conta = get_object_or_404(Conta, pk=pk)
+    conta = _obter_conta(pk)
 
     if request.method == 'POST':
         form = DepositoForm(request.POST)
@@ -72,16 +231,9 @@ def efetuar_deposito(request, pk):
             valor_str = valor_str.replace(',', '.')
             valor = Decimal(valor_str)
 
-            sucesso, mensagem = conta.depositar(valor)
+            sucesso, mensagem = conta.depositar(valor, chave_idempotencia=_chave_idempotencia(request, form))
 
             if sucesso:
-                # Registra a transação
-                Transacao.objects.create(
-                    conta=conta,
-                    tipo='D',
-                    valor=valor,
-                    descricao='Depósito em conta'
-                )
                 messages.success(request, mensagem)
             else:
                 messages.error(request, mensagem)
@@ -95,7 +247,7 @@ def efetuar_deposito(request, pk):
 
 def efetuar_saque(request, pk):
     """View para efetuar saque"""
-    conta = get_object_or_404(Conta, pk=pk)
+    conta = _obter_conta(pk)
 
     if request.method == 'POST':
         form = SaqueForm(request.POST)
@@ -105,16 +257,9 @@ def efetuar_saque(request, pk):
             valor_str = valor_str.replace(',', '.')
             valor = Decimal(valor_str)
 
-            sucesso, mensagem = conta.sacar(valor)
+            sucesso, mensagem = conta.sacar(valor, chave_idempotencia=_chave_idempotencia(request, form))
 
             if sucesso:
-                # Registra a transação
-                Transacao.objects.create(
-                    conta=conta,
-                    tipo='S',
-                    valor=valor,
-                    descricao='Saque em conta'
-                )
                 messages.success(request, mensagem)
             else:
                 messages.error(request, mensagem)
@@ -128,7 +273,7 @@ def efetuar_saque(request, pk):
 
 def efetuar_transferencia(request, pk):
     """View para efetuar transferência"""
-    conta_origem = get_object_or_404(Conta, pk=pk)
+    conta_origem = _obter_conta(pk)
 
     if request.method == 'POST':
         form = TransferenciaForm(request.POST)
@@ -140,22 +285,16 @@ def efetuar_transferencia(request, pk):
             valor = Decimal(valor_str)
 
             try:
-                conta_destino = Conta.objects.get(numero=numero_destino)
+                conta_destino = no_shard_da_conta(Conta.objects, numero_destino).get(numero=numero_destino)
 
                 if conta_origem.numero == conta_destino.numero:
                     messages.error(request, 'Não é possível transferir para a mesma conta!')
                 else:
-                    sucesso, mensagem = conta_origem.transferir(conta_destino, valor)
+                    sucesso, mensagem = conta_origem.transferir(
+                        conta_destino, valor, chave_idempotencia=_chave_idempotencia(request, form)
+                    )
 
                     if sucesso:
-                        # Registra a transação
-                        Transacao.objects.create(
-                            conta=conta_origem,
-                            tipo='T',
-                            valor=valor,
-                            conta_destino=conta_destino,
-                            descricao=f'Transferência para conta {conta_destino.numero}'
-                        )
                         messages.success(request, mensagem)
                     else:
                         messages.error(request, mensagem)
@@ -171,7 +310,7 @@ def efetuar_transferencia(request, pk):
 
 def cadastrar_chave_pix(request, pk):
     """View para cadastrar chave PIX"""
-    conta = get_object_or_404(Conta, pk=pk)
+    conta = _obter_conta(pk)
 
     if request.method == 'POST':
         form = ChavePixForm(request.POST)
@@ -195,9 +334,10 @@ def cadastrar_chave_pix(request, pk):
     return render(request, 'contas/cadastrar_chave_pix.html', {'form': form, 'conta': conta})
 
 
+@somente_leitura
 def listar_chaves_pix(request, pk):
     """View para listar chaves PIX de uma conta"""
-    conta = get_object_or_404(Conta, pk=pk)
+    conta = _obter_conta(pk)
     chaves = conta.chaves_pix.all()
 
     return render(request, 'contas/listar_chaves_pix.html', {'conta': conta, 'chaves': chaves})
@@ -205,7 +345,7 @@ def listar_chaves_pix(request, pk):
 
 def efetuar_pix(request, pk):
     """View para efetuar transferencia via PIX"""
-    conta = get_object_or_404(Conta, pk=pk)
+    conta = _obter_conta(pk)
 
     if request.method == 'POST':
         form = PixForm(request.POST)
@@ -216,19 +356,12 @@ def efetuar_pix(request, pk):
             valor_str = valor_str.replace(',', '.')
             valor = Decimal(valor_str)
 
-            sucesso, mensagem, conta_destino = conta.transferir_pix(chave_pix, valor)
+            sucesso, mensagem, destino = conta.transferir_pix(
+                chave_pix, valor, chave_idempotencia=_chave_idempotencia(request, form)
+            )
 
             if sucesso:
-                # Registra a transacao
-                Transacao.objects.create(
-                    conta=conta,
-                    tipo='P',
-                    valor=valor,
-                    conta_destino=conta_destino,
-                    chave_pix=chave_pix,
-                    descricao=f'PIX para {conta_destino.cliente.nome}'
-                )
-                messages.success(request, f'{mensagem} Destinatario: {conta_destino.cliente.nome}')
+                messages.success(request, f'{mensagem} Destinatario: {destino.nome}')
             else:
                 messages.error(request, mensagem)
 
@@ -241,11 +374,49 @@ def efetuar_pix(request, pk):
 
 def desativar_chave_pix(request, pk, chave_id):
     """View para desativar uma chave PIX"""
-    conta = get_object_or_404(Conta, pk=pk)
-    chave = get_object_or_404(ChavePix, pk=chave_id, conta=conta)
+    conta = _obter_conta(pk)
+    chave = get_object_or_404(conta.chaves_pix, pk=chave_id)
 
     chave.ativa = False
     chave.save()
     messages.success(request, 'Chave PIX desativada com sucesso!')
 
     return redirect('listar_chaves_pix', pk=conta.numero)
+
+
+@csrf_exempt
+@require_POST
+def lote_pagamentos(request):
+    """View para pagamentos em lote (integracao com sistemas de folha de pagamento).
+
+    Recebe um arquivo CSV ou JSON no campo "arquivo" e devolve em JSON o
+    resultado de cada linha. Cada linha debita a conta "origem" informada,
+    entao so aceita o sistema integrado (Authorization: Bearer com um dos
+    TOKENS de LOTE_PAGAMENTOS) ou um usuario staff logado, este com CSRF.
+    """
+    if token_valido(request):
+        return _executar_lote(request)
+    if request.user.is_authenticated and request.user.is_staff:
+        return csrf_protect(_executar_lote)(request)
+    return JsonResponse({'erro': 'Lote de pagamentos exige token de integracao ou usuario staff.'}, status=403)
+
+
+def _executar_lote(request):
+    arquivo = request.FILES.get('arquivo')
+    if arquivo is None:
+        return JsonResponse({'erro': 'Envie o arquivo do lote no campo "arquivo".'}, status=400)
+
+    formato = request.POST.get('formato') or ('json' if arquivo.name.lower().endswith('.json') else 'csv')
+    try:
+        itens = ler_lote(arquivo, formato)
+    except (ValueError, csv.Error) as erro:
+        return JsonResponse({'erro': f'Arquivo de lote invalido: {erro}'}, status=400)
+
+    relatorio = processar_lote(itens)
+    efetuados = sum(1 for linha in relatorio if linha['sucesso'])
+    return JsonResponse({
+        'total': len(relatorio),
+        'efetuados': efetuados,
+        'recusados': len(relatorio) - efetuados,
+        'linhas': relatorio,
+    })